@@ -0,0 +1,791 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+r"""
+Stage level performance benchmark of the Wan pipelines.
+
+The real `generate` of the task pipeline (`WanT2V`, `WanI2V`, `WanTI2V`,
+`WanS2V` or `WanAnimate`) is run, and its stages are timed through hooks on the
+pipeline's own modules: tokenization, T5 encode, CLIP / audio encode, VAE
+encode, DiT forward (single branch, or the batched CFG pass), scheduler step,
+VAE decode and video write. The pipeline is built from checkpoints
+(`--ckpt_dir`), or for t2v-A14B, i2v-A14B and ti2v-5B from tiny randomly
+initialised modules (`--tiny`, the default without a checkpoint). Results and
+peak memory are written as JSON, and a previous report can be given with
+`--compare` to flag regressions. It replaces the whole-run subprocess timing
+of `GenVidIM/benchmark.py`, which now forwards here.
+
+    # CPU regression run with scaled-down models
+    python benchmark.py --task ti2v-5B --tiny --device cpu --report out.json
+    python benchmark.py --task ti2v-5B --tiny --device cpu --compare out.json
+"""
+import argparse
+import copy
+import functools
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+from easydict import EasyDict
+from PIL import Image
+
+from wan import WanAnimate, WanI2V, WanS2V, WanT2V, WanTI2V
+from wan.configs import SIZE_CONFIGS, WAN_CONFIGS
+from wan.modules.attention import set_attention_backend
+from wan.modules.model import WanModel
+from wan.modules.t5 import T5Encoder, T5EncoderModel
+from wan.modules.tokenizers import HuggingfaceTokenizer
+from wan.modules.vae2_1 import Wan2_1_VAE
+from wan.modules.vae2_1 import WanVAE_ as WanVAE21
+from wan.modules.vae2_2 import Wan2_2_VAE
+from wan.modules.vae2_2 import WanVAE_ as WanVAE22
+from wan.utils.fm_solvers import FlowDPMSolverMultistepScheduler
+from wan.utils.fm_solvers_device import (
+    FlowDPMSolverDeviceScheduler,
+    FlowUniPCDeviceScheduler,
+)
+from wan.utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
+from wan.utils.video_writer import VideoWriter
+
+BENCHMARK_PIPELINES = {
+    't2v-A14B': WanT2V,
+    'i2v-A14B': WanI2V,
+    'ti2v-5B': WanTI2V,
+    's2v-14B': WanS2V,
+    'animate-14B': WanAnimate,
+}
+BENCHMARK_TASKS = list(BENCHMARK_PIPELINES)
+
+# pipelines whose VAE decode streams into the video writer
+STREAMING_TASKS = ('t2v-A14B', 'i2v-A14B', 'ti2v-5B')
+
+# DiT attributes of the pipelines
+DIT_ATTRS = ('model', 'low_noise_model', 'high_noise_model', 'noise_model')
+
+# (pipeline attribute, method, stage) of the timed host side methods
+STAGE_METHODS = (
+    ('vae', 'encode', 'vae_encode'),
+    ('vae', 'decode', 'vae_decode'),
+    ('clip', 'visual', 'clip_encode'),
+    ('audio_encoder', 'extract_audio_feat', 'audio_encode'),
+)
+
+SCHEDULERS = (FlowUniPCMultistepScheduler, FlowDPMSolverMultistepScheduler,
+              FlowUniPCDeviceScheduler, FlowDPMSolverDeviceScheduler)
+
+_TINY_T5 = dict(
+    vocab=1024,
+    dim=64,
+    dim_attn=64,
+    dim_ffn=128,
+    num_heads=4,
+    num_layers=2,
+    num_buckets=32,
+    shared_pos=False,
+    dropout=0.0)
+
+# scaled-down model shapes; strides and patch sizes stay those of the task
+TINY_CONFIGS = {
+    't2v-A14B':
+        EasyDict(
+            t5=_TINY_T5,
+            vae=dict(dim=8, z_dim=16, temperal_downsample=[False, True, True]),
+            dit=dict(
+                model_type='t2v',
+                in_dim=16,
+                out_dim=16,
+                dim=64,
+                ffn_dim=128,
+                text_dim=64,
+                num_heads=4,
+                num_layers=2)),
+    'i2v-A14B':
+        EasyDict(
+            t5=_TINY_T5,
+            vae=dict(dim=8, z_dim=16, temperal_downsample=[False, True, True]),
+            dit=dict(
+                model_type='i2v',
+                # noise latent + 4 mask channels + image latent
+                in_dim=36,
+                out_dim=16,
+                dim=64,
+                ffn_dim=128,
+                text_dim=64,
+                num_heads=4,
+                num_layers=2)),
+    'ti2v-5B':
+        EasyDict(
+            t5=_TINY_T5,
+            vae=dict(
+                dim=8,
+                dec_dim=8,
+                z_dim=48,
+                temperal_downsample=[False, True, True]),
+            dit=dict(
+                model_type='ti2v',
+                in_dim=48,
+                out_dim=48,
+                dim=64,
+                ffn_dim=128,
+                text_dim=64,
+                num_heads=4,
+                num_layers=2)),
+}
+
+
+class StageTimer:
+
+    def __init__(self, device):
+        r"""
+        Collects wall-clock durations per named stage. CUDA work is
+        synchronized at the stage boundaries so asynchronous kernels are
+        attributed to the stage that launched them. Re-entering a stage that
+        is already running, e.g. a scheduler `step` calling its parent class,
+        is counted once.
+        """
+        self.device = torch.device(device)
+        self.times = defaultdict(list)
+        self._open = {}
+
+    def _sync(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    def start(self, name):
+        depth, start = self._open.get(name, (0, None))
+        if depth == 0:
+            self._sync()
+            start = time.perf_counter()
+        self._open[name] = (depth + 1, start)
+
+    def stop(self, name):
+        depth, start = self._open.pop(name)
+        if depth > 1:
+            self._open[name] = (depth - 1, start)
+            return
+        self._sync()
+        self.times[name].append(time.perf_counter() - start)
+
+    @contextmanager
+    def stage(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def timed(self, fn, name):
+        r"""
+        Wraps the callable `fn` so that every call is timed as `name`.
+        """
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    def reset(self):
+        self.times.clear()
+        self._open.clear()
+
+    def summary(self):
+        out = {}
+        for name, values in self.times.items():
+            values = sorted(values)
+            out[name] = dict(
+                count=len(values),
+                total_s=sum(values),
+                mean_s=sum(values) / len(values),
+                median_s=values[len(values) // 2],
+                min_s=values[0],
+                max_s=values[-1])
+        return out
+
+
+class _TimedCall:
+
+    def __init__(self, obj, timer, name):
+        r"""
+        Proxy timing calls of `obj` as `name`. Attribute access is forwarded,
+        so it can replace e.g. a tokenizer in place.
+        """
+        self._obj = obj
+        self._timer = timer
+        self._name = name
+
+    def __call__(self, *args, **kwargs):
+        with self._timer.stage(self._name):
+            return self._obj(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._obj, name)
+
+
+def _dit_stage(module, args, kwargs):
+    x = args[0] if args else kwargs.get('x')
+    return 'dit_cfg' if isinstance(x, (list, tuple)) and len(x) > 1 else 'dit'
+
+
+@contextmanager
+def instrument(pipeline, timer):
+    r"""
+    Times the stages of `pipeline` in `timer` while the context is active.
+
+    Modules are timed with forward hooks, host side methods are wrapped on the
+    instance and the scheduler `step` is wrapped on the solver classes, since
+    `generate` creates its scheduler per call. Everything is restored on exit.
+    """
+    handles, restore = [], []
+
+    def hook_module(module, name):
+        if name is None:
+
+            def pre_hook(m, args, kwargs):
+                stage = _dit_stage(m, args, kwargs)
+                stages.append(stage)
+                timer.start(stage)
+
+            def post_hook(m, args, kwargs, output):
+                timer.stop(stages.pop())
+
+            stages = []
+        else:
+
+            def pre_hook(m, args, kwargs):
+                timer.start(name)
+
+            def post_hook(m, args, kwargs, output):
+                timer.stop(name)
+
+        handles.append(
+            module.register_forward_pre_hook(pre_hook, with_kwargs=True))
+        handles.append(
+            module.register_forward_hook(post_hook, with_kwargs=True))
+
+    def wrap(obj, attr, value):
+        had_attr = attr in vars(obj)
+        old = vars(obj).get(attr)
+        setattr(obj, attr, value)
+        restore.append(lambda: setattr(obj, attr, old)
+                       if had_attr else delattr(obj, attr))
+
+    text_encoder = getattr(pipeline, 'text_encoder', None)
+    if text_encoder is not None:
+        wrap(text_encoder, 'tokenizer',
+             _TimedCall(text_encoder.tokenizer, timer, 'tokenize'))
+        hook_module(text_encoder.model, 't5_encode')
+
+    for attr in DIT_ATTRS:
+        module = getattr(pipeline, attr, None)
+        if isinstance(module, torch.nn.Module):
+            hook_module(module, None)
+
+    for attr, method, name in STAGE_METHODS:
+        obj = getattr(pipeline, attr, None)
+        if obj is not None and hasattr(obj, method):
+            wrap(obj, method, timer.timed(getattr(obj, method), name))
+
+    for cls in SCHEDULERS:
+        if 'step' in vars(cls):
+            step = vars(cls)['step']
+            setattr(cls, 'step', timer.timed(step, 'scheduler_step'))
+            restore.append(functools.partial(setattr, cls, 'step', step))
+
+    try:
+        yield
+    finally:
+        for handle in handles:
+            handle.remove()
+        for fn in reversed(restore):
+            fn()
+
+
+class RandomTokenizer:
+
+    def __init__(self, vocab, seq_len):
+        r"""
+        Stand-in for `HuggingfaceTokenizer` in tiny runs: every text maps to
+        fixed random token ids of a length derived from the text.
+        """
+        self.vocab = vocab
+        self.seq_len = seq_len
+        self.clean = None
+
+    def __call__(self, sequence, return_mask=False, **kwargs):
+        if isinstance(sequence, str):
+            sequence = [sequence]
+        lens = [min(self.seq_len, 8 + zlib.crc32(u.encode()) % 40)
+                for u in sequence]
+        ids = torch.zeros(len(sequence), max(lens), dtype=torch.long)
+        mask = torch.zeros_like(ids)
+        for i, (text, n) in enumerate(zip(sequence, lens)):
+            g = torch.Generator().manual_seed(zlib.crc32(text.encode()))
+            ids[i, :n] = torch.randint(1, self.vocab, (n,), generator=g)
+            mask[i, :n] = 1
+        return (ids, mask) if return_mask else ids
+
+
+def tiny_pipeline(task, config, device, tokenizer=None):
+    r"""
+    Builds the real pipeline class of `task` around tiny randomly initialised
+    T5, VAE and DiT modules, setting the attributes its `__init__` would set
+    after loading the checkpoints.
+
+    Args:
+        task (`str`):
+            One of `TINY_CONFIGS`.
+        config (EasyDict):
+            Task config.
+        device (`torch.device`):
+            Device to run on, CPU is supported.
+        tokenizer (`str`, *optional*, defaults to None):
+            Tokenizer name or path. None uses `RandomTokenizer`.
+    """
+    shapes = TINY_CONFIGS[task]
+    cls = BENCHMARK_PIPELINES[task]
+    pipeline = cls.__new__(cls)
+    pipeline.config = config
+    pipeline.device = device
+    pipeline.rank = 0
+    pipeline.t5_cpu = False
+    pipeline.init_on_cpu = False
+    pipeline.offload_blocks = None
+    pipeline.block_streamers = []
+    pipeline.num_train_timesteps = config.num_train_timesteps
+    pipeline.boundary = config.get('boundary', None)
+    pipeline.param_dtype = (
+        config.param_dtype if device.type == 'cuda' else torch.float32)
+    pipeline.sp_size = 1
+    pipeline.vae_stride = config.vae_stride
+    pipeline.patch_size = config.patch_size
+    pipeline.sample_neg_prompt = config.sample_neg_prompt
+
+    text_encoder = T5EncoderModel.__new__(T5EncoderModel)
+    text_encoder.text_len = config.text_len
+    text_encoder.dtype = torch.float32
+    text_encoder.device = device
+    text_encoder.checkpoint_path = None
+    text_encoder.tokenizer_path = tokenizer
+    text_encoder.cache = None
+    text_encoder.quantize = None
+    text_encoder.model = T5Encoder(**shapes.t5).eval().requires_grad_(False)
+    text_encoder.tokenizer = RandomTokenizer(
+        shapes.t5['vocab'],
+        config.text_len) if tokenizer is None else HuggingfaceTokenizer(
+            name=tokenizer,
+            seq_len=config.text_len,
+            clean='whitespace',
+            pad_bucket=config.t5_pad_bucket)
+    pipeline.text_encoder = text_encoder
+
+    if task == 'ti2v-5B':
+        vae_cls, vae = WanVAE22, Wan2_2_VAE.__new__(Wan2_2_VAE)
+    else:
+        vae_cls, vae = WanVAE21, Wan2_1_VAE.__new__(Wan2_1_VAE)
+    z_dim = shapes.vae['z_dim']
+    vae.dtype = torch.float
+    vae.device = device
+    vae.scale = [
+        torch.zeros(z_dim, device=device),
+        torch.ones(z_dim, device=device)
+    ]
+    vae.model = vae_cls(**shapes.vae).eval().requires_grad_(False).to(device)
+    pipeline.vae = vae
+
+    def dit():
+        return WanModel(
+            patch_size=config.patch_size,
+            text_len=config.text_len,
+            freq_dim=config.freq_dim,
+            **shapes.dit).eval().requires_grad_(False).to(device)
+
+    if pipeline.boundary is not None:
+        pipeline.low_noise_model = dit()
+        pipeline.high_noise_model = dit()
+    else:
+        pipeline.model = dit()
+    return pipeline
+
+
+def checkpoint_pipeline(task, config, ckpt_dir, device, t5_cpu,
+                        convert_model_dtype):
+    r"""
+    Builds the pipeline of `task` from `ckpt_dir` the way generate.py does.
+    """
+    assert device.type == 'cuda', 'checkpoint runs need a CUDA device'
+    return BENCHMARK_PIPELINES[task](
+        config=config,
+        checkpoint_dir=ckpt_dir,
+        device_id=device.index or 0,
+        rank=0,
+        t5_cpu=t5_cpu,
+        convert_model_dtype=convert_model_dtype)
+
+
+def load_image(path, size):
+    r"""
+    Opens `path`, or returns a random image of `size` for 'random'.
+    """
+    if path != 'random':
+        return Image.open(path).convert('RGB')
+    w, h = size
+    rng = np.random.RandomState(0)
+    return Image.fromarray(rng.randint(0, 256, (h, w, 3), dtype=np.uint8))
+
+
+def generate(pipeline, task, args, size, frame_num, sample_steps, shift, img,
+             timer, save_file=None):
+    r"""
+    Runs one generation with the pipeline's own `generate`. t2v / i2v / ti2v
+    stream the decoded chunks into the writer during the VAE decode, so the
+    'video_write' stage is the encoder tail after decoding. s2v and animate
+    return the finished video, which is written in that stage.
+    """
+    common = dict(
+        shift=shift,
+        sample_solver=args.sample_solver,
+        sampling_steps=sample_steps,
+        guide_scale=args.sample_guide_scale,
+        seed=args.base_seed,
+        offload_model=args.offload_model,
+        batch_cfg=args.batch_cfg)
+    max_area = size[0] * size[1]
+    fps = pipeline.config.sample_fps
+
+    writer = None
+    if save_file is not None and task in STREAMING_TASKS:
+        writer = VideoWriter(save_file, fps=fps)
+    try:
+        if task == 't2v-A14B':
+            video = pipeline.generate(
+                args.prompt,
+                size=size,
+                frame_num=frame_num,
+                video_writer=writer,
+                **common)
+        elif task == 'i2v-A14B':
+            video = pipeline.generate(
+                args.prompt,
+                img,
+                max_area=max_area,
+                frame_num=frame_num,
+                video_writer=writer,
+                **common)
+        elif task == 'ti2v-5B':
+            video = pipeline.generate(
+                args.prompt,
+                img=img,
+                size=size,
+                max_area=max_area,
+                frame_num=frame_num,
+                video_writer=writer,
+                **common)
+        elif task == 's2v-14B':
+            video = pipeline.generate(
+                input_prompt=args.prompt,
+                ref_image_path=args.image,
+                audio_path=args.audio,
+                enable_tts=False,
+                tts_prompt_audio=None,
+                tts_prompt_text=None,
+                tts_text=None,
+                max_area=max_area,
+                infer_frames=frame_num,
+                **common)
+        else:
+            video = pipeline.generate(
+                src_root_path=args.src_root_path,
+                clip_len=frame_num,
+                input_prompt=args.prompt,
+                **common)
+
+        if writer is not None:
+            with timer.stage('video_write'):
+                writer.close()
+        elif save_file is not None:
+            with timer.stage('video_write'):
+                with VideoWriter(save_file, fps=fps) as out:
+                    out.write(video)
+    finally:
+        if writer is not None:
+            writer.close()
+    return video
+
+
+def peak_memory(device):
+    r"""
+    Peak memory of the process in bytes: allocated CUDA memory on GPU and the
+    resident set size of the process on CPU.
+    """
+    out = {
+        'cpu_max_rss_bytes':
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss *
+            (1 if sys.platform == 'darwin' else 1024)
+    }
+    if device.type == 'cuda':
+        out['cuda_max_allocated_bytes'] = torch.cuda.max_memory_allocated(
+            device)
+        out['cuda_max_reserved_bytes'] = torch.cuda.max_memory_reserved(device)
+    return out
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_reports(report, baseline, tolerance):
+    r"""
+    Logs the per-stage mean time ratio against `baseline` and returns the names
+    of stages that got slower by more than `tolerance` (e.g. 0.1 = 10%).
+    """
+    regressions = []
+    for name, stats in report['stages'].items():
+        if name not in baseline.get('stages', {}):
+            continue
+        base = baseline['stages'][name]['mean_s']
+        ratio = stats['mean_s'] / base if base > 0 else float('inf')
+        logging.info(f"{name:>16}: {stats['mean_s'] * 1000:9.2f}ms "
+                     f"vs {base * 1000:9.2f}ms ({ratio:.2f}x)")
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def _validate_args(args):
+    args.tiny = args.tiny or args.ckpt_dir is None
+    if args.tiny:
+        assert args.task in TINY_CONFIGS, \
+            f"{args.task} has no tiny configuration, pass --ckpt_dir"
+    if args.task == 'i2v-A14B' and args.image is None:
+        args.image = 'random'
+    if args.task == 's2v-14B':
+        assert args.image not in (None, 'random') and args.audio is not None, \
+            "s2v-14B needs --image and --audio"
+    if args.task == 'animate-14B':
+        assert args.src_root_path is not None, \
+            "animate-14B needs the preprocessed --src_root_path"
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Per-stage performance benchmark of the Wan pipelines.")
+    parser.add_argument(
+        "--task", type=str, default="ti2v-5B", choices=BENCHMARK_TASKS)
+    parser.add_argument(
+        "--ckpt_dir",
+        type=str,
+        default=None,
+        help="Checkpoint directory. Without it tiny random models are used.")
+    parser.add_argument(
+        "--tiny",
+        action="store_true",
+        default=False,
+        help="Force tiny randomly initialised models.")
+    parser.add_argument(
+        "--tokenizer",
+        type=str,
+        default=None,
+        help="Tokenizer for tiny runs; random token ids are used if omitted.")
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument(
+        "--size",
+        type=str,
+        default=None,
+        help="'width*height', for image conditioned tasks it bounds the pixel "
+        "area. Defaults to 1280*704 with checkpoints and 256*128 for tiny "
+        "models.")
+    parser.add_argument(
+        "--prompt", type=str, default="A cat wearing a wizard hat")
+    parser.add_argument("--frame_num", type=int, default=None)
+    parser.add_argument("--sample_steps", type=int, default=None)
+    parser.add_argument("--sample_shift", type=float, default=None)
+    parser.add_argument("--sample_guide_scale", type=float, default=5.0)
+    parser.add_argument(
+        "--sample_solver",
+        type=str,
+        default="unipc",
+        choices=["unipc", "dpm++"])
+    parser.add_argument("--base_seed", type=int, default=42)
+    parser.add_argument(
+        "--image",
+        type=str,
+        default=None,
+        help="Conditioning image of i2v-A14B, ti2v-5B and s2v-14B, or "
+        "'random' for a random image of --size. i2v-A14B defaults to 'random'.")
+    parser.add_argument(
+        "--audio", type=str, default=None, help="s2v-14B driving audio.")
+    parser.add_argument(
+        "--src_root_path",
+        type=str,
+        default=None,
+        help="animate-14B preprocessed inputs.")
+    parser.add_argument("--batch_cfg", action="store_true", default=False)
+    parser.add_argument(
+        "--device_scheduler",
+        action="store_true",
+        default=False,
+        help="Use the device resident solvers.")
+    parser.add_argument(
+        "--offload_model",
+        action="store_true",
+        default=False,
+        help="Offload models to CPU between stages, as generate.py does on "
+        "a single GPU.")
+    parser.add_argument("--t5_cpu", action="store_true", default=False)
+    parser.add_argument(
+        "--convert_model_dtype", action="store_true", default=False)
+    parser.add_argument(
+        "--attn_backend",
+        type=str,
+        default="auto",
+        choices=["auto", "fa3", "fa2", "sdpa", "chunked"])
+    parser.add_argument(
+        "--warmup", type=int, default=1, help="Untimed runs before timing.")
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument(
+        "--no_video_write",
+        action="store_true",
+        default=False,
+        help="Skip the video write stage.")
+    parser.add_argument(
+        "--report", type=str, default=None, help="Write the JSON report here.")
+    parser.add_argument(
+        "--compare",
+        type=str,
+        default=None,
+        help="Baseline JSON report to compare against.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Allowed relative slowdown per stage with --compare.")
+    args = parser.parse_args()
+    _validate_args(args)
+    return args
+
+
+def main():
+    args = _parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+        handlers=[logging.StreamHandler(stream=sys.stdout)])
+
+    device = torch.device(args.device)
+    assert device.type == 'cuda' or not args.offload_model, \
+        "--offload_model needs a CUDA device"
+    cfg = copy.deepcopy(WAN_CONFIGS[args.task])
+    cfg.attn_backend = args.attn_backend
+    cfg.device_scheduler = args.device_scheduler
+    if args.size is None:
+        size = (256, 128) if args.tiny else SIZE_CONFIGS['1280*704']
+    else:
+        size = tuple(int(v) for v in args.size.split('*'))
+    frame_num = args.frame_num or (9 if args.tiny else cfg.frame_num)
+    sample_steps = args.sample_steps or (4 if args.tiny else cfg.sample_steps)
+    shift = args.sample_shift if args.sample_shift is not None else cfg.sample_shift
+    img = None
+    if args.image is not None and args.task in ('i2v-A14B', 'ti2v-5B'):
+        img = load_image(args.image, size)
+
+    torch.manual_seed(0)
+    if args.tiny:
+        set_attention_backend(args.attn_backend, device)
+        pipeline = tiny_pipeline(args.task, cfg, device, args.tokenizer)
+    else:
+        pipeline = checkpoint_pipeline(args.task, cfg, args.ckpt_dir, device,
+                                       args.t5_cpu, args.convert_model_dtype)
+    # every run encodes its prompts, instead of hitting the embedding cache
+    # filled by the warmup
+    pipeline.text_encoder.cache = None
+
+    timer = StageTimer(device)
+    with instrument(pipeline, timer), tempfile.TemporaryDirectory() as tmp:
+        save_file = None if args.no_video_write else os.path.join(
+            tmp, 'benchmark.mp4')
+        run_kwargs = dict(
+            size=size,
+            frame_num=frame_num,
+            sample_steps=sample_steps,
+            shift=shift,
+            img=img,
+            timer=timer,
+            save_file=save_file)
+        for _ in range(args.warmup):
+            generate(pipeline, args.task, args, **run_kwargs)
+        timer.reset()
+        if device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(device)
+
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            generate(pipeline, args.task, args, **run_kwargs)
+        total = (time.perf_counter() - start) / args.repeats
+
+    report = dict(
+        meta=dict(
+            task=args.task,
+            mode='tiny' if args.tiny else 'checkpoint',
+            device=str(device),
+            device_name=torch.cuda.get_device_name(device)
+            if device.type == 'cuda' else platform.processor(),
+            torch=torch.__version__,
+            commit=git_commit(),
+            size=list(size),
+            frame_num=frame_num,
+            sample_steps=sample_steps,
+            sample_solver=args.sample_solver,
+            image=args.image,
+            batch_cfg=args.batch_cfg,
+            device_scheduler=args.device_scheduler,
+            offload_model=args.offload_model,
+            attn_backend=args.attn_backend,
+            repeats=args.repeats),
+        total_s=total,
+        stages=timer.summary(),
+        peak_memory=peak_memory(device))
+
+    for name, stats in report['stages'].items():
+        logging.info(f"{name:>16}: {stats['count']:4d} x "
+                     f"{stats['mean_s'] * 1000:9.2f}ms "
+                     f"(total {stats['total_s']:.3f}s)")
+    logging.info(f"Total per run: {total:.3f}s, peak memory: "
+                 f"{report['peak_memory']}")
+
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        logging.info(f"Report written to {args.report}")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_reports(report, baseline, args.tolerance)
+        if regressions:
+            logging.error(f"Slower than baseline: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
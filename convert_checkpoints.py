@@ -0,0 +1,140 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+r"""
+Converts the pickled T5, VAE and CLIP checkpoints of a Wan checkpoint directory
+to safetensors. The converted files are written next to the originals and are
+picked up automatically by the loaders, which memory-map them instead of
+unpickling into host RAM.
+
+    python convert_checkpoints.py --ckpt_dir ./Wan2.2-T2V-A14B
+
+With --quantize, the DiT of --task is additionally written as a weight-only
+int8 / int4 checkpoint, used by `generate.py --dit_quant_bits`.
+
+    python convert_checkpoints.py --ckpt_dir ./Wan2.2-T2V-A14B --task t2v-A14B --quantize 8
+"""
+import argparse
+import logging
+import os
+import sys
+
+from wan.configs import WAN_CONFIGS
+from wan.modules.animate import WanAnimateModel
+from wan.modules.checkpoint import convert_checkpoint
+from wan.modules.model import WanModel
+from wan.modules.quant import save_quantized
+from wan.modules.s2v.model_s2v import WanModel_S2V
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Convert Wan .pth checkpoints to safetensors")
+    parser.add_argument(
+        "--ckpt_dir",
+        type=str,
+        required=True,
+        help="The path to the checkpoint directory.")
+    parser.add_argument(
+        "--files",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Checkpoint files to convert, relative to ckpt_dir. Defaults to "
+        "every T5 / VAE / CLIP checkpoint referenced by the configs.")
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        default=False,
+        help="Re-convert files that already have a safetensors copy.")
+    parser.add_argument(
+        "--remove_source",
+        action="store_true",
+        default=False,
+        help="Delete the .pth file after a successful conversion.")
+    parser.add_argument(
+        "--task",
+        type=str,
+        default=None,
+        choices=list(WAN_CONFIGS.keys()),
+        help="The task whose DiT is quantized with --quantize.")
+    parser.add_argument(
+        "--quantize",
+        type=int,
+        default=None,
+        choices=[8, 4],
+        help="Also write a weight-only quantized DiT checkpoint with this many bits.")
+    parser.add_argument(
+        "--group_size",
+        type=int,
+        default=None,
+        help="Input channels sharing a quantization scale. Defaults to one scale per output channel."
+    )
+    args = parser.parse_args()
+    assert args.quantize is None or args.task is not None, \
+        "--quantize needs --task."
+    return args
+
+
+def dit_models(task):
+    r"""
+    DiT class and checkpoint subfolders of `task`.
+    """
+    cfg = WAN_CONFIGS[task]
+    if "s2v" in task:
+        return WanModel_S2V, [None]
+    if "animate" in task:
+        return WanAnimateModel, [None]
+    if cfg.get('low_noise_checkpoint'):
+        return WanModel, [cfg.low_noise_checkpoint, cfg.high_noise_checkpoint]
+    return WanModel, [None]
+
+
+def default_files():
+    files = set()
+    for cfg in WAN_CONFIGS.values():
+        for key in ('t5_checkpoint', 'vae_checkpoint', 'clip_checkpoint'):
+            if cfg.get(key):
+                files.add(cfg[key])
+    return sorted(files)
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+        handlers=[logging.StreamHandler(stream=sys.stdout)])
+    args = _parse_args()
+
+    files = args.files if args.files is not None else default_files()
+    for name in files:
+        src = os.path.join(args.ckpt_dir, name)
+        dst = os.path.splitext(src)[0] + '.safetensors'
+        if not os.path.exists(src):
+            if args.files is not None:
+                logging.warning(f"{src} does not exist, skipping.")
+            continue
+        if os.path.exists(dst) and not args.overwrite:
+            logging.info(f"{dst} already exists, skipping.")
+            continue
+        logging.info(f"Converting {src} -> {dst}")
+        convert_checkpoint(src, dst)
+        if args.remove_source:
+            os.remove(src)
+
+    if args.quantize is not None:
+        model_cls, subfolders = dit_models(args.task)
+        for subfolder in subfolders:
+            logging.info(
+                f"Quantizing {model_cls.__name__} in {args.ckpt_dir} "
+                f"{subfolder or ''} to int{args.quantize}")
+            dst = save_quantized(
+                model_cls,
+                args.ckpt_dir,
+                subfolder=subfolder,
+                bits=args.quantize,
+                group_size=args.group_size)
+            logging.info(f"Wrote {dst}")
+    logging.info("Finished.")
+
+
+if __name__ == "__main__":
+    main()
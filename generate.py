@@ -18,7 +18,9 @@ import wan
 from wan.configs import MAX_AREA_CONFIGS, SIZE_CONFIGS, SUPPORTED_SIZES, WAN_CONFIGS
 from wan.distributed.util import init_distributed_group
 from wan.utils.prompt_extend import DashScopePromptExpander, QwenPromptExpander
-from wan.utils.utils import merge_video_audio, save_video, str2bool
+from wan.utils.regional_compile import set_compile_cache_dir
+from wan.utils.utils import str2bool
+from wan.utils.video_writer import VideoWriter
 
 
 EXAMPLE_PROMPT = {
@@ -151,6 +153,104 @@ def _parse_args():
         action="store_true",
         default=False,
         help="Whether to place T5 model on CPU.")
+    parser.add_argument(
+        "--t5_quant",
+        type=str,
+        default=None,
+        choices=["int8"],
+        help="Run the T5 encoder with dynamically quantized int8 linear layers. Only used with --t5_cpu; the converted encoder is cached next to the checkpoint."
+    )
+    parser.add_argument(
+        "--t5_cache_dir",
+        type=str,
+        default=None,
+        help="Directory to persist prompt embeddings in, so repeated prompts skip the T5 encoder across runs."
+    )
+    parser.add_argument(
+        "--vae_tile_size",
+        type=int,
+        default=None,
+        help="Decode (and encode) the VAE in overlapping spatial tiles of this many latent pixels to reduce peak memory."
+    )
+    parser.add_argument(
+        "--vae_tile_overlap",
+        type=int,
+        default=8,
+        help="Overlap of neighbouring VAE tiles in latent pixels.")
+    parser.add_argument(
+        "--dit_quant_bits",
+        type=int,
+        default=None,
+        choices=[8, 4],
+        help="Run the DiT linear layers with weight-only int8 / int4 quantization. Uses a checkpoint written by convert_checkpoints.py --quantize if present, otherwise quantizes on load."
+    )
+    parser.add_argument(
+        "--dit_quant_group_size",
+        type=int,
+        default=None,
+        help="Input channels sharing a quantization scale. Defaults to one scale per output channel."
+    )
+    parser.add_argument(
+        "--offload_blocks",
+        type=int,
+        default=None,
+        help="Keep the DiT blocks of the A14B tasks in host memory and stream them to the GPU, with at most this many blocks resident."
+    )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        default=False,
+        help="Compile the DiT blocks with torch.compile, bucketing the sequence length to the supported sizes of the task."
+    )
+    parser.add_argument(
+        "--compile_mode",
+        type=str,
+        default=None,
+        help="torch.compile mode of the DiT blocks, e.g. max-autotune-no-cudagraphs.")
+    parser.add_argument(
+        "--compile_cache_dir",
+        type=str,
+        default=None,
+        help="Directory to persist compiled kernels in, so later runs skip recompilation."
+    )
+    parser.add_argument(
+        "--step_cache",
+        type=str,
+        default=None,
+        choices=["first_block", "timestep"],
+        help="Skip the DiT blocks of steps whose first block residual (first_block) or time modulation (timestep) barely changed, reusing the cached residual."
+    )
+    parser.add_argument(
+        "--step_cache_threshold",
+        type=float,
+        default=None,
+        help="Relative L1 change below which a step is skipped. Higher is faster at lower quality."
+    )
+    parser.add_argument(
+        "--step_cache_max_skips",
+        type=int,
+        default=None,
+        help="Maximum number of consecutive skipped steps per guidance branch."
+    )
+    parser.add_argument(
+        "--step_cache_warmup_steps",
+        type=int,
+        default=None,
+        help="Steps always computed in full at the start of every guidance branch."
+    )
+    parser.add_argument(
+        "--attn_backend",
+        type=str,
+        default=None,
+        choices=["auto", "fa3", "fa2", "sdpa", "chunked"],
+        help="Attention kernel used by the DiT. Defaults to the config value ('auto')."
+    )
+    parser.add_argument(
+        "--attn_benchmark",
+        action="store_true",
+        default=False,
+        help="With --attn_backend auto, time the available attention kernels at startup and use the fastest."
+    )
     parser.add_argument(
         "--dit_fsdp",
         action="store_true",
@@ -204,6 +304,12 @@ def _parse_args():
         default='unipc',
         choices=['unipc', 'dpm++'],
         help="The solver used to sample.")
+    parser.add_argument(
+        "--device_scheduler",
+        action="store_true",
+        default=False,
+        help="Use the device resident variant of the solver, whose coefficients are precomputed for the whole schedule."
+    )
     parser.add_argument(
         "--sample_steps", type=int, default=None, help="The sampling steps.")
     parser.add_argument(
@@ -216,11 +322,37 @@ def _parse_args():
         type=float,
         default=None,
         help="Classifier free guidance scale.")
+    parser.add_argument(
+        "--cfg_interval",
+        type=float,
+        nargs=2,
+        default=None,
+        metavar=("LOW", "HIGH"),
+        help="Only apply classifier free guidance while t / num_train_timesteps is within [LOW, HIGH]."
+    )
+    parser.add_argument(
+        "--cfg_every",
+        type=int,
+        default=None,
+        help="Run the unconditional pass every k steps and reuse the guidance delta in between."
+    )
+    parser.add_argument(
+        "--cfg_adaptive_threshold",
+        type=float,
+        default=None,
+        help="Drop the unconditional pass once its cosine similarity to the conditional prediction reaches this value, e.g. 0.99."
+    )
     parser.add_argument(
         "--convert_model_dtype",
         action="store_true",
         default=False,
         help="Whether to convert model paramerters dtype.")
+    parser.add_argument(
+        "--batch_cfg",
+        action="store_true",
+        default=False,
+        help="Whether to run the conditional and unconditional passes of classifier free guidance as one batched forward."
+    )
 
     # animate
     parser.add_argument(
@@ -359,6 +491,45 @@ def generate(args):
                 f"Unsupport prompt_extend_method: {args.prompt_extend_method}")
 
     cfg = WAN_CONFIGS[args.task]
+    if args.t5_cache_dir is not None:
+        cfg.t5_cache_dir = args.t5_cache_dir
+    if args.t5_quant is not None:
+        cfg.t5_quant = args.t5_quant
+    if args.attn_backend is not None:
+        cfg.attn_backend = args.attn_backend
+    if args.vae_tile_size is not None:
+        cfg.vae_tile_size = (args.vae_tile_size, args.vae_tile_size)
+        cfg.vae_tile_overlap = (args.vae_tile_overlap, args.vae_tile_overlap)
+    if args.attn_benchmark:
+        cfg.attn_benchmark = True
+    if args.offload_blocks is not None:
+        cfg.offload_blocks = args.offload_blocks
+    if args.compile:
+        cfg.compile_blocks = True
+        cfg.compile_mode = args.compile_mode
+        if args.compile_cache_dir is not None:
+            cfg.compile_cache_dir = args.compile_cache_dir
+        if cfg.compile_cache_dir is not None:
+            set_compile_cache_dir(cfg.compile_cache_dir)
+    if args.device_scheduler:
+        cfg.device_scheduler = True
+    if args.cfg_interval is not None:
+        cfg.cfg_interval = tuple(args.cfg_interval)
+    if args.cfg_every is not None:
+        cfg.cfg_every = args.cfg_every
+    if args.cfg_adaptive_threshold is not None:
+        cfg.cfg_adaptive_threshold = args.cfg_adaptive_threshold
+    if args.step_cache is not None:
+        cfg.step_cache = args.step_cache
+        if args.step_cache_threshold is not None:
+            cfg.step_cache_threshold = args.step_cache_threshold
+        if args.step_cache_max_skips is not None:
+            cfg.step_cache_max_skips = args.step_cache_max_skips
+        if args.step_cache_warmup_steps is not None:
+            cfg.step_cache_warmup_steps = args.step_cache_warmup_steps
+    if args.dit_quant_bits is not None:
+        cfg.dit_quant_bits = args.dit_quant_bits
+        cfg.dit_quant_group_size = args.dit_quant_group_size
     if args.ulysses_size > 1:
         assert cfg.num_heads % args.ulysses_size == 0, f"`{cfg.num_heads=}` cannot be divided evenly by `{args.ulysses_size=}`."
 
@@ -400,166 +571,182 @@ def generate(args):
         args.prompt = input_prompt[0]
         logging.info(f"Extended prompt: {args.prompt}")
 
-    if "t2v" in args.task:
-        logging.info("Creating WanT2V pipeline.")
-        wan_t2v = wan.WanT2V(
-            config=cfg,
-            checkpoint_dir=args.ckpt_dir,
-            device_id=device,
-            rank=rank,
-            t5_fsdp=args.t5_fsdp,
-            dit_fsdp=args.dit_fsdp,
-            use_sp=(args.ulysses_size > 1),
-            t5_cpu=args.t5_cpu,
-            convert_model_dtype=args.convert_model_dtype,
-        )
-
-        logging.info(f"Generating video ...")
-        video = wan_t2v.generate(
-            args.prompt,
-            size=SIZE_CONFIGS[args.size],
-            frame_num=args.frame_num,
-            shift=args.sample_shift,
-            sample_solver=args.sample_solver,
-            sampling_steps=args.sample_steps,
-            guide_scale=args.sample_guide_scale,
-            seed=args.base_seed,
-            offload_model=args.offload_model)
-    elif "ti2v" in args.task:
-        logging.info("Creating WanTI2V pipeline.")
-        wan_ti2v = wan.WanTI2V(
-            config=cfg,
-            checkpoint_dir=args.ckpt_dir,
-            device_id=device,
-            rank=rank,
-            t5_fsdp=args.t5_fsdp,
-            dit_fsdp=args.dit_fsdp,
-            use_sp=(args.ulysses_size > 1),
-            t5_cpu=args.t5_cpu,
-            convert_model_dtype=args.convert_model_dtype,
-        )
-
-        logging.info(f"Generating video ...")
-        video = wan_ti2v.generate(
-            args.prompt,
-            img=img,
-            size=SIZE_CONFIGS[args.size],
-            max_area=MAX_AREA_CONFIGS[args.size],
-            frame_num=args.frame_num,
-            shift=args.sample_shift,
-            sample_solver=args.sample_solver,
-            sampling_steps=args.sample_steps,
-            guide_scale=args.sample_guide_scale,
-            seed=args.base_seed,
-            offload_model=args.offload_model)
-    elif "animate" in args.task:
-        logging.info("Creating Wan-Animate pipeline.")
-        wan_animate = wan.WanAnimate(
-            config=cfg,
-            checkpoint_dir=args.ckpt_dir,
-            device_id=device,
-            rank=rank,
-            t5_fsdp=args.t5_fsdp,
-            dit_fsdp=args.dit_fsdp,
-            use_sp=(args.ulysses_size > 1),
-            t5_cpu=args.t5_cpu,
-            convert_model_dtype=args.convert_model_dtype,
-            use_relighting_lora=args.use_relighting_lora
-        )
-
-        logging.info(f"Generating video ...")
-        video = wan_animate.generate(
-            src_root_path=args.src_root_path,
-            replace_flag=args.replace_flag,
-            refert_num = args.refert_num,
-            clip_len=args.frame_num,
-            shift=args.sample_shift,
-            sample_solver=args.sample_solver,
-            sampling_steps=args.sample_steps,
-            guide_scale=args.sample_guide_scale,
-            seed=args.base_seed,
-            offload_model=args.offload_model)
-    elif "s2v" in args.task:
-        logging.info("Creating WanS2V pipeline.")
-        wan_s2v = wan.WanS2V(
-            config=cfg,
-            checkpoint_dir=args.ckpt_dir,
-            device_id=device,
-            rank=rank,
-            t5_fsdp=args.t5_fsdp,
-            dit_fsdp=args.dit_fsdp,
-            use_sp=(args.ulysses_size > 1),
-            t5_cpu=args.t5_cpu,
-            convert_model_dtype=args.convert_model_dtype,
-        )
-        logging.info(f"Generating video ...")
-        video = wan_s2v.generate(
-            input_prompt=args.prompt,
-            ref_image_path=args.image,
-            audio_path=args.audio,
-            enable_tts=args.enable_tts,
-            tts_prompt_audio=args.tts_prompt_audio,
-            tts_prompt_text=args.tts_prompt_text,
-            tts_text=args.tts_text,
-            num_repeat=args.num_clip,
-            pose_video=args.pose_video,
-            max_area=MAX_AREA_CONFIGS[args.size],
-            infer_frames=args.infer_frames,
-            shift=args.sample_shift,
-            sample_solver=args.sample_solver,
-            sampling_steps=args.sample_steps,
-            guide_scale=args.sample_guide_scale,
-            seed=args.base_seed,
-            offload_model=args.offload_model,
-            init_first_frame=args.start_from_ref,
-        )
-    else:
-        logging.info("Creating WanI2V pipeline.")
-        wan_i2v = wan.WanI2V(
-            config=cfg,
-            checkpoint_dir=args.ckpt_dir,
-            device_id=device,
-            rank=rank,
-            t5_fsdp=args.t5_fsdp,
-            dit_fsdp=args.dit_fsdp,
-            use_sp=(args.ulysses_size > 1),
-            t5_cpu=args.t5_cpu,
-            convert_model_dtype=args.convert_model_dtype,
-        )
-        logging.info("Generating video ...")
-        video = wan_i2v.generate(
-            args.prompt,
-            img,
-            max_area=MAX_AREA_CONFIGS[args.size],
-            frame_num=args.frame_num,
-            shift=args.sample_shift,
-            sample_solver=args.sample_solver,
-            sampling_steps=args.sample_steps,
-            guide_scale=args.sample_guide_scale,
-            seed=args.base_seed,
-            offload_model=args.offload_model)
-
-    if rank == 0:
-        if args.save_file is None:
-            formatted_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-            formatted_prompt = args.prompt.replace(" ", "_").replace("/",
-                                                                     "_")[:50]
-            suffix = '.mp4'
-            args.save_file = f"{args.task}_{args.size.replace('*','x') if sys.platform=='win32' else args.size}_{args.ulysses_size}_{formatted_prompt}_{formatted_time}" + suffix
-
+    if args.save_file is None:
+        formatted_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+        formatted_prompt = args.prompt.replace(" ", "_").replace("/",
+                                                                 "_")[:50]
+        suffix = '.mp4'
+        args.save_file = f"{args.task}_{args.size.replace('*','x') if sys.platform=='win32' else args.size}_{args.ulysses_size}_{formatted_prompt}_{formatted_time}" + suffix
+
+    # t2v / ti2v / i2v stream decoded chunks into the writer while the VAE is
+    # still decoding; s2v and animate hand over the finished video, and s2v
+    # only has its audio track after generation.
+    writer = None
+    if rank == 0 and not ("s2v" in args.task or "animate" in args.task):
         logging.info(f"Saving generated video to {args.save_file}")
-        save_video(
-            tensor=video[None],
-            save_file=args.save_file,
-            fps=cfg.sample_fps,
-            nrow=1,
-            normalize=True,
-            value_range=(-1, 1))
-        if "s2v" in args.task:
-            if args.enable_tts is False:
-                merge_video_audio(video_path=args.save_file, audio_path=args.audio)
-            else:
-                merge_video_audio(video_path=args.save_file, audio_path="tts.wav")
+        writer = VideoWriter(args.save_file, fps=cfg.sample_fps)
+
+    # the writer is closed even if generation fails, so ffmpeg is not left
+    # running
+    try:
+        if "t2v" in args.task:
+            logging.info("Creating WanT2V pipeline.")
+            wan_t2v = wan.WanT2V(
+                config=cfg,
+                checkpoint_dir=args.ckpt_dir,
+                device_id=device,
+                rank=rank,
+                t5_fsdp=args.t5_fsdp,
+                dit_fsdp=args.dit_fsdp,
+                use_sp=(args.ulysses_size > 1),
+                t5_cpu=args.t5_cpu,
+                convert_model_dtype=args.convert_model_dtype,
+            )
+
+            logging.info(f"Generating video ...")
+            video = wan_t2v.generate(
+                args.prompt,
+                size=SIZE_CONFIGS[args.size],
+                frame_num=args.frame_num,
+                shift=args.sample_shift,
+                sample_solver=args.sample_solver,
+                sampling_steps=args.sample_steps,
+                guide_scale=args.sample_guide_scale,
+                seed=args.base_seed,
+                offload_model=args.offload_model,
+                batch_cfg=args.batch_cfg,
+                video_writer=writer)
+        elif "ti2v" in args.task:
+            logging.info("Creating WanTI2V pipeline.")
+            wan_ti2v = wan.WanTI2V(
+                config=cfg,
+                checkpoint_dir=args.ckpt_dir,
+                device_id=device,
+                rank=rank,
+                t5_fsdp=args.t5_fsdp,
+                dit_fsdp=args.dit_fsdp,
+                use_sp=(args.ulysses_size > 1),
+                t5_cpu=args.t5_cpu,
+                convert_model_dtype=args.convert_model_dtype,
+            )
+
+            logging.info(f"Generating video ...")
+            video = wan_ti2v.generate(
+                args.prompt,
+                img=img,
+                size=SIZE_CONFIGS[args.size],
+                max_area=MAX_AREA_CONFIGS[args.size],
+                frame_num=args.frame_num,
+                shift=args.sample_shift,
+                sample_solver=args.sample_solver,
+                sampling_steps=args.sample_steps,
+                guide_scale=args.sample_guide_scale,
+                seed=args.base_seed,
+                offload_model=args.offload_model,
+                batch_cfg=args.batch_cfg,
+                video_writer=writer)
+        elif "animate" in args.task:
+            logging.info("Creating Wan-Animate pipeline.")
+            wan_animate = wan.WanAnimate(
+                config=cfg,
+                checkpoint_dir=args.ckpt_dir,
+                device_id=device,
+                rank=rank,
+                t5_fsdp=args.t5_fsdp,
+                dit_fsdp=args.dit_fsdp,
+                use_sp=(args.ulysses_size > 1),
+                t5_cpu=args.t5_cpu,
+                convert_model_dtype=args.convert_model_dtype,
+                use_relighting_lora=args.use_relighting_lora
+            )
+
+            logging.info(f"Generating video ...")
+            video = wan_animate.generate(
+                src_root_path=args.src_root_path,
+                replace_flag=args.replace_flag,
+                refert_num = args.refert_num,
+                clip_len=args.frame_num,
+                shift=args.sample_shift,
+                sample_solver=args.sample_solver,
+                sampling_steps=args.sample_steps,
+                guide_scale=args.sample_guide_scale,
+                seed=args.base_seed,
+                offload_model=args.offload_model,
+                batch_cfg=args.batch_cfg)
+        elif "s2v" in args.task:
+            logging.info("Creating WanS2V pipeline.")
+            wan_s2v = wan.WanS2V(
+                config=cfg,
+                checkpoint_dir=args.ckpt_dir,
+                device_id=device,
+                rank=rank,
+                t5_fsdp=args.t5_fsdp,
+                dit_fsdp=args.dit_fsdp,
+                use_sp=(args.ulysses_size > 1),
+                t5_cpu=args.t5_cpu,
+                convert_model_dtype=args.convert_model_dtype,
+            )
+            logging.info(f"Generating video ...")
+            video = wan_s2v.generate(
+                input_prompt=args.prompt,
+                ref_image_path=args.image,
+                audio_path=args.audio,
+                enable_tts=args.enable_tts,
+                tts_prompt_audio=args.tts_prompt_audio,
+                tts_prompt_text=args.tts_prompt_text,
+                tts_text=args.tts_text,
+                num_repeat=args.num_clip,
+                pose_video=args.pose_video,
+                max_area=MAX_AREA_CONFIGS[args.size],
+                infer_frames=args.infer_frames,
+                shift=args.sample_shift,
+                sample_solver=args.sample_solver,
+                sampling_steps=args.sample_steps,
+                guide_scale=args.sample_guide_scale,
+                seed=args.base_seed,
+                offload_model=args.offload_model,
+                init_first_frame=args.start_from_ref,
+                batch_cfg=args.batch_cfg,
+            )
+        else:
+            logging.info("Creating WanI2V pipeline.")
+            wan_i2v = wan.WanI2V(
+                config=cfg,
+                checkpoint_dir=args.ckpt_dir,
+                device_id=device,
+                rank=rank,
+                t5_fsdp=args.t5_fsdp,
+                dit_fsdp=args.dit_fsdp,
+                use_sp=(args.ulysses_size > 1),
+                t5_cpu=args.t5_cpu,
+                convert_model_dtype=args.convert_model_dtype,
+            )
+            logging.info("Generating video ...")
+            video = wan_i2v.generate(
+                args.prompt,
+                img,
+                max_area=MAX_AREA_CONFIGS[args.size],
+                frame_num=args.frame_num,
+                shift=args.sample_shift,
+                sample_solver=args.sample_solver,
+                sampling_steps=args.sample_steps,
+                guide_scale=args.sample_guide_scale,
+                seed=args.base_seed,
+                offload_model=args.offload_model,
+                batch_cfg=args.batch_cfg,
+                video_writer=writer)
+
+        if rank == 0 and writer is None:
+            audio = None
+            if "s2v" in args.task:
+                audio = "tts.wav" if args.enable_tts else args.audio
+            logging.info(f"Saving generated video to {args.save_file}")
+            writer = VideoWriter(
+                args.save_file, fps=cfg.sample_fps, audio=audio)
+            writer.write(video)
+    finally:
+        if writer is not None:
+            writer.close()
     del video
 
     torch.cuda.synchronize()
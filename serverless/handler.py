@@ -4,10 +4,79 @@ This runs ON RunPod serverless workers
 """
 
 import runpod
-import subprocess
+import base64
+import concurrent.futures
 import os
+import subprocess
+import sys
+import time
+import uuid
 from pathlib import Path
 
+REPO_ROOT = '/workspace/GenVidIM'
+sys.path.insert(0, REPO_ROOT)
+
+from wan.worker import WORKER_PIPELINES, WanWorker
+
+OUTPUT_DIR = Path(REPO_ROOT) / 'outputs'
+
+# Models are baked into Docker image at /workspace/models/
+# Map each task to its corresponding model directory
+MODEL_DIRS = {
+    'ti2v-5B': '/workspace/models/Wan2.2-TI2V-5B',
+    'animate-14B': '/workspace/models/Wan2.2-Animate-14B',
+    's2v-14B': '/workspace/models/Wan2.2-S2V-14B',
+    't2v-A14B': '/workspace/models/Wan2.2-T2V-A14B'
+}
+
+# One warm worker per container: weights are loaded once and reused by every
+# job instead of spawning `generate.py` for each request. Tasks the worker
+# has no pipeline for still run `generate.py` in a subprocess.
+worker = WanWorker(
+    checkpoint_dirs={
+        task: path
+        for task, path in MODEL_DIRS.items()
+        if task in WORKER_PIPELINES
+    },
+    offload_model=True,
+    convert_model_dtype=True,
+    t5_cpu=True,
+    keep_video=False)
+worker.warmup(os.environ.get('WAN_WARMUP_TASK', 'ti2v-5B'))
+
+
+def run_generate_script(task, prompt, size, steps, save_file):
+    """
+    Runs `generate.py` in a subprocess for tasks the warm worker does not
+    serve. Returns an error dict if it fails, None otherwise.
+    """
+    cmd = [
+        sys.executable, 'generate.py',
+        '--task', task,
+        '--size', size,
+        '--sample_steps', str(steps),
+        '--prompt', prompt,
+        '--ckpt_dir', MODEL_DIRS[task],
+        '--offload_model', 'True',
+        '--convert_model_dtype',
+        '--t5_cpu',
+        '--save_file', str(save_file)
+    ]
+    result = subprocess.run(
+        cmd,
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        timeout=1200  # 20 minutes
+    )
+    if result.returncode != 0:
+        return {
+            "error": "Generation failed",
+            "stderr": result.stderr,
+            "stdout": result.stdout
+        }
+    return None
+
 
 def generate_video(job):
     """
@@ -34,73 +103,45 @@ def generate_video(job):
 
     if not prompt:
         return {"error": "No prompt provided"}
+    if task not in MODEL_DIRS:
+        return {"error": f"Unsupported task: {task}"}
 
     print(f"🎬 Starting generation: {prompt}")
 
-    # Build command
-    # Models are baked into Docker image at /workspace/models/
-    # Map each task to its corresponding model directory
-    model_dirs = {
-        'ti2v-5B': '/workspace/models/Wan2.2-TI2V-5B',
-        'animate-14B': '/workspace/models/Wan2.2-Animate-14B',
-        's2v-14B': '/workspace/models/Wan2.2-S2V-14B',
-        't2v-A14B': '/workspace/models/Wan2.2-T2V-A14B'
-    }
-    
-    ckpt_dir = model_dirs.get(task, '/workspace/models/Wan2.2-TI2V-5B')
-    
-    cmd = [
-        'python', 'generate.py',
-        '--task', task,
-        '--size', size,
-        '--sample_steps', str(steps),
-        '--prompt', prompt,
-        '--ckpt_dir', ckpt_dir,  # Model weights in Docker image
-        '--offload_model', 'True',
-        '--convert_model_dtype',
-        '--t5_cpu'
-    ]
+    save_file = OUTPUT_DIR / f"{job.get('id') or uuid.uuid4()}.mp4"
 
-    # Execute
     try:
-        result = subprocess.run(
-            cmd,
-            cwd='/workspace/GenVidIM',
-            capture_output=True,
-            text=True,
-            timeout=1200  # 20 minutes
-        )
-
-        if result.returncode != 0:
-            return {
-                "error": "Generation failed",
-                "stderr": result.stderr,
-                "stdout": result.stdout
-            }
-
-        # Find generated video in outputs directory
-        video_files = list(Path('/workspace/GenVidIM/outputs').glob('*.mp4'))
-        if not video_files:
-            return {
-                "error": "No video file generated",
-                "stdout": result.stdout
-            }
-
-        # Get the most recent video
-        latest_video = max(video_files, key=lambda p: p.stat().st_mtime)
+        if task in WORKER_PIPELINES:
+            result = worker.generate(
+                task,
+                prompt,
+                size=size,
+                sampling_steps=int(steps),
+                save_file=str(save_file),
+                timeout=1200)  # 20 minutes
+            elapsed = result.elapsed
+        else:
+            start = time.time()
+            error = run_generate_script(task, prompt, size, steps, save_file)
+            if error is not None:
+                return error
+            elapsed = time.time() - start
+
+        video_path = Path(save_file)
+        if not video_path.exists():
+            return {"error": "No video file generated"}
 
         # Read video file as base64 (or upload to S3/cloud storage)
-        import base64
-        video_data = base64.b64encode(latest_video.read_bytes()).decode('utf-8')
+        video_data = base64.b64encode(video_path.read_bytes()).decode('utf-8')
 
         return {
             "status": "success",
-            "video_filename": latest_video.name,
+            "video_filename": video_path.name,
             "video_data": video_data,
-            "stdout": result.stdout[-1000:]  # Last 1000 chars
+            "elapsed_seconds": round(elapsed, 1)
         }
 
-    except subprocess.TimeoutExpired:
+    except (concurrent.futures.TimeoutError, subprocess.TimeoutExpired):
         return {"error": "Generation timed out after 20 minutes"}
     except Exception as e:
         return {"error": str(e)}
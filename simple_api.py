@@ -5,71 +5,74 @@ Production-ready alternative to serverless
 """
 
 from flask import Flask, request, jsonify, send_file
-import subprocess
 import os
+import sys
 import uuid
 from pathlib import Path
-import threading
 import time
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from wan.worker import WanWorker
+
 app = Flask(__name__)
 
 # Configuration
 OUTPUT_DIR = Path("/workspace/GenVidIM/outputs")
 OUTPUT_DIR.mkdir(exist_ok=True)
+CKPT_DIR = os.environ.get("WAN_CKPT_DIR", "/workspace/models/Wan2.2-TI2V-5B")
 
 # Job tracking
 jobs = {}
 
+# Warm model worker: the TI2V-5B pipeline is built once and every request is
+# served from the same process through the worker's queue. Queued requests with
+# the same size and step count are sampled together, up to WAN_MAX_BATCH_SIZE.
+worker = WanWorker(
+    checkpoint_dirs={"ti2v-5B": CKPT_DIR},
+    offload_model=True,
+    convert_model_dtype=True,
+    t5_cpu=True,
+    keep_video=False,
+    max_batch_size=int(os.environ.get("WAN_MAX_BATCH_SIZE", 1)))
+
+
+def _on_job_started(job_id, gen_job):
+    jobs[job_id]["status"] = "IN_PROGRESS"
+    jobs[job_id]["started_at"] = gen_job.started_at
+
+
 def generate_video_task(job_id, prompt, size="512*288", steps=10):
-    """Background task for video generation"""
-    
+    """Queue a video generation on the warm worker"""
+
     try:
-        jobs[job_id]["status"] = "IN_PROGRESS"
-        jobs[job_id]["started_at"] = time.time()
-        
-        # Run generation
-        cmd = [
-            "python", "generate.py",
-            "--task", "ti2v-5B",
-            "--size", size,
-            "--sample_steps", str(steps),
-            "--prompt", prompt,
-            "--offload_model", "True",
-            "--convert_model_dtype",
-            "--t5_cpu"
-        ]
-        
-        result = subprocess.run(
-            cmd,
-            cwd="/workspace/GenVidIM",
-            capture_output=True,
-            text=True,
-            timeout=1200
-        )
-        
-        if result.returncode == 0:
-            # Find generated video
-            videos = sorted(OUTPUT_DIR.glob("*.mp4"), key=lambda x: x.stat().st_mtime)
-            
-            if videos:
-                latest_video = videos[-1]
+        gen_job = worker.submit(
+            "ti2v-5B",
+            prompt,
+            size=size,
+            sampling_steps=int(steps),
+            save_file=str(OUTPUT_DIR / f"{job_id}.mp4"),
+            on_start=lambda j: _on_job_started(job_id, j))
+    except Exception as e:
+        jobs[job_id]["status"] = "FAILED"
+        jobs[job_id]["error"] = str(e)
+        return
+
+    def _on_done(future):
+        try:
+            result = future.result()
+            if os.path.exists(result.save_file):
                 jobs[job_id]["status"] = "COMPLETED"
-                jobs[job_id]["video_path"] = str(latest_video)
-                jobs[job_id]["completed_at"] = time.time()
+                jobs[job_id]["video_path"] = result.save_file
             else:
                 jobs[job_id]["status"] = "FAILED"
                 jobs[job_id]["error"] = "No video file generated"
-        else:
+        except Exception as e:
             jobs[job_id]["status"] = "FAILED"
-            jobs[job_id]["error"] = result.stderr
-            
-    except subprocess.TimeoutExpired:
-        jobs[job_id]["status"] = "FAILED"
-        jobs[job_id]["error"] = "Generation timed out"
-    except Exception as e:
-        jobs[job_id]["status"] = "FAILED"
-        jobs[job_id]["error"] = str(e)
+            jobs[job_id]["error"] = str(e)
+        jobs[job_id]["completed_at"] = time.time()
+
+    gen_job.future.add_done_callback(_on_done)
 
 
 @app.route('/health', methods=['GET'])
@@ -112,13 +115,8 @@ def generate():
         "created_at": time.time()
     }
     
-    # Start generation in background
-    thread = threading.Thread(
-        target=generate_video_task,
-        args=(job_id, prompt, size, steps)
-    )
-    thread.daemon = True
-    thread.start()
+    # Queue generation on the warm worker
+    generate_video_task(job_id, prompt, size, steps)
     
     return jsonify({
         "job_id": job_id,
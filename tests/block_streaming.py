@@ -0,0 +1,85 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+r"""
+Checks that streaming the DiT blocks with `BlockStreamer` reproduces the
+resident model, never keeps more than the budgeted number of blocks on the
+device and leaves none behind after a pass, including cached cross attention
+keys and values. Runs on CPU, or on GPU with --device cuda.
+
+    python tests/block_streaming.py
+"""
+import argparse
+import copy
+import os
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.fixtures import tiny_model
+from wan.utils.offload import BlockStreamer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--num_layers', type=int, default=6)
+    parser.add_argument('--num_resident', type=int, nargs='+', default=[1, 2, 3])
+    parser.add_argument('--tolerance', type=float, default=1e-5)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    device = torch.device(args.device)
+    model = tiny_model(num_layers=args.num_layers)
+
+    x = [torch.randn(16, 3, 8, 8, device=device)]
+    context = [torch.randn(20, 64, device=device)]
+    t = torch.tensor([500.], device=device)
+    seq_len = 3 * 4 * 4
+
+    with torch.no_grad():
+        ref = copy.deepcopy(model).to(device)(
+            x, t=t, context=context, seq_len=seq_len)[0]
+
+        ok = True
+        for num_resident in args.num_resident:
+            streamed = copy.deepcopy(model)
+            streamer = BlockStreamer(
+                streamed, device, num_resident=num_resident)
+            # two passes, as for the conditional / unconditional CFG branches
+            for _ in range(2):
+                out = streamed(x, t=t, context=context, seq_len=seq_len)[0]
+                err = (out - ref).abs().max().item()
+                ok = ok and err <= args.tolerance
+            budget = min(num_resident, args.num_layers)
+            # nothing is prefetched past the last block
+            left = streamer.num_loaded
+            print(f'num_resident={num_resident}: max abs error {err:.2e}, '
+                  f'{streamer.num_loads} block loads, '
+                  f'at most {streamer.max_resident} blocks resident, '
+                  f'{left} left after the pass')
+            ok = ok and streamer.max_resident <= budget
+            ok = ok and (left == 0 or budget == args.num_layers)
+            # evicted blocks must not keep their context keys / values
+            cached = [
+                block.cross_attn._context_cache for block in streamed.blocks
+            ]
+            ok = ok and not any(cache._entries for cache in cached)
+
+            # the head prefetched ahead of a pass stays within the budget
+            streamer.prefetch_head()
+            ok = ok and streamer.num_loaded == budget
+            out = streamed(x, t=t, context=context, seq_len=seq_len)[0]
+            ok = ok and (out - ref).abs().max().item() <= args.tolerance
+            ok = ok and streamer.max_resident <= budget
+            streamer.prefetch_head()
+            streamer.release()
+            ok = ok and streamer.num_loaded == 0
+            streamer.remove()
+            ok = ok and all(cache.size > 0 for cache in cached)
+    if not ok:
+        sys.exit('block streaming does not match the resident model')
+
+
+if __name__ == '__main__':
+    main()
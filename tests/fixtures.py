@@ -0,0 +1,59 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+r"""
+Tiny randomly initialised models shared by the CPU test scripts.
+"""
+import copy
+
+import torch
+
+from benchmark import DIT_ATTRS
+from benchmark import tiny_pipeline as _tiny_pipeline
+from wan.configs import WAN_CONFIGS
+from wan.modules.model import WanModel
+
+__all__ = ['init_head', 'tiny_model', 'tiny_pipeline']
+
+
+def init_head(model):
+    r"""
+    Randomly initialises the output projection of the DiT `model`. It is
+    zero-initialised, which would make every output zero and hide mismatches.
+    """
+    torch.nn.init.normal_(model.head.head.weight, std=0.02)
+    return model
+
+
+def tiny_model(**overrides):
+    r"""
+    A tiny t2v `WanModel` in eval mode without gradients, with a random output
+    projection. `overrides` replace the constructor arguments, e.g.
+    `model_type='i2v', in_dim=36`.
+    """
+    kwargs = dict(
+        model_type='t2v',
+        patch_size=(1, 2, 2),
+        text_len=32,
+        in_dim=16,
+        dim=64,
+        ffn_dim=128,
+        freq_dim=256,
+        text_dim=64,
+        out_dim=16,
+        num_heads=4,
+        num_layers=2)
+    kwargs.update(overrides)
+    return init_head(WanModel(**kwargs).eval().requires_grad_(False))
+
+
+def tiny_pipeline(task='ti2v-5B'):
+    r"""
+    The real pipeline class of `task` around tiny randomly initialised T5, VAE
+    and DiT modules on CPU, as built by `benchmark.tiny_pipeline`, with random
+    DiT output projections.
+    """
+    pipeline = _tiny_pipeline(task, copy.deepcopy(WAN_CONFIGS[task]),
+                              torch.device('cpu'))
+    for attr in DIT_ATTRS:
+        if hasattr(pipeline, attr):
+            init_head(getattr(pipeline, attr))
+    return pipeline
@@ -0,0 +1,76 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+r"""
+Checks the fused adaLN-modulate and gated residual ops against the unfused
+reference ops for per-sample, per-token and per-segment modulation. Runs the
+PyTorch fallback on CPU and, when CUDA and Triton are available, the Triton
+kernels as well.
+
+    python tests/fused_ops_parity.py
+"""
+import argparse
+import os
+import sys
+
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wan.modules.fused_ops import (
+    TRITON_AVAILABLE,
+    gate,
+    gated_residual,
+    layer_norm_modulate,
+    modulate,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dim', type=int, default=96)
+    parser.add_argument('--seq_len', type=int, default=50)
+    parser.add_argument('--tolerance', type=float, default=1e-5)
+    args = parser.parse_args()
+
+    devices = ['cpu']
+    if torch.cuda.is_available() and TRITON_AVAILABLE:
+        devices.append('cuda')
+
+    torch.manual_seed(0)
+    b, l, c = 2, args.seq_len, args.dim
+    cases = [
+        ('per sample', b, 1, None),
+        ('shared', 1, 1, None),
+        ('per token', b, l, None),
+        ('segments', b, 3, [(0, 10), (10, 10), (10, l)]),
+    ]
+
+    ok = True
+    for device in devices:
+        for dtype in (torch.float32, torch.bfloat16):
+            for name, eb, rows, segments in cases:
+                x = torch.randn(b, l, c, device=device).to(dtype)
+                y = torch.randn(b, l, c, device=device).to(dtype)
+                # modulation rows are views of one [B, L1, 6, C] tensor
+                e = torch.randn(eb, rows, 6, c, device=device).unbind(2)
+
+                with torch.no_grad():
+                    normed = F.layer_norm(x.float(), (c,), eps=1e-6)
+                    ref = modulate(normed, e[0], e[1], segments)
+                    out = layer_norm_modulate(x, e[0], e[1], 1e-6, segments)
+                    err = (out - ref).abs().max().item()
+
+                    ref = x + gate(y, e[2], segments)
+                    out = gated_residual(x, y, e[2], segments)
+                    err_res = (out - ref).abs().max().item()
+                    ok = ok and out.dtype == ref.dtype
+
+                print(f'{device} {str(dtype)[6:]} {name}: modulate {err:.2e}, '
+                      f'gated residual {err_res:.2e}')
+                ok = ok and max(err, err_res) <= args.tolerance
+    if not ok:
+        sys.exit('fused ops do not match the reference ops')
+
+
+if __name__ == '__main__':
+    main()
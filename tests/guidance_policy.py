@@ -0,0 +1,87 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+r"""
+Checks which unconditional passes the guidance policies run on a 10-step
+schedule and the guided predictions they return. Runs on CPU.
+
+    python tests/guidance_policy.py
+"""
+import os
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wan.utils.guidance import GuidancePolicy
+
+
+def run(policy, timesteps, cond, uncond, scale=5.0):
+    r"""
+    Steps with an unconditional pass and the guided predictions. `uncond`
+    maps the step index to the unconditional prediction.
+    """
+    policy.plan(timesteps)
+    ran, preds = [], []
+    for i in range(len(timesteps)):
+        u = None
+        if policy.use_uncond(i):
+            ran.append(i)
+            u = uncond(i)
+        preds.append(policy(i, cond, u, scale))
+    return ran, preds
+
+
+def main():
+    torch.manual_seed(0)
+    timesteps = torch.linspace(1000, 100, 10)
+    cond = torch.randn(16, 2, 4, 4)
+    base = torch.randn(16, 2, 4, 4)
+
+    ok = True
+
+    def check(name, got, expected):
+        nonlocal ok
+        print(f'{name}: {got}')
+        if got != expected:
+            print(f'  expected {expected}')
+            ok = False
+
+    # default: classifier-free guidance at every step
+    ran, preds = run(GuidancePolicy(), timesteps, cond, lambda i: base)
+    check('default', ran, list(range(10)))
+    ok = ok and all(torch.equal(p, base + 5.0 * (cond - base)) for p in preds)
+
+    # guidance only while 0.3 <= t / 1000 <= 0.7
+    ran, preds = run(
+        GuidancePolicy(interval=(0.3, 0.7)), timesteps, cond, lambda i: base)
+    check('interval', ran, [3, 4, 5, 6, 7])
+    ok = ok and torch.equal(preds[0], cond) and torch.equal(preds[9], cond)
+
+    # every third step, the delta of the last pass is reused in between
+    policy = GuidancePolicy(every=3)
+    ran, preds = run(policy, timesteps, cond, lambda i: base + i)
+    check('every 3', ran, [0, 3, 6, 9])
+    reused = cond + 4.0 * (cond - (base + 3))
+    ok = ok and torch.allclose(preds[4], reused) and torch.allclose(
+        preds[5], reused)
+    check('every 3 skipped', policy.skipped, {
+        'interval': 0,
+        'reuse': 6,
+        'adaptive': 0
+    })
+
+    # uncond converges to cond from the fourth step on
+    policy = GuidancePolicy(adaptive_threshold=0.99)
+    ran, preds = run(policy, timesteps, cond,
+                     lambda i: cond + (1.0 if i < 3 else 1e-3) * base)
+    check('adaptive', ran, [0, 1, 2, 3])
+    ok = ok and all(torch.equal(p, cond) for p in preds[4:])
+    policy.report()
+    check('adaptive after report', policy.num_steps, 0)
+
+    if not ok:
+        sys.exit('guidance policy ran unexpected unconditional passes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+r"""
+Bounded-error parity of the weight-only int8 / int4 quantized DiT against the
+full precision model on a tiny randomly initialised WanModel, including a
+round trip through the quantized checkpoint format. Runs on CPU.
+
+    python tests/quant_parity.py
+"""
+import argparse
+import copy
+import os
+import sys
+import tempfile
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.fixtures import tiny_model
+from wan.modules.model import WanModel
+from wan.modules.quant import load_pretrained, quantize_model, save_quantized
+
+
+def relative_error(a, b):
+    return ((a - b).norm() / b.norm().clamp(min=1e-6)).item()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--int8_tolerance', type=float, default=0.02)
+    parser.add_argument('--int4_tolerance', type=float, default=0.15)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model = tiny_model(dim=128, ffn_dim=256)
+
+    x = [torch.randn(16, 3, 8, 8)]
+    context = [torch.randn(20, 64)]
+    t = torch.tensor([500.])
+    seq_len = 3 * 4 * 4
+
+    def run(m):
+        with torch.no_grad():
+            return m(x, t=t, context=context, seq_len=seq_len)[0]
+
+    ref = run(model)
+
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        model.save_pretrained(tmp)
+        for bits, group_size, tolerance in ((8, None, args.int8_tolerance),
+                                            (8, 32, args.int8_tolerance),
+                                            (4, 32, args.int4_tolerance)):
+            name = f'int{bits}' + (f'-g{group_size}' if group_size else '')
+            out = run(quantize_model(copy.deepcopy(model), bits, group_size))
+            err = relative_error(out, ref)
+            print(f'{name}: relative L2 error {err:.4f}')
+            ok = ok and err < tolerance
+
+            # the converted checkpoint must reproduce on the fly quantization
+            save_quantized(WanModel, tmp, bits=bits, group_size=group_size)
+            loaded = load_pretrained(
+                WanModel, tmp, bits=bits, group_size=group_size)
+            max_err = (run(loaded.eval()) - out).abs().max().item()
+            print(f'{name}: checkpoint round trip max abs error {max_err:.2e}')
+            ok = ok and max_err < 1e-5
+    if not ok:
+        sys.exit('quantized DiT error above tolerance')
+
+
+if __name__ == '__main__':
+    main()
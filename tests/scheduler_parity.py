@@ -0,0 +1,110 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+r"""
+Checks that the device resident UniPC and DPM++ schedulers produce bitwise
+the same samples as the reference schedulers over whole sampling runs, for
+the solver orders and variants they support. Runs on CPU, or on CUDA with
+`--device cuda`.
+
+    python tests/scheduler_parity.py
+"""
+import argparse
+import itertools
+import os
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wan.utils.fm_solvers import (
+    FlowDPMSolverMultistepScheduler,
+    get_sampling_sigmas,
+    retrieve_timesteps,
+)
+from wan.utils.fm_solvers_device import (
+    FlowDPMSolverDeviceScheduler,
+    FlowUniPCDeviceScheduler,
+)
+from wan.utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
+
+
+def sample(scheduler, steps, shift, device, solver):
+    if solver == 'unipc':
+        scheduler.set_timesteps(steps, device=device, shift=shift)
+        timesteps = scheduler.timesteps
+    else:
+        timesteps, _ = retrieve_timesteps(
+            scheduler,
+            device=device,
+            sigmas=get_sampling_sigmas(steps, shift))
+
+    g = torch.Generator(device=device).manual_seed(0)
+    latents = torch.randn(1, 4, 3, 8, 8, generator=g, device=device)
+    outputs = []
+    for i, t in enumerate(timesteps):
+        # a stand-in for the flow prediction that depends on the latents
+        noise_pred = torch.tanh(latents * 0.7) - 0.05 * i
+        latents = scheduler.step(
+            noise_pred, t, latents, return_dict=False, generator=g)[0]
+        outputs.append(latents)
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--shift', type=float, default=5.0)
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    cases = []
+    for steps, order, solver_type, disable_corrector in itertools.product(
+        (4, 20), (1, 2, 3), ('bh1', 'bh2'), ([], [0, 5])):
+        cases.append(('unipc', steps,
+                      dict(
+                          solver_order=order,
+                          solver_type=solver_type,
+                          disable_corrector=disable_corrector)))
+    for steps, order, algorithm_type, solver_type in itertools.product(
+        (4, 20), (1, 2, 3), ('dpmsolver++', 'sde-dpmsolver++'),
+        ('midpoint', 'heun')):
+        if order == 3 and algorithm_type.startswith('sde'):
+            continue
+        cases.append(('dpm++', steps,
+                      dict(
+                          solver_order=order,
+                          algorithm_type=algorithm_type,
+                          solver_type=solver_type)))
+
+    failed = 0
+    for solver, steps, kwargs in cases:
+        classes = {
+            'unipc': (FlowUniPCMultistepScheduler, FlowUniPCDeviceScheduler),
+            'dpm++':
+                (FlowDPMSolverMultistepScheduler, FlowDPMSolverDeviceScheduler)
+        }[solver]
+        ref, out = [
+            sample(
+                cls(num_train_timesteps=1000,
+                    shift=1,
+                    use_dynamic_shifting=False,
+                    **kwargs), steps, args.shift, device, solver)
+            for cls in classes
+        ]
+        mismatch = [
+            i for i, (a, b) in enumerate(zip(ref, out))
+            if not torch.equal(a, b)
+        ]
+        if mismatch:
+            failed += 1
+            err = (ref[mismatch[0]] - out[mismatch[0]]).abs().max().item()
+            print(f'{solver} {steps} steps {kwargs}: first mismatch at step '
+                  f'{mismatch[0]}, max abs error {err:.2e}')
+    print(f'{len(cases) - failed} of {len(cases)} scheduler configurations '
+          f'match bitwise')
+    if failed:
+        sys.exit('device resident schedulers deviate from the reference')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+r"""
+Runs a short denoising schedule through a tiny WanModel with the step cache
+in both modes. A zero threshold must reproduce the uncached outputs exactly,
+an unbounded one must skip as many steps as `max_skips` and the warmup allow,
+tracked separately for the conditional and unconditional branch, and the
+statistics must count branches evicted from the cache. Runs on CPU.
+
+    python tests/step_cache.py
+"""
+import argparse
+import os
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.fixtures import tiny_model
+from wan.modules.model import clear_context_cache
+from wan.modules.step_cache import STEP_CACHE_MODES, StepCache
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--steps', type=int, default=8)
+    parser.add_argument('--max_skips', type=int, default=2)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model = tiny_model(num_layers=3)
+
+    context = [torch.randn(20, 64)]
+    context_null = [torch.randn(20, 64)]
+    seq_len = 3 * 4 * 4
+    timesteps = torch.linspace(1000, 100, args.steps)
+
+    def sample():
+        torch.manual_seed(1)
+        x = torch.randn(16, 3, 8, 8)
+        outputs = []
+        with torch.no_grad():
+            for t in timesteps:
+                cond = model([x], t=t[None], context=context,
+                             seq_len=seq_len)[0]
+                uncond = model([x], t=t[None],
+                               context=context_null,
+                               seq_len=seq_len)[0]
+                outputs += [cond, uncond]
+                x = x - 0.1 * (uncond + 3 * (cond - uncond))
+        return outputs
+
+    ref = sample()
+    # per branch: a warmup step, then max_skips skipped steps before every
+    # computed one
+    computed = 1 + (args.steps - 1) // (args.max_skips + 1)
+    expected = 2 * (args.steps - computed)
+
+    ok = True
+    for mode in STEP_CACHE_MODES:
+        model.step_cache = StepCache(mode, threshold=0., warmup_steps=1)
+        out = sample()
+        err = max((a - b).abs().max().item() for a, b in zip(out, ref))
+        skipped = model.step_cache.stats()[1]
+        print(f'{mode}, threshold 0: {skipped} skipped, '
+              f'max abs error {err:.2e}')
+        ok = ok and skipped == 0 and err == 0
+        clear_context_cache(model)
+
+        model.step_cache = StepCache(
+            mode, threshold=float('inf'), max_skips=args.max_skips)
+        out = sample()
+        num_steps, skipped = model.step_cache.stats()
+        err = max((a - b).abs().max().item() for a, b in zip(out, ref))
+        print(f'{mode}, unbounded threshold: {skipped} of {num_steps} '
+              f'skipped (expected {expected}), max abs error {err:.2e}')
+        ok = ok and num_steps == 2 * args.steps and skipped == expected
+        clear_context_cache(model)
+        ok = ok and model.step_cache.stats() == (0, 0)
+
+    # branches evicted by `max_branches` still count in the totals
+    model.step_cache = StepCache('first_block', threshold=float('inf'))
+    model.step_cache.max_branches = 1
+    sample()
+    num_steps, skipped = model.step_cache.stats()
+    print(f'one cached branch: {skipped} of {num_steps} skipped')
+    ok = ok and num_steps == 2 * args.steps and skipped == 0
+    clear_context_cache(model)
+    if not ok:
+        sys.exit('step cache skipped unexpected steps')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+r"""
+Accuracy of the dynamic int8 T5 encoder against the bf16 encoder on a tiny
+randomly initialised model. Runs on CPU.
+
+    python tests/t5_quant_parity.py
+"""
+import argparse
+import copy
+import os
+import sys
+
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wan.modules.t5 import T5Encoder, quantize_dynamic_int8
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tolerance', type=float, default=0.05)
+    parser.add_argument('--min_cosine', type=float, default=0.99)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model = T5Encoder(
+        vocab=1024,
+        dim=256,
+        dim_attn=256,
+        dim_ffn=512,
+        num_heads=4,
+        num_layers=2,
+        num_buckets=32,
+        shared_pos=False,
+        dropout=0.0).eval().requires_grad_(False)
+
+    ids = torch.randint(0, 1024, (2, 48))
+    mask = torch.ones_like(ids)
+    mask[1, 20:] = 0
+
+    with torch.no_grad():
+        ref = copy.deepcopy(model).bfloat16()(ids, mask).float()
+        quantized = quantize_dynamic_int8(copy.deepcopy(model).bfloat16())
+        out = quantized(ids, mask).float()
+
+    valid = mask.bool()
+    ref, out = ref[valid], out[valid]
+    err = ((out - ref).norm() / ref.norm()).item()
+    cosine = F.cosine_similarity(out, ref, dim=-1).min().item()
+    print(f'int8 vs bf16: relative L2 error {err:.4f}, '
+          f'min token cosine similarity {cosine:.4f}')
+    if err > args.tolerance or cosine < args.min_cosine:
+        sys.exit('int8 T5 encoder deviates too much from bf16')
+
+
+if __name__ == '__main__':
+    main()
@@ -78,6 +78,11 @@ function ti2v_5B() {
     echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> ti2v_5B t2v Multiple GPU, prompt extend local_qwen: "
     torchrun --nproc_per_node=$GPUS $PY_FILE --task ti2v-5B --ckpt_dir $CKPT_DIR --size 704*1280 --dit_fsdp --t5_fsdp --ulysses_size $GPUS --use_prompt_extend --prompt_extend_model "Qwen/Qwen2.5-3B-Instruct" --prompt_extend_target_lang "en"
 
+    echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> ti2v_5B t2v batched CFG parity Test: "
+    python $PY_FILE --task ti2v-5B --ckpt_dir $CKPT_DIR --size 1280*704 --frame_num 21 --sample_steps 10 --base_seed 42 --offload_model True --save_file /tmp/ti2v_cfg_two_pass.mp4
+    python $PY_FILE --task ti2v-5B --ckpt_dir $CKPT_DIR --size 1280*704 --frame_num 21 --sample_steps 10 --base_seed 42 --offload_model True --save_file /tmp/ti2v_cfg_batched.mp4 --batch_cfg
+    python -c "import imageio.v3 as iio, numpy as np; a = iio.imread('/tmp/ti2v_cfg_two_pass.mp4').astype(np.float32); b = iio.imread('/tmp/ti2v_cfg_batched.mp4').astype(np.float32); err = np.abs(a - b).mean(); print(f'batched CFG mean abs diff: {err:.3f}'); assert err < 2.0"
+
     echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> ti2v_5B i2v Multiple GPU Test: "
     torchrun --nproc_per_node=$GPUS $PY_FILE --task ti2v-5B --ckpt_dir $CKPT_DIR --size 704*1280 --dit_fsdp --t5_fsdp --ulysses_size $GPUS --prompt "Summer beach vacation style, a white cat wearing sunglasses sits on a surfboard. The fluffy-furred feline gazes directly at the camera with a relaxed expression. Blurred beach scenery forms the background featuring crystal-clear waters, distant green hills, and a blue sky dotted with white clouds. The cat assumes a naturally relaxed posture, as if savoring the sea breeze and warm sunlight. A close-up shot highlights the feline's intricate details and the refreshing atmosphere of the seaside." --image "examples/i2v_input.JPG"
 
@@ -86,6 +91,84 @@ function ti2v_5B() {
 
 }
 
+function vae_tiling() {
+    echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> VAE tiled encode / decode parity Test: "
+    python tests/vae_tiling_parity.py
+}
+
+function block_streaming() {
+    echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> DiT block streaming Test: "
+    python tests/block_streaming.py
+}
+
+function quant_parity() {
+    echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Quantized DiT parity Test: "
+    python tests/quant_parity.py
+}
+
+function t5_quant_parity() {
+    echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Quantized T5 encoder parity Test: "
+    python tests/t5_quant_parity.py
+}
+
+function compile_parity() {
+    echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Regional compile parity Test: "
+    python tests/compile_parity.py
+}
+
+function fused_ops_parity() {
+    echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Fused ops parity Test: "
+    python tests/fused_ops_parity.py
+}
+
+function context_cache() {
+    echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Cross attention context cache Test: "
+    python tests/context_cache.py
+}
+
+function step_cache() {
+    echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Step cache Test: "
+    python tests/step_cache.py
+}
+
+function guidance_policy() {
+    echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Guidance policy Test: "
+    python tests/guidance_policy.py
+}
+
+function scheduler_parity() {
+    echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Device resident scheduler parity Test: "
+    python tests/scheduler_parity.py
+}
+
+function continuous_batching() {
+    echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Continuous batching engine Test: "
+    python tests/continuous_batching.py
+}
+
+function worker_batching() {
+    echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Worker batching Test: "
+    python tests/worker_batching.py
+}
+
+function batched_cfg() {
+    echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Batched CFG parity Test: "
+    python tests/batched_cfg.py
+}
+
+vae_tiling
+block_streaming
+quant_parity
+t5_quant_parity
+compile_parity
+fused_ops_parity
+context_cache
+step_cache
+guidance_policy
+scheduler_parity
+continuous_batching
+worker_batching
+batched_cfg
 t2v_A14B
 i2v_A14B
 ti2v_5B
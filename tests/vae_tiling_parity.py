@@ -0,0 +1,97 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+r"""
+Parity of tiled vs. untiled VAE encode / decode on tiny randomly initialised
+Wan2.1 and Wan2.2 VAEs. Runs on CPU.
+
+A single tile covering the whole latent grid has to reproduce the untiled
+result exactly, which checks the per-tile caches, chunking and blending.
+Overlapping tiles are checked against a bounded relative L2 error. That error
+is inherent: the theoretical receptive field of the decoder is about 17
+latent cells (13 for the encoder), more than the 16 cell test tiles, and
+untrained weights do not concentrate it near the centre the way trained ones
+do, so the zero padding at tile borders reaches into the blended region. With
+the default settings the error is 0.05 to 0.15, a misplaced or misweighted
+tile gives an error of order 1.
+
+    python tests/vae_tiling_parity.py
+"""
+import argparse
+import os
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wan.modules.vae2_1 import WanVAE_ as WanVAE21
+from wan.modules.vae2_2 import WanVAE_ as WanVAE22
+
+
+def relative_error(a, b):
+    return ((a - b).norm() / b.norm().clamp(min=1e-6)).item()
+
+
+def check(name, vae, spatial, args):
+    scale = [0.0, 1.0]
+    h, w = args.latent_size
+    frames = 1 + 4 * (args.latent_frames - 1)
+
+    z = torch.randn(1, vae.z_dim, args.latent_frames, h, w)
+    video = torch.rand(1, 3, frames, h * spatial, w * spatial) * 2 - 1
+
+    def run(tile_size, tile_overlap):
+        if tile_size is None:
+            vae.disable_tiling()
+        else:
+            vae.enable_tiling(tile_size, tile_overlap)
+        with torch.no_grad():
+            out = vae.decode(z, scale), vae.encode(video, scale)
+        vae.disable_tiling()
+        return out
+
+    ref = run(None, None)
+    ok = True
+    for tiling, tile_size, tile_overlap, tolerance in (
+        ('single tile', (h, w), (0, 0), 1e-6),
+        ('tiled', args.tile_size, args.tile_overlap, args.tolerance),
+    ):
+        out = run(tile_size, tile_overlap)
+        for stage, a, b in zip(('decode', 'encode'), out, ref):
+            assert a.shape == b.shape, f'{name} {stage}: {a.shape} vs {b.shape}'
+            err = relative_error(a, b)
+            max_err = (a - b).abs().max().item()
+            print(f'{name} {tiling} {stage}: relative L2 error {err:.4f}, '
+                  f'max abs error {max_err:.4f}')
+            ok = ok and err <= tolerance
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latent_size', type=int, nargs=2, default=[24, 40])
+    parser.add_argument('--latent_frames', type=int, default=3)
+    parser.add_argument('--tile_size', type=int, nargs=2, default=[16, 16])
+    parser.add_argument('--tile_overlap', type=int, nargs=2, default=[8, 8])
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    vaes = [
+        ('Wan2.1', WanVAE21(dim=8, z_dim=4,
+                            temperal_downsample=[False, True, True]), 8),
+        ('Wan2.2',
+         WanVAE22(
+             dim=8,
+             dec_dim=8,
+             z_dim=8,
+             temperal_downsample=[False, True, True]), 16),
+    ]
+    ok = True
+    for name, vae, spatial in vaes:
+        ok = check(name, vae.eval(), spatial, args) and ok
+    if not ok:
+        sys.exit(f'tiled VAE error above tolerance {args.tolerance}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+r"""
+Checks that `WanWorker` groups only compatible queued jobs, and that the jobs
+it samples together through `WanTI2V.t2v_batch` match the same jobs sampled
+one at a time with `WanTI2V.generate`. Uses the real pipeline around tiny
+randomly initialised T5, VAE and DiT modules. Runs on CPU.
+
+    python tests/worker_batching.py
+"""
+import argparse
+import os
+import sys
+
+import torch
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.fixtures import tiny_pipeline
+from wan.worker import WanWorker
+
+
+def tiny_worker(pipeline, max_batch_size, batch_cfg):
+    # not started, so every job is queued before the first batch is taken
+    return WanWorker({},
+                     offload_model=False,
+                     batch_cfg=batch_cfg,
+                     max_batch_size=max_batch_size,
+                     pipelines={'ti2v-5B': pipeline},
+                     start=False)
+
+
+def check_take():
+    worker = tiny_worker(None, max_batch_size=2, batch_cfg=False)
+    common = dict(size='64*64', frame_num=5, sampling_steps=3)
+    a = worker.submit('ti2v-5B', 'a', seed=0, **common)
+    b = worker.submit('t2v-A14B', 'b', seed=1, **common)
+    c = worker.submit('ti2v-5B', 'c', seed=2, **common)
+    d = worker.submit(
+        'ti2v-5B', 'd', seed=3, size='96*64', frame_num=5, sampling_steps=3)
+    e = worker.submit(
+        'ti2v-5B', 'e', seed=4, img=Image.new('RGB', (64, 64)), **common)
+    f = worker.submit('ti2v-5B', 'f', seed=5, **common)
+    g = worker.submit('ti2v-5B', 'g', seed=6, **common)
+    h = worker.submit('ti2v-5B', 'h', seed=7, **common)
+    # at most max_batch_size equal keys per batch, queue order kept otherwise
+    expected = [[a, c], [b], [d], [e], [f, g], [h]]
+    taken = [worker._take() for _ in expected]
+    ok = all(
+        len(u) == len(v) and all(x is y for x, y in zip(u, v))
+        for u, v in zip(taken, expected)) and worker.qsize() == 0
+    print(f'take: {[[job.prompt for job in u] for u in taken]}')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max_batch_size', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    pipeline = tiny_pipeline('ti2v-5B')
+    requests = [
+        dict(prompt='a first request', seed=0, guide_scale=5.0),
+        dict(prompt='a second request', seed=1, guide_scale=3.0),
+        dict(prompt='a third request', seed=2, guide_scale=5.0),
+    ][:args.max_batch_size]
+    common = dict(size='64*64', frame_num=5, shift=5.0, sampling_steps=3)
+
+    ok = check_take()
+    # adaptive guidance has to stop each sample's unconditional pass on its
+    # own convergence, not on the similarity over the batch
+    for batch_cfg, threshold in ((False, None), (True, None), (True, 0.5)):
+        pipeline.config.cfg_adaptive_threshold = threshold
+        worker = tiny_worker(pipeline, args.max_batch_size, batch_cfg)
+        jobs = [worker.submit('ti2v-5B', **common, **r) for r in requests]
+        worker.start()
+        for job in jobs:
+            job.future.result()
+        worker.close()
+
+        err = 0.
+        for job in jobs:
+            ref = pipeline.generate(
+                job.prompt,
+                size=job.size,
+                frame_num=job.frame_num,
+                shift=job.shift,
+                sample_solver=job.sample_solver,
+                sampling_steps=job.sampling_steps,
+                guide_scale=job.guide_scale,
+                n_prompt=job.n_prompt,
+                seed=job.seed,
+                offload_model=False,
+                batch_cfg=batch_cfg)
+            err = max(err, (job.video - ref).abs().max().item())
+        print(f'batch_cfg={batch_cfg}, adaptive threshold {threshold}: '
+              f'{len(jobs)} jobs, max abs error {err:.2e}')
+        ok = ok and err <= args.tolerance
+    if not ok:
+        sys.exit('worker batching deviates from sequential sampling')
+
+
+if __name__ == '__main__':
+    main()
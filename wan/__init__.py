@@ -4,4 +4,6 @@ from .image2video import WanI2V
 from .speech2video import WanS2V
 from .text2video import WanT2V
 from .textimage2video import WanTI2V
-from .animate import WanAnimate
\ No newline at end of file
+from .animate import WanAnimate
+from .worker import WanWorker
+from .engine import ContinuousBatchingEngine
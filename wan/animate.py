@@ -20,16 +20,19 @@ from .distributed.sequence_parallel import sp_attn_forward, sp_dit_forward
 from .distributed.util import get_world_size
 
 from .modules.animate import WanAnimateModel
+from .modules.attention import set_attention_backend
+from .modules.model import context_cache_scope
+from .modules.quant import load_pretrained
+from .modules.step_cache import StepCache
 from .modules.animate import CLIPModel
 from .modules.t5 import T5EncoderModel
 from .modules.vae2_1 import Wan2_1_VAE
 from .modules.animate.animate_utils import TensorList, get_loraconfig
-from .utils.fm_solvers import (
-    FlowDPMSolverMultistepScheduler,
-    get_sampling_sigmas,
-    retrieve_timesteps,
-)
-from .utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
+from .utils.fm_solvers import get_sampling_sigmas, retrieve_timesteps
+from .utils.fm_solvers_device import scheduler_class
+from .utils.guidance import GuidancePolicy, cfg_batch_args
+from .utils.prompt_cache import PromptEmbeddingCache
+from .utils.regional_compile import compile_blocks, seq_len_buckets
 
 
 
@@ -78,6 +81,8 @@ class WanAnimate:
                Whether to use relighting lora for character replacement. 
         """
         self.device = torch.device(f"cuda:{device_id}")
+        set_attention_backend(
+            config.attn_backend, self.device, benchmark=config.attn_benchmark)
         self.config = config
         self.rank = rank
         self.t5_cpu = t5_cpu
@@ -97,6 +102,11 @@ class WanAnimate:
             checkpoint_path=os.path.join(checkpoint_dir, config.t5_checkpoint),
             tokenizer_path=os.path.join(checkpoint_dir, config.t5_tokenizer),
             shard_fn=shard_fn if t5_fsdp else None,
+            cache=PromptEmbeddingCache(
+                max_entries=config.t5_cache_size,
+                cache_dir=config.t5_cache_dir),
+            pad_bucket=config.t5_pad_bucket,
+            quantize=config.t5_quant if t5_cpu else None,
         )
 
         self.clip = CLIPModel(
@@ -109,17 +119,28 @@ class WanAnimate:
         self.vae = Wan2_1_VAE(
             vae_pth=os.path.join(checkpoint_dir, config.vae_checkpoint),
             device=self.device)
+        if config.vae_tile_size is not None:
+            self.vae.enable_tiling(config.vae_tile_size, config.vae_tile_overlap)
 
+        assert not (use_relighting_lora and config.dit_quant_bits), \
+            "The relighting LoRA needs the full precision DiT, disable dit_quant_bits."
         logging.info(f"Creating WanAnimate from {checkpoint_dir}")
 
         if not dit_fsdp:
-            self.noise_model = WanAnimateModel.from_pretrained(
+            self.noise_model = load_pretrained(
+                WanAnimateModel,
                 checkpoint_dir,
+                bits=config.dit_quant_bits,
+                group_size=config.dit_quant_group_size,
                 torch_dtype=self.param_dtype,
                 device_map=self.device)
         else:
-            self.noise_model = WanAnimateModel.from_pretrained(
-                checkpoint_dir, torch_dtype=self.param_dtype)
+            self.noise_model = load_pretrained(
+                WanAnimateModel,
+                checkpoint_dir,
+                bits=config.dit_quant_bits,
+                group_size=config.dit_quant_group_size,
+                torch_dtype=self.param_dtype)
 
         self.noise_model = self._configure_model(
             model=self.noise_model,
@@ -138,6 +159,9 @@ class WanAnimate:
             self.sp_size = 1
 
         self.sample_neg_prompt = config.sample_neg_prompt
+        self.text_encoder.precompute(
+            [self.sample_neg_prompt],
+            torch.device('cpu') if t5_cpu else self.device)
         self.sample_prompt = config.prompt
 
 
@@ -173,6 +197,13 @@ class WanAnimate:
 
             model.use_context_parallel = True
 
+        if self.config.step_cache:
+            model.step_cache = StepCache(
+                mode=self.config.step_cache,
+                threshold=self.config.step_cache_threshold,
+                max_skips=self.config.step_cache_max_skips,
+                warmup_steps=self.config.step_cache_warmup_steps)
+
         if dist.is_initialized():
             dist.barrier()
 
@@ -196,6 +227,15 @@ class WanAnimate:
             if not self.init_on_cpu:
                 model.to(self.device)
 
+        if self.config.compile_blocks and not dit_fsdp:
+            compile_blocks(
+                model,
+                buckets=seq_len_buckets(self.config.compile_sizes,
+                                        self.config.vae_stride,
+                                        self.config.patch_size),
+                backend=self.config.compile_backend,
+                mode=self.config.compile_mode)
+
         return model
 
     def inputs_padding(self, array, target_len):
@@ -308,6 +348,7 @@ class WanAnimate:
         n_prompt="",
         seed=-1,
         offload_model=True,
+        batch_cfg=False,
     ):
         r"""
         Generates video frames from input image using diffusion process.
@@ -339,6 +380,9 @@ class WanAnimate:
                 Random seed for noise generation. If -1, use random seed
             offload_model (`bool`, *optional*, defaults to True):
                 If True, offloads models to CPU during generation to save VRAM
+            batch_cfg (`bool`, *optional*, defaults to False):
+                If True and `guide_scale > 1`, runs the conditional and unconditional
+                passes as a single batch-of-2 forward per step
 
         Returns:
             torch.Tensor:
@@ -366,16 +410,16 @@ class WanAnimate:
         cond_images, face_images, refer_images = self.prepare_source(src_pose_path=src_pose_path, src_face_path=src_face_path, src_ref_path=src_ref_path)
         
         if not self.t5_cpu:
-            self.text_encoder.model.to(self.device)
-            context = self.text_encoder([input_prompt], self.device)
-            context_null = self.text_encoder([n_prompt], self.device)
+            if not self.text_encoder.is_cached([input_prompt, n_prompt]):
+                self.text_encoder.model.to(self.device)
+            context = self.text_encoder([input_prompt, n_prompt], self.device)
             if offload_model:
                 self.text_encoder.model.cpu()
         else:
-            context = self.text_encoder([input_prompt], torch.device('cpu'))
-            context_null = self.text_encoder([n_prompt], torch.device('cpu'))
+            context = self.text_encoder([input_prompt, n_prompt],
+                                        torch.device('cpu'))
             context = [t.to(self.device) for t in context]
-            context_null = [t.to(self.device) for t in context_null]
+        context, context_null = context[:1], context[1:]
 
         real_frame_len = len(cond_images)
         target_len = self.get_valid_len(real_frame_len, clip_len, overlap=refert_num)
@@ -394,6 +438,7 @@ class WanAnimate:
         start = 0
         end = clip_len
         all_out_frames = []
+        guidance = GuidancePolicy.from_config(self.config)
         while True:
             if start + refert_num >= len(cond_images):
                 break
@@ -478,23 +523,28 @@ class WanAnimate:
             if max_seq_len % self.sp_size != 0:
                 raise ValueError(f"max_seq_len {max_seq_len} is not divisible by sp_size {self.sp_size}")
 
+            # the cached context embeddings and keys / values are dropped
+            # after every clip, also when sampling fails
             with (
                 torch.autocast(device_type=str(self.device), dtype=torch.bfloat16, enabled=True),
-                torch.no_grad()
+                torch.no_grad(),
+                context_cache_scope(self.noise_model),
             ):
                 if sample_solver == 'unipc':
-                    sample_scheduler = FlowUniPCMultistepScheduler(
-                        num_train_timesteps=self.num_train_timesteps,
-                        shift=1,
-                        use_dynamic_shifting=False)
+                    sample_scheduler = scheduler_class(
+                        'unipc', self.config.device_scheduler)(
+                            num_train_timesteps=self.num_train_timesteps,
+                            shift=1,
+                            use_dynamic_shifting=False)
                     sample_scheduler.set_timesteps(
                         sampling_steps, device=self.device, shift=shift)
                     timesteps = sample_scheduler.timesteps
                 elif sample_solver == 'dpm++':
-                    sample_scheduler = FlowDPMSolverMultistepScheduler(
-                        num_train_timesteps=self.num_train_timesteps,
-                        shift=1,
-                        use_dynamic_shifting=False)
+                    sample_scheduler = scheduler_class(
+                        'dpm++', self.config.device_scheduler)(
+                            num_train_timesteps=self.num_train_timesteps,
+                            shift=1,
+                            use_dynamic_shifting=False)
                     sampling_sigmas = get_sampling_sigmas(sampling_steps, shift)
                     timesteps, _ = retrieve_timesteps(
                         sample_scheduler,
@@ -599,28 +649,48 @@ class WanAnimate:
                         "pose_latents": pose_latents,
                         "face_pixel_values": face_pixel_values_uncond,
                     }
+                    if batch_cfg:
+                        arg_cfg = cfg_batch_args(arg_c, arg_null)
 
+                guidance.plan(timesteps)
                 for i, t in enumerate(tqdm(timesteps)):
                     latent_model_input = latents
                     timestep = [t]
 
                     timestep = torch.stack(timestep)
 
-                    noise_pred_cond = TensorList(
-                         self.noise_model(TensorList(latent_model_input), t=timestep, **arg_c)
-                    )
-
-                    if guide_scale > 1:
+                    use_uncond = guide_scale > 1 and guidance.use_uncond(i)
+                    if use_uncond and batch_cfg:
+                        noise_pred = self.noise_model(
+                            TensorList(latent_model_input * 2),
+                            t=torch.cat([timestep, timestep]),
+                            **arg_cfg)
+                        noise_pred = TensorList(
+                            [guidance(i, noise_pred[0], noise_pred[1], guide_scale)]
+                        )
+                    elif use_uncond:
+                        noise_pred_cond = TensorList(
+                             self.noise_model(TensorList(latent_model_input), t=timestep, **arg_c)
+                        )
                         noise_pred_uncond = TensorList(
                              self.noise_model(
                                 TensorList(latent_model_input), t=timestep, **arg_null
                             )
                         )
-                        noise_pred = noise_pred_uncond + guide_scale * (
-                            noise_pred_cond - noise_pred_uncond
+                        noise_pred = TensorList(
+                            [guidance(i, noise_pred_cond[0], noise_pred_uncond[0], guide_scale)]
+                        )
+                    elif guide_scale > 1:
+                        noise_pred_cond = TensorList(
+                             self.noise_model(TensorList(latent_model_input), t=timestep, **arg_c)
+                        )
+                        noise_pred = TensorList(
+                            [guidance(i, noise_pred_cond[0], None, guide_scale)]
                         )
                     else:
-                        noise_pred = noise_pred_cond
+                        noise_pred = TensorList(
+                             self.noise_model(TensorList(latent_model_input), t=timestep, **arg_c)
+                        )
 
                     temp_x0 = sample_scheduler.step(
                         noise_pred[0].unsqueeze(0),
@@ -644,5 +714,6 @@ class WanAnimate:
                 start += clip_len - refert_num
                 end += clip_len - refert_num
 
+        guidance.report()
         videos = torch.cat(all_out_frames, dim=2)[:, :, :real_frame_len]
         return videos[0] if self.rank == 0 else None
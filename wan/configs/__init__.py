@@ -48,3 +48,8 @@ SUPPORTED_SIZES = {
                 '704*1024', '704*1280', '1280*704'),
     'animate-14B': ('720*1280', '1280*720')
 }
+
+# sequence lengths of the supported sizes are the shape buckets of the
+# compiled DiT blocks
+for _task, _sizes in SUPPORTED_SIZES.items():
+    WAN_CONFIGS[_task].compile_sizes = [SIZE_CONFIGS[u] for u in _sizes]
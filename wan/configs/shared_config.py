@@ -9,12 +9,67 @@ wan_shared_cfg = EasyDict()
 wan_shared_cfg.t5_model = 'umt5_xxl'
 wan_shared_cfg.t5_dtype = torch.bfloat16
 wan_shared_cfg.text_len = 512
+# prompt embeddings kept in memory
+wan_shared_cfg.t5_cache_size = 64
+# optional on-disk safetensors cache
+wan_shared_cfg.t5_cache_dir = None
+# 'int8' runs the encoder with dynamic int8 linear layers when it is on CPU
+wan_shared_cfg.t5_quant = None
+# pad prompts to the longest in the batch, rounded up to a multiple of this;
+# None pads to text_len
+wan_shared_cfg.t5_pad_bucket = 32
 
 # transformer
 wan_shared_cfg.param_dtype = torch.bfloat16
+# 'auto', 'fa3', 'fa2', 'sdpa' or 'chunked'
+wan_shared_cfg.attn_backend = 'auto'
+# with 'auto', time the available backends at startup
+wan_shared_cfg.attn_benchmark = False
+# move the next MoE expert during the last step of the current one
+wan_shared_cfg.expert_prefetch = True
+# 8 or 4 for weight-only quantized DiT linear layers
+wan_shared_cfg.dit_quant_bits = None
+# input channels per scale, None for per-channel scales
+wan_shared_cfg.dit_quant_group_size = None
+# stream DiT blocks from host memory, at most this many on the device;
+# disables the per-block cross attention key / value cache
+wan_shared_cfg.offload_blocks = None
+# torch.compile every DiT block, shapes bucketed to compile_sizes
+wan_shared_cfg.compile_blocks = False
+wan_shared_cfg.compile_backend = 'inductor'
+wan_shared_cfg.compile_mode = None
+# persistent inductor cache shared by warm workers, set up once at startup by
+# generate.py / WanWorker
+wan_shared_cfg.compile_cache_dir = None
+# (width, height) of the sizes seq_len is bucketed to, set per task
+wan_shared_cfg.compile_sizes = []
+# 'first_block' or 'timestep' to reuse the block residual of similar steps
+wan_shared_cfg.step_cache = None
+# relative L1 change below which a step is skipped
+wan_shared_cfg.step_cache_threshold = 0.05
+# consecutive skipped steps per guidance branch
+wan_shared_cfg.step_cache_max_skips = 2
+# steps always computed at the start
+wan_shared_cfg.step_cache_warmup_steps = 1
+
+# vae
+# (h, w) in latent units to encode / decode in spatial tiles
+wan_shared_cfg.vae_tile_size = None
+wan_shared_cfg.vae_tile_overlap = (8, 8)
 
 # inference
 wan_shared_cfg.num_train_timesteps = 1000
 wan_shared_cfg.sample_fps = 16
 wan_shared_cfg.sample_neg_prompt = '色调艳丽，过曝，静态，细节模糊不清，字幕，风格，作品，画作，画面，静止，整体发灰，最差质量，低质量，JPEG压缩残留，丑陋的，残缺的，多余的手指，画得不好的手部，画得不好的脸部，畸形的，毁容的，形态畸形的肢体，手指融合，静止不动的画面，杂乱的背景，三条腿，背景人很多，倒着走'
 wan_shared_cfg.frame_num = 81
+# precompute the solver coefficients on the device, no host syncs in the
+# sampling loop
+wan_shared_cfg.device_scheduler = False
+# (low, high) of t / num_train_timesteps within which guidance is applied
+wan_shared_cfg.cfg_interval = None
+# run the unconditional pass every k steps, reusing the guidance delta in
+# between
+wan_shared_cfg.cfg_every = 1
+# drop the unconditional pass once its cosine similarity to the conditional
+# one reaches this
+wan_shared_cfg.cfg_adaptive_threshold = None
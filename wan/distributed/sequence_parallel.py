@@ -2,7 +2,8 @@
 import torch
 import torch.cuda.amp as amp
 
-from ..modules.model import sinusoidal_embedding_1d
+from ..modules.model import rope_apply as _rope_apply
+from ..modules.model import rope_cos_sin
 from .ulysses import distributed_attention
 from .util import gather_forward, get_rank, get_world_size
 
@@ -20,45 +21,49 @@ def pad_freqs(original_tensor, target_len):
     return padded_tensor
 
 
+def shard_rope_freqs(freqs, s):
+    r"""
+    Slices full-length (cos, sin) rope tables to the `s` positions owned by
+    this sequence parallel rank.
+    """
+    sp_rank = get_rank()
+    return tuple(u[:, sp_rank * s:(sp_rank + 1) * s] for u in freqs)
+
+
+def shard_time_embeddings(e, e0, segments, s):
+    r"""
+    Restricts the output of `WanModel.time_embeddings` to the `s` tokens owned
+    by this sequence parallel rank.
+    """
+    if segments is None:
+        if e.size(1) == 1:
+            return e, e0, None
+        return (torch.chunk(e, get_world_size(), dim=1)[get_rank()],
+                torch.chunk(e0, get_world_size(), dim=1)[get_rank()], None)
+
+    start = get_rank() * s
+    index, shard = [], []
+    for i, (a, b) in enumerate(segments):
+        a, b = max(a, start), min(b, start + s)
+        if a < b:
+            index.append(i)
+            shard.append((a - start, b - start))
+    return e[:, index], e0[:, index], shard if len(shard) > 1 else None
+
+
 @torch.amp.autocast('cuda', enabled=False)
 def rope_apply(x, grid_sizes, freqs):
     """
     x:          [B, L, N, C].
     grid_sizes: [B, 3].
-    freqs:      [M, C // 2].
+    freqs:      [M, C // 2] complex table, or (cos, sin) tables already
+                sharded for this rank, each [B or 1, L, 1, C // 2].
     """
-    s, n, c = x.size(1), x.size(2), x.size(3) // 2
-    # split freqs
-    freqs = freqs.split([c - 2 * (c // 3), c // 3, c // 3], dim=1)
-
-    # loop over samples
-    output = []
-    for i, (f, h, w) in enumerate(grid_sizes.tolist()):
-        seq_len = f * h * w
-
-        # precompute multipliers
-        x_i = torch.view_as_complex(x[i, :s].to(torch.float64).reshape(
-            s, n, -1, 2))
-        freqs_i = torch.cat([
-            freqs[0][:f].view(f, 1, 1, -1).expand(f, h, w, -1),
-            freqs[1][:h].view(1, h, 1, -1).expand(f, h, w, -1),
-            freqs[2][:w].view(1, 1, w, -1).expand(f, h, w, -1)
-        ],
-                            dim=-1).reshape(seq_len, 1, -1)
-
-        # apply rotary embedding
-        sp_size = get_world_size()
-        sp_rank = get_rank()
-        freqs_i = pad_freqs(freqs_i, s * sp_size)
-        s_per_rank = s
-        freqs_i_rank = freqs_i[(sp_rank * s_per_rank):((sp_rank + 1) *
-                                                       s_per_rank), :, :]
-        x_i = torch.view_as_real(x_i * freqs_i_rank).flatten(2)
-        x_i = torch.cat([x_i, x[i, s:]])
-
-        # append to collection
-        output.append(x_i)
-    return torch.stack(output).float()
+    if not isinstance(freqs, tuple):
+        s = x.size(1)
+        freqs = shard_rope_freqs(
+            rope_cos_sin(freqs, grid_sizes, s * get_world_size()), s)
+    return _rope_apply(x, grid_sizes, freqs)
 
 
 def sp_dit_forward(
@@ -68,11 +73,14 @@ def sp_dit_forward(
     context,
     seq_len,
     y=None,
+    t_bounds=None,
 ):
     """
     x:              A list of videos each with shape [C, T, H, W].
-    t:              [B].
+    t:              [B] or [B, seq_len].
     context:        A list of text embeddings each with shape [L, C].
+    t_bounds:       Token indices where a per-token t may change, see
+                    `time_bounds`.
     """
     if self.model_type == 'i2v':
         assert y is not None
@@ -97,44 +105,39 @@ def sp_dit_forward(
     ])
 
     # time embeddings
-    if t.dim() == 1:
-        t = t.expand(t.size(0), seq_len)
-    with torch.amp.autocast('cuda', dtype=torch.float32):
-        bt = t.size(0)
-        t = t.flatten()
-        e = self.time_embedding(
-            sinusoidal_embedding_1d(self.freq_dim,
-                                    t).unflatten(0, (bt, seq_len)).float())
-        e0 = self.time_projection(e).unflatten(2, (6, self.dim))
-        assert e.dtype == torch.float32 and e0.dtype == torch.float32
+    e, e0, segments = self.time_embeddings(t, seq_len, t_bounds)
 
     # context
     context_lens = None
-    context = self.text_embedding(
-        torch.stack([
-            torch.cat([u, u.new_zeros(self.text_len - u.size(0), u.size(1))])
-            for u in context
-        ]))
+    context = self.embed_context(context)
 
     # Context Parallel
     x = torch.chunk(x, get_world_size(), dim=1)[get_rank()]
-    e = torch.chunk(e, get_world_size(), dim=1)[get_rank()]
-    e0 = torch.chunk(e0, get_world_size(), dim=1)[get_rank()]
+    e, e0, segments = shard_time_embeddings(e, e0, segments, x.size(1))
 
     # arguments
     kwargs = dict(
         e=e0,
         seq_lens=seq_lens,
         grid_sizes=grid_sizes,
-        freqs=self.freqs,
+        freqs=shard_rope_freqs(
+            self.rope_freqs(grid_sizes, seq_len), x.size(1)),
         context=context,
-        context_lens=context_lens)
+        context_lens=context_lens,
+        segments=segments)
+
+    def run_blocks(x, start=0, end=None):
+        for block in self.blocks[start:end]:
+            x = block(x, **kwargs)
+        return x
 
-    for block in self.blocks:
-        x = block(x, **kwargs)
+    if self.step_cache is not None and not torch.is_grad_enabled():
+        x = self.step_cache(context, x, run_blocks, e0)
+    else:
+        x = run_blocks(x)
 
     # head
-    x = self.head(x, e)
+    x = self.head(x, e, segments)
 
     # Context Parallel
     x = gather_forward(x, dim=1)
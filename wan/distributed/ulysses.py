@@ -2,7 +2,7 @@
 import torch
 import torch.distributed as dist
 
-from ..modules.attention import flash_attention
+from ..modules.attention import attention
 from .util import all_to_all
 
 
@@ -34,7 +34,7 @@ def distributed_attention(
     v = all_to_all(v, scatter_dim=2, gather_dim=1)
 
     # apply attention
-    x = flash_attention(
+    x = attention(
         q,
         k,
         v,
@@ -0,0 +1,412 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import logging
+import math
+import random
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+import torch
+import torch.distributed as dist
+
+from .modules.model import clear_context_cache, time_bounds
+from .utils.fm_solvers import get_sampling_sigmas, retrieve_timesteps
+from .utils.fm_solvers_device import scheduler_class
+from .utils.guidance import GuidancePolicy
+from .utils.utils import masks_like
+from .utils.video_writer import VideoWriter
+from .worker import GenerationJob
+
+__all__ = ['ContinuousBatchingEngine']
+
+
+class _Sample:
+
+    def __init__(self, job, latent, z, mask, t_bounds, context, context_null,
+                 scheduler, timesteps, generator, guidance):
+        r"""
+        Sampling state of one request in the running batch.
+        """
+        self.job = job
+        self.latent = latent
+        self.z = z
+        self.mask = mask
+        self.t_bounds = t_bounds
+        self.context = context
+        self.context_null = context_null
+        self.scheduler = scheduler
+        self.timesteps = timesteps
+        self.generator = generator
+        self.guidance = guidance
+        self.step = 0
+
+    @property
+    def done(self):
+        return self.step == len(self.timesteps)
+
+
+class ContinuousBatchingEngine:
+
+    def __init__(self,
+                 pipeline,
+                 max_batch_size=4,
+                 batch_cfg=False,
+                 keep_video=True):
+        r"""
+        Iteration-level continuous batching on top of a `WanTI2V` pipeline.
+        Every iteration runs one denoising step of all running requests as a
+        single DiT forward, each sample at its own timestep through the
+        per-sample, per-token timestep tensor. New requests join the running
+        batch at their step 0 between iterations and finished requests leave
+        it right away, their VAE decode runs on a separate thread (and CUDA
+        stream) while the batch keeps denoising.
+
+        Every request keeps its own scheduler, noise generator and guidance
+        policy, so it follows the trajectory of a single `generate` call with
+        its seed up to the numerics of the batched forward. Requests may differ
+        in solver, step count, shift, guidance scale and prompts. Only requests
+        with the same latent shape share a batch: a request of another shape
+        waits at the head of the queue, which stops further admissions, until
+        the running batch has drained.
+
+        The DiT stays on the device. Sequence parallel and FSDP are not
+        supported.
+
+        Args:
+            pipeline (`WanTI2V`):
+                Loaded TI2V-5B pipeline.
+            max_batch_size (`int`, *optional*, defaults to 4):
+                Maximum number of requests in the running batch.
+            batch_cfg (`bool`, *optional*, defaults to False):
+                Run the conditional and unconditional passes as one forward.
+            keep_video (`bool`, *optional*, defaults to True):
+                Keep the decoded video tensor on the finished job. Disable when
+                only `save_file` is needed.
+        """
+        assert not dist.is_initialized() or dist.get_world_size() == 1, \
+            'ContinuousBatchingEngine runs on a single device.'
+        self.pipeline = pipeline
+        self.config = pipeline.config
+        self.device = pipeline.device
+        self.max_batch_size = max(1, max_batch_size)
+        self.batch_cfg = batch_cfg
+        self.keep_video = keep_video
+
+        # iterations run and sample steps taken, see `stats`
+        self.num_iterations = 0
+        self.num_sample_steps = 0
+
+        self._pending = deque()
+        self._running = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._decode_queue = deque()
+        self._decode_cond = threading.Condition()
+        self._vae_lock = threading.Lock()
+        self._decode_stream = torch.cuda.Stream(
+            self.device) if self.device.type == 'cuda' else None
+
+        self._thread = threading.Thread(
+            target=self._run, name='wan-engine', daemon=True)
+        self._decode_thread = threading.Thread(
+            target=self._run_decode, name='wan-engine-decode', daemon=True)
+        self._thread.start()
+        self._decode_thread.start()
+
+    def submit(self, prompt, **kwargs):
+        r"""
+        Queues a ti2v-5B request and returns its `GenerationJob`. The job's
+        `future` resolves to the job itself once `video` / `save_file` are set.
+        Keyword arguments are forwarded to `GenerationJob`.
+        """
+        job = GenerationJob('ti2v-5B', prompt, **kwargs)
+        shape = self._latent_shape(job)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Engine is closed.')
+            self._pending.append((job, shape))
+            self._cond.notify()
+        return job
+
+    def generate(self, prompt, timeout=None, **kwargs):
+        r"""
+        Blocking variant of `submit`.
+        """
+        return self.submit(prompt, **kwargs).future.result(timeout)
+
+    def qsize(self):
+        with self._cond:
+            return len(self._pending)
+
+    def stats(self):
+        r"""
+        Number of iterations, of sample steps and the mean batch size so far.
+        """
+        return dict(
+            iterations=self.num_iterations,
+            sample_steps=self.num_sample_steps,
+            mean_batch_size=self.num_sample_steps /
+            max(self.num_iterations, 1))
+
+    def close(self, wait=True):
+        r"""
+        Stops accepting requests. Queued and running requests are finished.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if wait:
+            self._thread.join()
+            self._decode_thread.join()
+
+    def _latent_shape(self, job):
+        p = self.pipeline
+        if job.img is None:
+            w, h = job.size
+        else:
+            w, h = p.output_size(job.img, job.max_area)
+        return (p.vae.model.z_dim, (job.frame_num - 1) // p.vae_stride[0] + 1,
+                h // p.vae_stride[1], w // p.vae_stride[2])
+
+    def _admit(self):
+        r"""
+        Pops the queued requests that join the running batch. Blocks while
+        there is nothing to do, returns None once closed and drained.
+        """
+        with self._cond:
+            while not self._pending and not self._running:
+                if self._closed:
+                    return None
+                self._cond.wait()
+            admitted = []
+            while (self._pending and
+                   len(self._running) + len(admitted) < self.max_batch_size):
+                job, shape = self._pending[0]
+                if self._running:
+                    ref = tuple(self._running[0].latent.shape)
+                elif admitted:
+                    ref = admitted[0][1]
+                else:
+                    ref = shape
+                if shape != ref:
+                    break
+                self._pending.popleft()
+                if job.future.set_running_or_notify_cancel():
+                    admitted.append((job, shape))
+            return admitted
+
+    def _run(self):
+        p = self.pipeline
+        if p.init_on_cpu:
+            p.model.to(self.device)
+        autocast = torch.amp.autocast(
+            self.device.type,
+            dtype=p.param_dtype,
+            enabled=self.device.type == 'cuda')
+        while True:
+            admitted = self._admit()
+            if admitted is None:
+                break
+            with autocast, torch.no_grad():
+                for job, shape in admitted:
+                    try:
+                        self._running.append(self._start(job, shape))
+                    except BaseException as e:
+                        logging.exception('Engine request failed to start.')
+                        job.future.set_exception(e)
+                if not self._running:
+                    continue
+                try:
+                    self._iterate()
+                except BaseException as e:
+                    logging.exception('Engine iteration failed.')
+                    for sample in self._running:
+                        sample.job.future.set_exception(e)
+                    self._running = []
+            if not self._running:
+                clear_context_cache(p.model)
+        stats = self.stats()
+        logging.info(f"Engine ran {stats['sample_steps']} sample steps in "
+                     f"{stats['iterations']} iterations, mean batch size "
+                     f"{stats['mean_batch_size']:.2f}.")
+        self._put_decode(None)
+
+    def _encode_text(self, prompts):
+        p = self.pipeline
+        if not p.t5_cpu:
+            if not p.text_encoder.is_cached(prompts):
+                p.text_encoder.model.to(self.device)
+            return p.text_encoder(prompts, self.device)
+        context = p.text_encoder(prompts, torch.device('cpu'))
+        return [t.to(self.device) for t in context]
+
+    def _start(self, job, shape):
+        r"""
+        Encodes the prompts (and image) of `job` and sets up its noise,
+        scheduler and guidance policy.
+        """
+        p, cfg = self.pipeline, self.config
+        job.started_at = time.time()
+        if job.on_start is not None:
+            job.on_start(job)
+
+        seed = job.seed if job.seed >= 0 else random.randint(0, sys.maxsize)
+        generator = torch.Generator(device=self.device)
+        generator.manual_seed(seed)
+        noise = torch.randn(
+            *shape, dtype=torch.float32, generator=generator, device=self.device)
+
+        n_prompt = job.n_prompt if job.n_prompt != "" else p.sample_neg_prompt
+        context, context_null = self._encode_text([job.prompt, n_prompt])
+
+        z = None
+        _, mask = masks_like([noise], zero=job.img is not None)
+        mask, latent = mask[0], noise
+        if job.img is not None:
+            with self._vae_lock:
+                z = p.vae.encode([p.preprocess_image(job.img,
+                                                     job.max_area)])[0]
+            latent = (1. - mask) * z + mask * latent
+        # the per-token timestep only changes where the mask does
+        _, f, h, w = shape
+        t_bounds = time_bounds(
+            mask[0][:, ::2, ::2],
+            math.ceil(f * h * w / (p.patch_size[1] * p.patch_size[2])))
+
+        scheduler = scheduler_class(job.sample_solver, cfg.device_scheduler)(
+            num_train_timesteps=cfg.num_train_timesteps,
+            shift=1,
+            use_dynamic_shifting=False)
+        if job.sample_solver == 'unipc':
+            scheduler.set_timesteps(
+                job.sampling_steps, device=self.device, shift=job.shift)
+            timesteps = scheduler.timesteps
+        else:
+            timesteps, _ = retrieve_timesteps(
+                scheduler,
+                device=self.device,
+                sigmas=get_sampling_sigmas(job.sampling_steps, job.shift))
+        guidance = GuidancePolicy.from_config(cfg).plan(timesteps)
+        return _Sample(job, latent, z, mask, t_bounds, context, context_null,
+                       scheduler, timesteps, generator, guidance)
+
+    def _iterate(self):
+        r"""
+        One denoising step of every running sample.
+        """
+        p, samples = self.pipeline, self._running
+        _, f, h, w = samples[0].latent.shape
+        seq_len = math.ceil(f * h * w / (p.patch_size[1] * p.patch_size[2]))
+
+        timesteps = []
+        for sample in samples:
+            timestep = torch.stack([sample.timesteps[sample.step]])
+            temp_ts = (sample.mask[0][:, ::2, ::2] * timestep).flatten()
+            timesteps.append(
+                torch.cat([
+                    temp_ts,
+                    temp_ts.new_ones(seq_len - temp_ts.size(0)) * timestep
+                ]))
+        t = torch.stack(timesteps)
+        t_bounds = sorted(
+            set().union(*(sample.t_bounds for sample in samples)))
+        x = [sample.latent for sample in samples]
+        context = [sample.context for sample in samples]
+
+        uncond = [
+            i for i, sample in enumerate(samples)
+            if sample.guidance.use_uncond(sample.step)
+        ]
+        x_null = [x[i] for i in uncond]
+        context_null = [samples[i].context_null for i in uncond]
+        if uncond and self.batch_cfg:
+            noise_pred = p.model(
+                x + x_null,
+                t=torch.cat([t, t[uncond]]),
+                context=context + context_null,
+                seq_len=seq_len,
+                t_bounds=t_bounds)
+            noise_pred_cond = noise_pred[:len(samples)]
+            noise_pred_uncond = noise_pred[len(samples):]
+        else:
+            noise_pred_cond = p.model(
+                x, t=t, context=context, seq_len=seq_len, t_bounds=t_bounds)
+            noise_pred_uncond = []
+            if uncond:
+                noise_pred_uncond = p.model(
+                    x_null,
+                    t=t[uncond],
+                    context=context_null,
+                    seq_len=seq_len,
+                    t_bounds=t_bounds)
+        noise_pred_uncond = dict(zip(uncond, noise_pred_uncond))
+
+        for i, sample in enumerate(samples):
+            noise_pred = sample.guidance(sample.step, noise_pred_cond[i],
+                                         noise_pred_uncond.get(i),
+                                         sample.job.guide_scale)
+            latent = sample.scheduler.step(
+                noise_pred.unsqueeze(0),
+                sample.timesteps[sample.step],
+                sample.latent.unsqueeze(0),
+                return_dict=False,
+                generator=sample.generator)[0].squeeze(0)
+            if sample.z is not None:
+                latent = (1. - sample.mask) * sample.z + sample.mask * latent
+            sample.latent = latent
+            sample.step += 1
+
+        self.num_iterations += 1
+        self.num_sample_steps += len(samples)
+        self._running = [sample for sample in samples if not sample.done]
+        for sample in samples:
+            if sample.done:
+                sample.guidance.report()
+                event = None
+                if self._decode_stream is not None:
+                    event = torch.cuda.Event()
+                    event.record()
+                self._put_decode((sample, event))
+
+    def _put_decode(self, item):
+        with self._decode_cond:
+            self._decode_queue.append(item)
+            self._decode_cond.notify()
+
+    def _run_decode(self):
+        stream = nullcontext() if self._decode_stream is None else \
+            torch.cuda.stream(self._decode_stream)
+        while True:
+            with self._decode_cond:
+                while not self._decode_queue:
+                    self._decode_cond.wait()
+                item = self._decode_queue.popleft()
+            if item is None:
+                break
+            sample, event = item
+            job = sample.job
+            try:
+                with stream, torch.no_grad(), self._vae_lock:
+                    if event is not None:
+                        self._decode_stream.wait_event(event)
+                        sample.latent.record_stream(self._decode_stream)
+                    if job.save_file is not None:
+                        with VideoWriter(
+                                job.save_file,
+                                fps=self.config.sample_fps) as writer:
+                            video = self.pipeline.vae.decode(
+                                [sample.latent], writer=writer)[0]
+                    else:
+                        video = self.pipeline.vae.decode([sample.latent])[0]
+                    if self.keep_video:
+                        job.video = video.cpu()
+                job.finished_at = time.time()
+                logging.info(
+                    f"Finished {job.task} request in {job.elapsed:.1f}s.")
+                job.future.set_result(job)
+            except BaseException as e:
+                logging.exception('Engine decode failed.')
+                job.future.set_exception(e)
+            del sample, item
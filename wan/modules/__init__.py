@@ -1,5 +1,5 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
-from .attention import flash_attention
+from .attention import attention, flash_attention, set_attention_backend
 from .model import WanModel
 from .t5 import T5Decoder, T5Encoder, T5EncoderModel, T5Model
 from .tokenizers import HuggingfaceTokenizer
@@ -16,4 +16,6 @@ __all__ = [
     'T5EncoderModel',
     'HuggingfaceTokenizer',
     'flash_attention',
+    'attention',
+    'set_attention_backend',
 ]
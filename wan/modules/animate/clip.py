@@ -1,6 +1,5 @@
 # Modified from ``https://github.com/openai/CLIP'' and ``https://github.com/mlfoundations/open_clip''
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
-import logging
 import math
 
 import torch
@@ -9,6 +8,7 @@ import torch.nn.functional as F
 import torchvision.transforms as T
 
 from ..attention import flash_attention
+from ..checkpoint import load_checkpoint
 from ..tokenizers import HuggingfaceTokenizer
 from .xlm_roberta import XLMRoberta
 
@@ -512,11 +512,9 @@ class CLIPModel:
             return_transforms=True,
             return_tokenizer=False,
             dtype=dtype,
-            device=device)
-        self.model = self.model.eval().requires_grad_(False)
-        logging.info(f'loading {checkpoint_path}')
-        self.model.load_state_dict(
-            torch.load(checkpoint_path, map_location='cpu'))
+            device='meta')
+        self.model = load_checkpoint(self.model, checkpoint_path, dtype=dtype)
+        self.model = self.model.to(device).eval().requires_grad_(False)
 
         # init tokenizer
         self.tokenizer = HuggingfaceTokenizer(
@@ -20,17 +20,20 @@ from ...distributed.sequence_parallel import (
 )
 
 
+from ..attention import attention
+from ..fused_ops import gated_residual, layer_norm_modulate
 from ..model import (
+    ContextCache,
     Head,
     WanAttentionBlock,
     WanLayerNorm,
     WanRMSNorm,
     WanModel,
     WanSelfAttention,
-    flash_attention,
     rope_params,
     sinusoidal_embedding_1d,
-    rope_apply
+    rope_apply,
+    clear_context_cache
 )
 
 from .face_blocks import FaceEncoder, FaceAdapter
@@ -47,7 +50,7 @@ class HeadAnimate(Head):
         assert e.dtype == torch.float32
         with amp.autocast(dtype=torch.float32):
             e = (self.modulation + e.unsqueeze(1)).chunk(2, dim=1)
-            x = (self.head(self.norm(x) * (1 + e[1]) + e[0]))
+            x = self.head(layer_norm_modulate(x, e[0], e[1], self.norm.eps))
         return x
 
 
@@ -72,12 +75,13 @@ class WanAnimateSelfAttention(WanSelfAttention):
 
         q, k, v = qkv_fn(x)
 
-        x = flash_attention(
+        x = attention(
             q=rope_apply(q, grid_sizes, freqs),
             k=rope_apply(k, grid_sizes, freqs),
             v=v,
             k_lens=seq_lens,
-            window_size=self.window_size)
+            window_size=self.window_size,
+            backend=self.attn_backend)
 
         # output
         x = x.flatten(2)
@@ -108,6 +112,7 @@ class WanAnimateCrossAttention(WanSelfAttention):
             self.k_img = nn.Linear(dim, dim)
             self.v_img = nn.Linear(dim, dim)
             self.norm_k_img = WanRMSNorm(dim, eps=eps) if qk_norm else nn.Identity()
+        self._context_cache = ContextCache()
 
     def forward(self, x, context, context_lens):
         """
@@ -115,25 +120,18 @@ class WanAnimateCrossAttention(WanSelfAttention):
         context:        [B, L2, C].
         context_lens:   [B].
         """
-        if self.use_img_emb:
-            context_img = context[:, :257]
-            context = context[:, 257:]
-        else:
-            context = context
-
         b, n, d = x.size(0), self.num_heads, self.head_dim
 
         # compute query, key, value
         q = self.norm_q(self.q(x)).view(b, -1, n, d)
-        k = self.norm_k(self.k(context)).view(b, -1, n, d)
-        v = self.v(context).view(b, -1, n, d)
+        k, v, k_img, v_img = self._context_cache.get(
+            (context,), lambda: self.project_context(context))
 
         if self.use_img_emb:
-            k_img = self.norm_k_img(self.k_img(context_img)).view(b, -1, n, d)
-            v_img = self.v_img(context_img).view(b, -1, n, d)
-            img_x = flash_attention(q, k_img, v_img, k_lens=None)
+            img_x = attention(
+                q, k_img, v_img, k_lens=None, backend=self.attn_backend)
         # compute attention
-        x = flash_attention(q, k, v, k_lens=context_lens)
+        x = attention(q, k, v, k_lens=context_lens, backend=self.attn_backend)
 
         # output
         x = x.flatten(2)
@@ -145,6 +143,23 @@ class WanAnimateCrossAttention(WanSelfAttention):
         x = self.o(x)
         return x
 
+    def project_context(self, context):
+        """
+        Keys and values of the text tokens and, with `use_img_emb`, of the
+        leading 257 CLIP image tokens (None otherwise), cached for all sampling
+        steps of a request.
+        """
+        b, n, d = context.size(0), self.num_heads, self.head_dim
+        k_img = v_img = None
+        if self.use_img_emb:
+            context_img = context[:, :257]
+            context = context[:, 257:]
+            k_img = self.norm_k_img(self.k_img(context_img)).view(b, -1, n, d)
+            v_img = self.v_img(context_img).view(b, -1, n, d)
+        k = self.norm_k(self.k(context)).view(b, -1, n, d)
+        v = self.v(context).view(b, -1, n, d)
+        return k, v, k_img, v_img
+
 
 class WanAnimateAttentionBlock(nn.Module):
     def __init__(self,
@@ -210,17 +225,15 @@ class WanAnimateAttentionBlock(nn.Module):
 
         # self-attention
         y = self.self_attn(
-            self.norm1(x).float() * (1 + e[1]) + e[0], seq_lens, grid_sizes, freqs
-        )
-        with amp.autocast(dtype=torch.float32):
-            x = x + y * e[2]
+            layer_norm_modulate(x, e[0], e[1], self.norm1.eps), seq_lens,
+            grid_sizes, freqs)
+        x = gated_residual(x, y, e[2])
 
         # cross-attention & ffn function
         def cross_attn_ffn(x, context, context_lens, e):
             x = x + self.cross_attn(self.norm3(x), context, context_lens)
-            y = self.ffn(self.norm2(x).float() * (1 + e[4]) + e[3])
-            with amp.autocast(dtype=torch.float32):
-                x = x + y * e[5]
+            y = self.ffn(layer_norm_modulate(x, e[3], e[4], self.norm2.eps))
+            x = gated_residual(x, y, e[5])
             return x
 
         x = cross_attn_ffn(x, context, context_lens, e)
@@ -245,6 +258,7 @@ class MLPProj(torch.nn.Module):
 
 class WanAnimateModel(ModelMixin, ConfigMixin, PeftAdapterMixin):
     _no_split_modules = ['WanAttentionBlock']
+    step_cache = None
 
     @register_to_config
     def __init__(self,
@@ -320,7 +334,8 @@ class WanAnimateModel(ModelMixin, ConfigMixin, PeftAdapterMixin):
         ], dim=1)
 
         self.img_emb = MLPProj(1280, dim)
-        
+        self._context_cache = ContextCache()
+
         # initialize weights
         self.init_weights()
 
@@ -412,16 +427,7 @@ class WanAnimateModel(ModelMixin, ConfigMixin, PeftAdapterMixin):
 
         # context
         context_lens = None
-        context = self.text_embedding(
-            torch.stack([
-                torch.cat(
-                    [u, u.new_zeros(self.text_len - u.size(0), u.size(1))])
-                for u in context
-            ]))
-
-        if self.use_img_emb:
-            context_clip = self.img_emb(clip_fea) # bs x 257 x dim
-            context = torch.concat([context_clip, context], dim=1)
+        context = self.embed_context(context, clip_fea)
 
         # arguments
         kwargs = dict(
@@ -435,9 +441,16 @@ class WanAnimateModel(ModelMixin, ConfigMixin, PeftAdapterMixin):
         if self.use_context_parallel:
             x = torch.chunk(x, get_world_size(), dim=1)[get_rank()]
 
-        for idx, block in enumerate(self.blocks):
-            x = block(x, **kwargs)
-            x = self.after_transformer_block(idx, x, motion_vec)
+        def run_blocks(x, start=0, end=None):
+            for idx in range(start, len(self.blocks) if end is None else end):
+                x = self.blocks[idx](x, **kwargs)
+                x = self.after_transformer_block(idx, x, motion_vec)
+            return x
+
+        if self.step_cache is not None and not torch.is_grad_enabled():
+            x = self.step_cache(context, x, run_blocks, e0)
+        else:
+            x = run_blocks(x)
 
         # head
         x = self.head(x, e)
@@ -450,6 +463,36 @@ class WanAnimateModel(ModelMixin, ConfigMixin, PeftAdapterMixin):
         return [u.float() for u in x]
 
 
+    def embed_context(self, context, clip_fea):
+        r"""
+        Text embeddings zero-padded to `text_len` and passed through
+        `text_embedding`, preceded by the 257 CLIP image tokens when
+        `use_img_emb`. The result is reused while the same context and CLIP
+        features are passed in, see `ContextCache`.
+        """
+
+        def embed():
+            embedded = self.text_embedding(
+                torch.stack([
+                    torch.cat(
+                        [u, u.new_zeros(self.text_len - u.size(0), u.size(1))])
+                    for u in context
+                ]))
+            if self.use_img_emb:
+                context_clip = self.img_emb(clip_fea)  # bs x 257 x dim
+                embedded = torch.concat([context_clip, embedded], dim=1)
+            return embedded
+
+        keys = list(context) + ([clip_fea] if self.use_img_emb else [])
+        return self._context_cache.get(keys, embed)
+
+    def clear_context_cache(self):
+        r"""
+        Releases the cached context embeddings and cross attention keys and
+        values, called at the end of a request.
+        """
+        clear_context_cache(self)
+
     def unpatchify(self, x, grid_sizes):
         r"""
         Reconstruct video tensors from patch embeddings.
@@ -13,13 +13,25 @@ try:
 except ModuleNotFoundError:
     FLASH_ATTN_2_AVAILABLE = False
 
+import logging
+import time
 import warnings
 
 __all__ = [
     'flash_attention',
     'attention',
+    'ATTENTION_BACKENDS',
+    'register_attention_backend',
+    'available_attention_backends',
+    'get_attention_backend',
+    'set_attention_backend',
 ]
 
+ATTENTION_BACKENDS = {}
+
+# name of the backend used when a module does not pick one
+_default_backend = 'auto'
+
 
 def flash_attention(
     q,
@@ -130,6 +142,251 @@ def flash_attention(
     return x.type(out_dtype)
 
 
+def register_attention_backend(name, is_available=lambda device: True):
+    r"""
+    Decorator registering an attention implementation under `name`.
+
+    The function receives `q, k, v` of shape [B, L, N, C] plus the keyword
+    arguments of `attention` and returns [B, Lq, Nq, C2] in the dtype of `q`.
+    `is_available(device)` tells whether it can run on a `torch.device`.
+    """
+
+    def decorator(fn):
+        ATTENTION_BACKENDS[name] = (fn, is_available)
+        return fn
+
+    return decorator
+
+
+def available_attention_backends(device=None):
+    r"""
+    Returns the names of the registered backends usable on `device`.
+    """
+    device = torch.device(device or
+                          ('cuda' if torch.cuda.is_available() else 'cpu'))
+    return [
+        name for name, (_, is_available) in ATTENTION_BACKENDS.items()
+        if is_available(device)
+    ]
+
+
+@register_attention_backend(
+    'fa3', lambda device: device.type == 'cuda' and FLASH_ATTN_3_AVAILABLE)
+def _fa3_attention(q, k, v, **kwargs):
+    return flash_attention(q, k, v, version=3, **kwargs)
+
+
+@register_attention_backend(
+    'fa2', lambda device: device.type == 'cuda' and FLASH_ATTN_2_AVAILABLE)
+def _fa2_attention(q, k, v, **kwargs):
+    return flash_attention(q, k, v, version=2, **kwargs)
+
+
+def _attention_mask(q, k, q_lens, k_lens, causal, window_size):
+    r"""
+    Boolean mask [B or 1, 1, Lq, Lk], True where attention is allowed, or None
+    when every query may attend to every key.
+    """
+    lq, lk = q.size(1), k.size(1)
+    mask = None
+    if k_lens is not None:
+        # keep at least one key so fully padded rows do not produce NaN
+        k_lens = k_lens.to(q.device).clamp(min=1)
+        mask = (torch.arange(lk, device=q.device).view(1, 1, 1, lk) <
+                k_lens.view(-1, 1, 1, 1))
+    if causal or tuple(window_size) != (-1, -1):
+        # flash attention aligns the causal diagonal to the bottom right
+        rel = torch.arange(
+            lk, device=q.device).view(1, lk) - torch.arange(
+                lq, device=q.device).view(lq, 1) - (lk - lq)
+        band = torch.ones(lq, lk, dtype=torch.bool, device=q.device)
+        left, right = window_size
+        if causal:
+            right = 0
+        if left >= 0:
+            band = band & (rel >= -left)
+        if right >= 0:
+            band = band & (rel <= right)
+        band = band.view(1, 1, lq, lk)
+        mask = band if mask is None else mask & band
+    return mask
+
+
+def _math_dtype(q, dtype):
+    # half precision kernels on GPU, full precision on CPU
+    half_dtypes = (torch.float16, torch.bfloat16)
+    if q.device.type == 'cuda':
+        return q.dtype if q.dtype in half_dtypes else dtype
+    return q.dtype
+
+
+@register_attention_backend('sdpa')
+def _sdpa_attention(q,
+                    k,
+                    v,
+                    q_lens=None,
+                    k_lens=None,
+                    dropout_p=0.,
+                    softmax_scale=None,
+                    q_scale=None,
+                    causal=False,
+                    window_size=(-1, -1),
+                    deterministic=False,
+                    dtype=torch.bfloat16):
+    out_dtype, compute_dtype = q.dtype, _math_dtype(q, dtype)
+    if q_scale is not None:
+        q = q * q_scale
+    mask = _attention_mask(q, k, q_lens, k_lens, causal, window_size)
+
+    q = q.transpose(1, 2).to(compute_dtype)
+    k = k.transpose(1, 2).to(compute_dtype)
+    v = v.transpose(1, 2).to(compute_dtype)
+    if k.size(1) != q.size(1):
+        k = k.repeat_interleave(q.size(1) // k.size(1), dim=1)
+        v = v.repeat_interleave(q.size(1) // v.size(1), dim=1)
+
+    out = torch.nn.functional.scaled_dot_product_attention(
+        q, k, v, attn_mask=mask, dropout_p=dropout_p, scale=softmax_scale)
+    return out.transpose(1, 2).contiguous().type(out_dtype)
+
+
+@register_attention_backend('chunked')
+def _chunked_attention(q,
+                       k,
+                       v,
+                       q_lens=None,
+                       k_lens=None,
+                       dropout_p=0.,
+                       softmax_scale=None,
+                       q_scale=None,
+                       causal=False,
+                       window_size=(-1, -1),
+                       deterministic=False,
+                       dtype=torch.bfloat16,
+                       chunk_size=1024):
+    r"""
+    Plain matmul-softmax attention evaluated over blocks of `chunk_size`
+    queries, so the score matrix never exceeds [B, N, chunk_size, Lk]. Runs
+    everywhere and serves as the numerical reference.
+    """
+    out_dtype, compute_dtype = q.dtype, _math_dtype(q, dtype)
+    if q_scale is not None:
+        q = q * q_scale
+    scale = softmax_scale or q.size(-1)**-0.5
+    mask = _attention_mask(q, k, q_lens, k_lens, causal, window_size)
+
+    q = q.transpose(1, 2).to(compute_dtype)
+    k = k.transpose(1, 2).to(compute_dtype)
+    v = v.transpose(1, 2).to(compute_dtype)
+    if k.size(1) != q.size(1):
+        k = k.repeat_interleave(q.size(1) // k.size(1), dim=1)
+        v = v.repeat_interleave(q.size(1) // v.size(1), dim=1)
+
+    out = []
+    for i in range(0, q.size(2), chunk_size):
+        attn = torch.matmul(q[:, :, i:i + chunk_size],
+                            k.transpose(-1, -2)).float() * scale
+        if mask is not None:
+            attn = attn.masked_fill(~mask[:, :, i:i + chunk_size]
+                                    if mask.size(2) > 1 else ~mask,
+                                    torch.finfo(attn.dtype).min)
+        attn = attn.softmax(dim=-1).to(v.dtype)
+        if dropout_p > 0:
+            attn = torch.nn.functional.dropout(attn, p=dropout_p)
+        out.append(torch.matmul(attn, v))
+    return torch.cat(out, dim=2).transpose(1, 2).contiguous().type(out_dtype)
+
+
+def _resolve_backend(name, device):
+    if name != 'auto':
+        if name not in ATTENTION_BACKENDS:
+            raise ValueError(f"Unknown attention backend '{name}', expected "
+                             f"one of {list(ATTENTION_BACKENDS)} or 'auto'.")
+        return name
+    for candidate in ('fa3', 'fa2', 'sdpa'):
+        if candidate in ATTENTION_BACKENDS and ATTENTION_BACKENDS[candidate][1](
+                device):
+            return candidate
+    return 'chunked'
+
+
+def get_attention_backend():
+    r"""
+    Returns the name of the default attention backend.
+    """
+    return _default_backend
+
+
+def benchmark_attention_backends(device,
+                                 seq_len=4096,
+                                 num_heads=12,
+                                 head_dim=128,
+                                 dtype=torch.bfloat16,
+                                 repeats=3):
+    r"""
+    Times every backend available on `device` on one self-attention call of
+    the given shape and returns `{name: seconds}`. Failing backends are
+    skipped.
+    """
+    device = torch.device(device)
+    if device.type != 'cuda':
+        dtype = torch.float32
+    q, k, v = (
+        torch.randn(1, seq_len, num_heads, head_dim, device=device,
+                    dtype=dtype) for _ in range(3))
+    k_lens = torch.tensor([seq_len], dtype=torch.int32)
+    results = {}
+    for name in available_attention_backends(device):
+        fn = ATTENTION_BACKENDS[name][0]
+        try:
+            fn(q, k, v, k_lens=k_lens)
+            if device.type == 'cuda':
+                torch.cuda.synchronize(device)
+            start = time.perf_counter()
+            for _ in range(repeats):
+                fn(q, k, v, k_lens=k_lens)
+            if device.type == 'cuda':
+                torch.cuda.synchronize(device)
+            results[name] = (time.perf_counter() - start) / repeats
+        except Exception as e:
+            logging.warning(f"Attention backend '{name}' failed: {e}")
+    return results
+
+
+def set_attention_backend(name='auto', device=None, benchmark=False):
+    r"""
+    Sets the default attention backend used by modules that do not pick one.
+
+    Args:
+        name (`str`, *optional*, defaults to 'auto'):
+            A registered backend ('fa3', 'fa2', 'sdpa', 'chunked') or 'auto',
+            which picks the first available of fa3, fa2, sdpa.
+        device (`torch.device`, *optional*, defaults to None):
+            Device the backend has to run on. Defaults to CUDA if available.
+        benchmark (`bool`, *optional*, defaults to False):
+            With 'auto', time the available backends and keep the fastest.
+
+    Returns:
+        `str`: Name of the selected backend.
+    """
+    global _default_backend
+    device = torch.device(device or
+                          ('cuda' if torch.cuda.is_available() else 'cpu'))
+    if name == 'auto' and benchmark:
+        timings = benchmark_attention_backends(device)
+        logging.info('Attention backend timings: ' + ', '.join(
+            f'{k}={v * 1000:.2f}ms' for k, v in timings.items()))
+        if timings:
+            name = min(timings, key=timings.get)
+    name = _resolve_backend(name, device)
+    if not ATTENTION_BACKENDS[name][1](device):
+        raise ValueError(
+            f"Attention backend '{name}' is not available on {device}.")
+    _default_backend = name
+    logging.info(f'Using attention backend: {name} on {device}')
+    return name
+
+
 def attention(
     q,
     k,
@@ -144,36 +401,36 @@ def attention(
     deterministic=False,
     dtype=torch.bfloat16,
     fa_version=None,
+    backend=None,
 ):
-    if FLASH_ATTN_2_AVAILABLE or FLASH_ATTN_3_AVAILABLE:
-        return flash_attention(
-            q=q,
-            k=k,
-            v=v,
-            q_lens=q_lens,
-            k_lens=k_lens,
-            dropout_p=dropout_p,
-            softmax_scale=softmax_scale,
-            q_scale=q_scale,
-            causal=causal,
-            window_size=window_size,
-            deterministic=deterministic,
-            dtype=dtype,
-            version=fa_version,
-        )
-    else:
-        if q_lens is not None or k_lens is not None:
-            warnings.warn(
-                'Padding mask is disabled when using scaled_dot_product_attention. It can have a significant impact on performance.'
-            )
-        attn_mask = None
-
-        q = q.transpose(1, 2).to(dtype)
-        k = k.transpose(1, 2).to(dtype)
-        v = v.transpose(1, 2).to(dtype)
-
-        out = torch.nn.functional.scaled_dot_product_attention(
-            q, k, v, attn_mask=attn_mask, is_causal=causal, dropout_p=dropout_p)
-
-        out = out.transpose(1, 2).contiguous()
-        return out
+    """
+    q:              [B, Lq, Nq, C1].
+    k:              [B, Lk, Nk, C1].
+    v:              [B, Lk, Nk, C2]. Nq must be divisible by Nk.
+    q_lens:         [B].
+    k_lens:         [B]. Keys past k_lens are masked out by every backend.
+    backend:        str. Registered backend name, 'auto' or None for the
+                    default set by `set_attention_backend`.
+    See `flash_attention` for the remaining arguments.
+    """
+    if backend is None:
+        backend = {3: 'fa3', 2: 'fa2'}.get(fa_version, _default_backend)
+    backend = _resolve_backend(backend, q.device)
+    if not ATTENTION_BACKENDS[backend][1](q.device):
+        # e.g. a flash attention backend picked for GPU running on CPU
+        backend = _resolve_backend('auto', q.device)
+    fn = ATTENTION_BACKENDS[backend][0]
+    return fn(
+        q,
+        k,
+        v,
+        q_lens=q_lens,
+        k_lens=k_lens,
+        dropout_p=dropout_p,
+        softmax_scale=softmax_scale,
+        q_scale=q_scale,
+        causal=causal,
+        window_size=window_size,
+        deterministic=deterministic,
+        dtype=dtype,
+    )
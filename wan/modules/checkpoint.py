@@ -0,0 +1,112 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import logging
+import os
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import load_file, save_file
+
+__all__ = [
+    'resolve_checkpoint', 'load_state_dict', 'load_checkpoint',
+    'convert_checkpoint'
+]
+
+
+def resolve_checkpoint(path):
+    r"""
+    Returns the `.safetensors` sibling of a `.pth` / `.ckpt` checkpoint if it
+    has been converted, and `path` otherwise.
+    """
+    root, ext = os.path.splitext(path)
+    if ext != '.safetensors' and os.path.exists(root + '.safetensors'):
+        return root + '.safetensors'
+    return path
+
+
+def load_state_dict(path, device='cpu'):
+    r"""
+    Loads a state dict, preferring a converted safetensors file. Safetensors
+    files are memory-mapped, so tensors loaded to CPU share pages with the
+    file instead of being copied into private host memory.
+
+    Args:
+        path (`str`):
+            Path of a `.safetensors` or `.pth` checkpoint.
+        device (`str` or `int`, *optional*, defaults to 'cpu'):
+            Device the tensors are loaded to.
+    """
+    path = resolve_checkpoint(path)
+    logging.info(f'loading {path}')
+    if path.endswith('.safetensors'):
+        return load_file(path, device=device)
+    try:
+        return torch.load(
+            path, map_location=device, mmap=True, weights_only=True)
+    except Exception:
+        # legacy (non-zip) pickles can not be mmapped
+        return torch.load(path, map_location=device)
+
+
+def load_checkpoint(model, path, device='cpu', dtype=None):
+    r"""
+    Loads a checkpoint into `model` by assigning the loaded tensors instead of
+    copying them. Build `model` under `torch.device('meta')` so that no random
+    initialisation is materialised.
+
+    Args:
+        model (`nn.Module`):
+            Module, usually on the meta device.
+        path (`str`):
+            Path of a `.safetensors` or `.pth` checkpoint.
+        device (`str` or `int`, *optional*, defaults to 'cpu'):
+            Device the tensors are loaded to.
+        dtype (`torch.dtype`, *optional*, defaults to None):
+            Dtype the module is cast to after loading.
+    """
+    model.load_state_dict(load_state_dict(path, device), assign=True)
+    if dtype is not None:
+        model.to(dtype=dtype)
+    return model
+
+
+def convert_checkpoint(src, dst=None, dtype=None):
+    r"""
+    Converts a pickled `.pth` state dict into safetensors.
+
+    Args:
+        src (`str`):
+            Source checkpoint.
+        dst (`str`, *optional*, defaults to None):
+            Output path. Defaults to `src` with a `.safetensors` extension.
+        dtype (`torch.dtype`, *optional*, defaults to None):
+            If given, floating point tensors are cast to it.
+
+    Returns:
+        `str`: The output path.
+    """
+    if dst is None:
+        dst = os.path.splitext(src)[0] + '.safetensors'
+    state_dict = torch.load(src, map_location='cpu')
+    if 'state_dict' in state_dict and isinstance(state_dict['state_dict'],
+                                                 dict):
+        state_dict = state_dict['state_dict']
+
+    tensors, storages = {}, set()
+    for k, v in state_dict.items():
+        if dtype is not None and v.is_floating_point():
+            v = v.to(dtype)
+        # safetensors refuses tensors that share storage, e.g. tied weights
+        ptr = v.untyped_storage().data_ptr()
+        if ptr in storages:
+            v = v.clone()
+        storages.add(ptr)
+        tensors[k] = v.contiguous()
+
+    tmp = dst + f'.{os.getpid()}.tmp'
+    save_file(tensors, tmp, metadata={'format': 'pt'})
+    os.replace(tmp, dst)
+
+    # sanity check that every tensor made it
+    with safe_open(dst, framework='pt') as f:
+        assert set(f.keys()) == set(tensors), f'incomplete conversion of {src}'
+    return dst
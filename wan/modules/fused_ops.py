@@ -0,0 +1,250 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import functools
+
+import torch
+import torch.nn.functional as F
+
+try:
+    import triton
+    import triton.language as tl
+    TRITON_AVAILABLE = True
+except ModuleNotFoundError:
+    TRITON_AVAILABLE = False
+
+__all__ = [
+    'modulate',
+    'gate',
+    'layer_norm_modulate',
+    'gated_residual',
+]
+
+
+def modulate(x, shift, scale, segments=None):
+    r"""
+    Computes `x * (1 + scale) + shift`.
+
+    Args:
+        x(Tensor): Shape [B, L, C]
+        shift(Tensor): Shape [B, L1, C], L1 is 1, L or len(segments)
+        scale(Tensor): Same shape as shift
+        segments(List[Tuple[int, int]], *optional*): Token ranges [start, end)
+            that share one row of shift / scale
+    """
+    if segments is None:
+        return x * (1 + scale) + shift
+    return torch.cat([
+        x[:, a:b] * (1 + scale[:, i:i + 1]) + shift[:, i:i + 1]
+        for i, (a, b) in enumerate(segments)
+    ],
+                     dim=1)
+
+
+def gate(x, g, segments=None):
+    r"""
+    Computes `x * g`, with `g` given per token or per segment, see `modulate`.
+    """
+    if segments is None:
+        return x * g
+    return torch.cat(
+        [x[:, a:b] * g[:, i:i + 1] for i, (a, b) in enumerate(segments)],
+        dim=1)
+
+
+def layer_norm_modulate(x, shift, scale, eps=1e-6, segments=None):
+    r"""
+    Fused `modulate(layer_norm(x.float()), shift, scale, segments)` of a
+    LayerNorm without affine parameters. The normalized activations stay in
+    float32 instead of being rounded to the dtype of `x` first. On CUDA this
+    is a single Triton kernel that reads `x` once and writes the result once,
+    elsewhere the modulation is applied in place to the normalized tensor.
+
+    Args:
+        x(Tensor): Shape [B, L, C]
+        shift(Tensor): Shape [B, L1, C] or [1, L1, C], L1 is 1, L or
+            len(segments)
+        scale(Tensor): Same shape as shift
+        eps(`float`): Epsilon of the LayerNorm
+        segments(List[Tuple[int, int]], *optional*): Token ranges [start, end)
+            that share one row of shift / scale
+    """
+    if torch.is_grad_enabled() or torch.compiler.is_compiling():
+        # the reference ops are differentiable, and inductor fuses them itself
+        return modulate(
+            F.layer_norm(x.float(), x.shape[-1:], eps=eps), shift, scale,
+            segments)
+    if _use_triton(x, shift, scale):
+        return _triton_layer_norm_modulate(x, shift, scale, eps, segments)
+
+    out = F.layer_norm(x.float(), x.shape[-1:], eps=eps)
+    for rows, (a, b) in _row_ranges(out.size(1), shift.size(1), segments):
+        out[:, a:b].mul_(1 + scale[:, rows]).add_(shift[:, rows])
+    return out
+
+
+def gated_residual(x, y, g, segments=None):
+    r"""
+    Fused `x + gate(y, g, segments)`, the result has the promoted dtype of the
+    inputs as with the unfused ops. On CUDA this is a single Triton kernel,
+    elsewhere a single `addcmul` per segment.
+
+    Args:
+        x(Tensor): Residual stream of shape [B, L, C]
+        y(Tensor): Branch output of shape [B, L, C]
+        g(Tensor): Gate of shape [B, L1, C] or [1, L1, C], L1 is 1, L or
+            len(segments)
+        segments(List[Tuple[int, int]], *optional*): Token ranges [start, end)
+            that share one row of g
+    """
+    if torch.is_grad_enabled() or torch.compiler.is_compiling():
+        return x + gate(y, g, segments)
+    if _use_triton(x, y, g):
+        return _triton_gated_residual(x, y, g, segments)
+
+    if segments is None:
+        return torch.addcmul(x, y, g)
+    out = torch.empty_like(
+        x, dtype=torch.promote_types(x.dtype, torch.result_type(y, g)))
+    for rows, (a, b) in _row_ranges(out.size(1), g.size(1), segments):
+        torch.addcmul(x[:, a:b], y[:, a:b], g[:, rows], out=out[:, a:b])
+    return out
+
+
+def _row_ranges(seq_len, num_rows, segments):
+    r"""
+    Token ranges and the index of the row (or the slice of rows) of the
+    modulation tensor that applies to them.
+    """
+    if segments is not None:
+        return [(slice(i, i + 1), (a, b)) for i, (a, b) in enumerate(segments)]
+    if num_rows == 1:
+        return [(slice(0, 1), (0, seq_len))]
+    assert num_rows == seq_len
+    return [(slice(None), (0, seq_len))]
+
+
+def _use_triton(*tensors):
+    return TRITON_AVAILABLE and all(u.is_cuda for u in tensors)
+
+
+@functools.lru_cache(maxsize=16)
+def _row_index(seq_len, num_rows, segments, device):
+    r"""
+    Row of the modulation tensor used by every token, int32 of shape [L].
+    """
+    if segments is not None:
+        lengths = torch.tensor([b - a for a, b in segments], device=device)
+        index = torch.repeat_interleave(
+            torch.arange(len(segments), device=device), lengths)
+    elif num_rows == 1:
+        index = torch.zeros(seq_len, dtype=torch.long, device=device)
+    else:
+        assert num_rows == seq_len
+        index = torch.arange(seq_len, device=device)
+    return index.to(torch.int32)
+
+
+def _launch_args(x, *rows, segments=None):
+    b, seq_len, dim = x.shape
+    for u in rows:
+        assert u.dim() == 3 and u.size(0) in (1, b) and u.size(2) == dim
+        assert u.stride(2) == 1
+    num_rows = rows[0].size(1)
+    index = _row_index(seq_len, num_rows,
+                       None if segments is None else tuple(segments), x.device)
+    strides = []
+    for u in rows:
+        strides += [u.stride(0) if u.size(0) == b else 0, u.stride(1)]
+    block = triton.next_power_of_2(dim)
+    num_warps = min(max(block // 256, 1), 16)
+    return index, strides, block, num_warps
+
+
+def _triton_layer_norm_modulate(x, shift, scale, eps, segments):
+    x = x.contiguous()
+    b, seq_len, dim = x.shape
+    out = torch.empty(x.shape, dtype=torch.float32, device=x.device)
+    index, strides, block, num_warps = _launch_args(
+        x, shift, scale, segments=segments)
+    _layer_norm_modulate_kernel[(b * seq_len,)](
+        x,
+        shift,
+        scale,
+        index,
+        out,
+        seq_len,
+        dim,
+        *strides,
+        eps,
+        BLOCK=block,
+        num_warps=num_warps)
+    return out
+
+
+def _triton_gated_residual(x, y, g, segments):
+    x, y = x.contiguous(), y.contiguous()
+    b, seq_len, dim = x.shape
+    out = torch.empty(
+        x.shape,
+        dtype=torch.promote_types(x.dtype, torch.result_type(y, g)),
+        device=x.device)
+    index, strides, block, num_warps = _launch_args(x, g, segments=segments)
+    _gated_residual_kernel[(b * seq_len,)](
+        x,
+        y,
+        g,
+        index,
+        out,
+        seq_len,
+        dim,
+        *strides,
+        BLOCK=block,
+        num_warps=num_warps)
+    return out
+
+
+if TRITON_AVAILABLE:
+
+    @triton.jit
+    def _layer_norm_modulate_kernel(x_ptr, shift_ptr, scale_ptr, index_ptr,
+                                    out_ptr, seq_len, dim, shift_stride_b,
+                                    shift_stride_l, scale_stride_b,
+                                    scale_stride_l, eps, BLOCK: tl.constexpr):
+        token = tl.program_id(0).to(tl.int64)
+        b = token // seq_len
+        row = tl.load(index_ptr + token % seq_len).to(tl.int64)
+        cols = tl.arange(0, BLOCK)
+        mask = cols < dim
+
+        x = tl.load(
+            x_ptr + token * dim + cols, mask=mask, other=0.).to(tl.float32)
+        mean = tl.sum(x, axis=0) / dim
+        x = tl.where(mask, x - mean, 0.)
+        rstd = tl.rsqrt(tl.sum(x * x, axis=0) / dim + eps)
+
+        shift = tl.load(
+            shift_ptr + b * shift_stride_b + row * shift_stride_l + cols,
+            mask=mask).to(tl.float32)
+        scale = tl.load(
+            scale_ptr + b * scale_stride_b + row * scale_stride_l + cols,
+            mask=mask).to(tl.float32)
+        tl.store(
+            out_ptr + token * dim + cols,
+            x * rstd * (1 + scale) + shift,
+            mask=mask)
+
+    @triton.jit
+    def _gated_residual_kernel(x_ptr, y_ptr, g_ptr, index_ptr, out_ptr,
+                               seq_len, dim, g_stride_b, g_stride_l,
+                               BLOCK: tl.constexpr):
+        token = tl.program_id(0).to(tl.int64)
+        b = token // seq_len
+        row = tl.load(index_ptr + token % seq_len).to(tl.int64)
+        cols = tl.arange(0, BLOCK)
+        mask = cols < dim
+
+        x = tl.load(x_ptr + token * dim + cols, mask=mask).to(tl.float32)
+        y = tl.load(y_ptr + token * dim + cols, mask=mask).to(tl.float32)
+        g = tl.load(
+            g_ptr + b * g_stride_b + row * g_stride_l + cols,
+            mask=mask).to(tl.float32)
+        tl.store(out_ptr + token * dim + cols, x + y * g, mask=mask)
@@ -1,12 +1,14 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
 import math
+from contextlib import contextmanager
 
 import torch
 import torch.nn as nn
 from diffusers.configuration_utils import ConfigMixin, register_to_config
 from diffusers.models.modeling_utils import ModelMixin
 
-from .attention import flash_attention
+from .attention import attention
+from .fused_ops import gated_residual, layer_norm_modulate
 
 __all__ = ['WanModel']
 
@@ -36,34 +38,172 @@ def rope_params(max_seq_len, dim, theta=10000):
 
 
 @torch.amp.autocast('cuda', enabled=False)
-def rope_apply(x, grid_sizes, freqs):
-    n, c = x.size(2), x.size(3) // 2
+def rope_cos_sin(freqs, grid_sizes, seq_len):
+    r"""
+    Expands the complex 3D rotary table into per-token float32 cos / sin
+    tables for every sample of the batch.
+
+    Args:
+        freqs (`Tensor`):
+            Complex rope table of shape [M, C / 2].
+        grid_sizes (`Tensor`):
+            Shape [B, 3], the second dimension contains (F, H, W).
+        seq_len (`int`):
+            Padded sequence length. Positions past F * H * W get cos=1, sin=0
+            and are left unrotated.
+
+    Returns:
+        `tuple[Tensor, Tensor]`: cos and sin of shape [B, seq_len, 1, C / 2],
+        or [1, seq_len, 1, C / 2] when all grids are equal.
+    """
+    c = freqs.size(1)
 
     # split freqs
     freqs = freqs.split([c - 2 * (c // 3), c // 3, c // 3], dim=1)
 
-    # loop over samples
-    output = []
-    for i, (f, h, w) in enumerate(grid_sizes.tolist()):
-        seq_len = f * h * w
-
-        # precompute multipliers
-        x_i = torch.view_as_complex(x[i, :seq_len].to(torch.float64).reshape(
-            seq_len, n, -1, 2))
+    grids = [tuple(u) for u in grid_sizes.tolist()]
+    tables = {}
+    for f, h, w in grids:
+        if (f, h, w) in tables:
+            continue
+        n = f * h * w
+        assert n <= seq_len
         freqs_i = torch.cat([
             freqs[0][:f].view(f, 1, 1, -1).expand(f, h, w, -1),
             freqs[1][:h].view(1, h, 1, -1).expand(f, h, w, -1),
             freqs[2][:w].view(1, 1, w, -1).expand(f, h, w, -1)
         ],
-                            dim=-1).reshape(seq_len, 1, -1)
+                            dim=-1).reshape(n, 1, -1)
+        cos = freqs_i.real.float()
+        sin = freqs_i.imag.float()
+        if n < seq_len:
+            cos = torch.cat([cos, cos.new_ones(seq_len - n, 1, c)])
+            sin = torch.cat([sin, sin.new_zeros(seq_len - n, 1, c)])
+        tables[(f, h, w)] = (cos, sin)
+
+    if len(tables) == 1:
+        cos, sin = tables[grids[0]]
+        return cos.unsqueeze(0), sin.unsqueeze(0)
+    return (torch.stack([tables[g][0] for g in grids]),
+            torch.stack([tables[g][1] for g in grids]))
+
+
+@torch.amp.autocast('cuda', enabled=False)
+def rope_apply(x, grid_sizes, freqs):
+    r"""
+    Args:
+        x(Tensor): Shape [B, L, N, C]
+        grid_sizes(Tensor): Shape [B, 3], the second dimension contains (F, H, W)
+        freqs(Tensor | tuple[Tensor, Tensor]): Either the complex rope table
+            of shape [M, C / 2], or precomputed (cos, sin) tables from
+            `rope_cos_sin` of shape [B or 1, L, 1, C / 2]
+    """
+    if not isinstance(freqs, tuple):
+        freqs = rope_cos_sin(freqs, grid_sizes, x.size(1))
+    cos, sin = freqs
+
+    # apply rotary embedding on (real, imag) pairs
+    x = x.float().unflatten(3, (-1, 2))
+    x0, x1 = x[..., 0], x[..., 1]
+    return torch.stack([x0 * cos - x1 * sin, x0 * sin + x1 * cos],
+                       dim=-1).flatten(3)
+
+
+class ContextCache:
+
+    def __init__(self, size=4):
+        r"""
+        Values derived from the context of a request (text embeddings, cross
+        attention keys and values), keyed by the identity of the tensors they
+        are computed from. The sampling loop passes the same context tensors
+        at every step, so each value is computed once per request. Entries
+        hold a reference to their key tensors, which keeps the ids from being
+        reused while the entry exists. Nothing is cached while autograd is
+        enabled.
+
+        The cross attention keys and values are kept per block on the device
+        of the block: with a 512 token context, 40 blocks and dim 5120 in
+        bf16, that is about 420 MB per entry, about 1.7 GB for the cond,
+        uncond and batched contexts of an A14B expert. `BlockStreamer`
+        disables the caches of the blocks it streams.
+
+        Args:
+            size (`int`, *optional*, defaults to 4):
+                Maximum number of entries, e.g. the conditional, unconditional
+                and batched context of a request. 0 disables the cache.
+        """
+        self.size = size
+        self._entries = {}
+
+    @torch.compiler.disable
+    def get(self, tensors, fn):
+        r"""
+        Returns the cached value for `tensors`, or computes it with `fn()`.
+        """
+        key = tuple(id(u) for u in tensors)
+        entry = self._entries.get(key)
+        if entry is not None:
+            return entry[1]
+        value = fn()
+        if self.size > 0 and not torch.is_grad_enabled():
+            if len(self._entries) >= self.size:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (tuple(tensors), value)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+
+
+def clear_context_cache(model):
+    r"""
+    Drops the cached context embeddings and cross attention keys and values of
+    every module of `model`, see `ContextCache`, and resets its step cache.
+    """
+    for m in model.modules():
+        cache = getattr(m, '_context_cache', None)
+        if isinstance(cache, ContextCache):
+            cache.clear()
+        step_cache = getattr(m, 'step_cache', None)
+        if step_cache is not None:
+            step_cache.reset()
+
 
-        # apply rotary embedding
-        x_i = torch.view_as_real(x_i * freqs_i).flatten(2)
-        x_i = torch.cat([x_i, x[i, seq_len:]])
+@contextmanager
+def context_cache_scope(*models):
+    r"""
+    Clears the context caches of `models` when the block exits, also when
+    sampling fails, so no cached keys and values outlive the request.
+    """
+    try:
+        yield
+    finally:
+        for model in models:
+            clear_context_cache(model)
 
-        # append to collection
-        output.append(x_i)
-    return torch.stack(output).float()
+
+def time_bounds(mask, seq_len):
+    r"""
+    Token indices at which the per-token timestep `mask * t` of a request can
+    change, for the `t_bounds` argument of `WanModel`. The mask (e.g. the TI2V
+    first frame mask, one value per token) is fixed for a request, so this
+    reads it to the host once instead of `WanModel` finding the time segments
+    on the device at every step.
+
+    Args:
+        mask (Tensor):
+            Per-token timestep factor, flattened to at most `seq_len` values.
+            Tokens past its end count as 1, like the padded timesteps of the
+            pipelines.
+        seq_len (`int`):
+            Sequence length of the timestep tensor
+
+    Returns:
+        `list[int]`: Indices of the tokens where a new segment starts.
+    """
+    mask = mask.flatten()
+    mask = torch.cat([mask, mask.new_ones(seq_len - mask.numel())])
+    return (mask[1:] != mask[:-1]).nonzero().flatten().add(1).tolist()
 
 
 class WanRMSNorm(nn.Module):
@@ -114,6 +254,8 @@ class WanSelfAttention(nn.Module):
         self.window_size = window_size
         self.qk_norm = qk_norm
         self.eps = eps
+        # attention backend name, None uses the global default
+        self.attn_backend = None
 
         # layers
         self.q = nn.Linear(dim, dim)
@@ -129,7 +271,7 @@ class WanSelfAttention(nn.Module):
             x(Tensor): Shape [B, L, num_heads, C / num_heads]
             seq_lens(Tensor): Shape [B]
             grid_sizes(Tensor): Shape [B, 3], the second dimension contains (F, H, W)
-            freqs(Tensor): Rope freqs, shape [1024, C / num_heads / 2]
+            freqs(Tensor | tuple[Tensor, Tensor]): Rope freqs, see `rope_apply`
         """
         b, s, n, d = *x.shape[:2], self.num_heads, self.head_dim
 
@@ -142,12 +284,13 @@ class WanSelfAttention(nn.Module):
 
         q, k, v = qkv_fn(x)
 
-        x = flash_attention(
+        x = attention(
             q=rope_apply(q, grid_sizes, freqs),
             k=rope_apply(k, grid_sizes, freqs),
             v=v,
             k_lens=seq_lens,
-            window_size=self.window_size)
+            window_size=self.window_size,
+            backend=self.attn_backend)
 
         # output
         x = x.flatten(2)
@@ -157,6 +300,15 @@ class WanSelfAttention(nn.Module):
 
 class WanCrossAttention(WanSelfAttention):
 
+    def __init__(self,
+                 dim,
+                 num_heads,
+                 window_size=(-1, -1),
+                 qk_norm=True,
+                 eps=1e-6):
+        super().__init__(dim, num_heads, window_size, qk_norm, eps)
+        self._context_cache = ContextCache()
+
     def forward(self, x, context, context_lens):
         r"""
         Args:
@@ -168,17 +320,29 @@ class WanCrossAttention(WanSelfAttention):
 
         # compute query, key, value
         q = self.norm_q(self.q(x)).view(b, -1, n, d)
-        k = self.norm_k(self.k(context)).view(b, -1, n, d)
-        v = self.v(context).view(b, -1, n, d)
+        k, v = self._context_cache.get((context,),
+                                       lambda: self.project_context(context))
 
         # compute attention
-        x = flash_attention(q, k, v, k_lens=context_lens)
+        x = attention(
+            q, k, v, k_lens=context_lens, backend=self.attn_backend)
 
         # output
         x = x.flatten(2)
         x = self.o(x)
         return x
 
+    def project_context(self, context):
+        r"""
+        Keys and values of `context`, each of shape [B, L2, num_heads, head_dim].
+        They only depend on the context, so they are cached for all sampling
+        steps of a request.
+        """
+        b, n, d = context.size(0), self.num_heads, self.head_dim
+        k = self.norm_k(self.k(context)).view(b, -1, n, d)
+        v = self.v(context).view(b, -1, n, d)
+        return k, v
+
 
 class WanAttentionBlock(nn.Module):
 
@@ -225,34 +389,36 @@ class WanAttentionBlock(nn.Module):
         freqs,
         context,
         context_lens,
+        segments=None,
     ):
         r"""
         Args:
             x(Tensor): Shape [B, L, C]
-            e(Tensor): Shape [B, L1, 6, C]
+            e(Tensor): Shape [B, L1, 6, C], L1 is 1, L or len(segments)
             seq_lens(Tensor): Shape [B], length of each sequence in batch
             grid_sizes(Tensor): Shape [B, 3], the second dimension contains (F, H, W)
-            freqs(Tensor): Rope freqs, shape [1024, C / num_heads / 2]
+            freqs(Tensor | tuple[Tensor, Tensor]): Rope freqs, see `rope_apply`
+            segments(List[Tuple[int, int]], *optional*): Token ranges sharing
+                one row of `e`
         """
         assert e.dtype == torch.float32
         with torch.amp.autocast('cuda', dtype=torch.float32):
             e = (self.modulation.unsqueeze(0) + e).chunk(6, dim=2)
         assert e[0].dtype == torch.float32
+        e = [u.squeeze(2) for u in e]
 
         # self-attention
         y = self.self_attn(
-            self.norm1(x).float() * (1 + e[1].squeeze(2)) + e[0].squeeze(2),
+            layer_norm_modulate(x, e[0], e[1], self.norm1.eps, segments),
             seq_lens, grid_sizes, freqs)
-        with torch.amp.autocast('cuda', dtype=torch.float32):
-            x = x + y * e[2].squeeze(2)
+        x = gated_residual(x, y, e[2], segments)
 
         # cross-attention & ffn function
         def cross_attn_ffn(x, context, context_lens, e):
             x = x + self.cross_attn(self.norm3(x), context, context_lens)
             y = self.ffn(
-                self.norm2(x).float() * (1 + e[4].squeeze(2)) + e[3].squeeze(2))
-            with torch.amp.autocast('cuda', dtype=torch.float32):
-                x = x + y * e[5].squeeze(2)
+                layer_norm_modulate(x, e[3], e[4], self.norm2.eps, segments))
+            x = gated_residual(x, y, e[5], segments)
             return x
 
         x = cross_attn_ffn(x, context, context_lens, e)
@@ -276,18 +442,20 @@ class Head(nn.Module):
         # modulation
         self.modulation = nn.Parameter(torch.randn(1, 2, dim) / dim**0.5)
 
-    def forward(self, x, e):
+    def forward(self, x, e, segments=None):
         r"""
         Args:
-            x(Tensor): Shape [B, L1, C]
-            e(Tensor): Shape [B, L1, C]
+            x(Tensor): Shape [B, L, C]
+            e(Tensor): Shape [B, L1, C], L1 is 1, L or len(segments)
+            segments(List[Tuple[int, int]], *optional*): Token ranges sharing
+                one row of `e`
         """
         assert e.dtype == torch.float32
         with torch.amp.autocast('cuda', dtype=torch.float32):
             e = (self.modulation.unsqueeze(0) + e.unsqueeze(2)).chunk(2, dim=2)
-            x = (
-                self.head(
-                    self.norm(x) * (1 + e[1].squeeze(2)) + e[0].squeeze(2)))
+            x = self.head(
+                layer_norm_modulate(x, e[0].squeeze(2), e[1].squeeze(2),
+                                    self.norm.eps, segments))
         return x
 
 
@@ -300,6 +468,13 @@ class WanModel(ModelMixin, ConfigMixin):
         'patch_size', 'cross_attn_norm', 'qk_norm', 'text_dim', 'window_size'
     ]
     _no_split_modules = ['WanAttentionBlock']
+    # above this many distinct timestep runs, embed every token separately
+    max_time_segments = 8
+    # tokens per latent frame that seq_len is padded up to, set when the
+    # blocks are compiled so that they only see a few distinct shapes
+    seq_len_buckets = None
+    # `StepCache` that may skip the blocks of a denoising step
+    step_cache = None
 
     @register_to_config
     def __init__(self,
@@ -403,6 +578,9 @@ class WanModel(ModelMixin, ConfigMixin):
             rope_params(1024, 2 * (d // 6))
         ],
                                dim=1)
+        self._rope_cache = {}
+        self._time_cache = None
+        self._context_cache = ContextCache()
 
         # initialize weights
         self.init_weights()
@@ -414,6 +592,7 @@ class WanModel(ModelMixin, ConfigMixin):
         context,
         seq_len,
         y=None,
+        t_bounds=None,
     ):
         r"""
         Forward pass through the diffusion model
@@ -422,13 +601,16 @@ class WanModel(ModelMixin, ConfigMixin):
             x (List[Tensor]):
                 List of input video tensors, each with shape [C_in, F, H, W]
             t (Tensor):
-                Diffusion timesteps tensor of shape [B]
+                Diffusion timesteps tensor of shape [B] or [B, seq_len]
             context (List[Tensor]):
                 List of text embeddings each with shape [L, C]
             seq_len (`int`):
                 Maximum sequence length for positional encoding
             y (List[Tensor], *optional*):
                 Conditional video inputs for image-to-video mode, same shape as x
+            t_bounds (`list[int]`, *optional*):
+                Token indices where a per-token `t` may change, see
+                `time_bounds`. Saves finding them on the device at every step
 
         Returns:
             List[Tensor]:
@@ -451,51 +633,200 @@ class WanModel(ModelMixin, ConfigMixin):
         x = [u.flatten(2).transpose(1, 2) for u in x]
         seq_lens = torch.tensor([u.size(1) for u in x], dtype=torch.long)
         assert seq_lens.max() <= seq_len
+        seq_len = self.bucket_seq_len(seq_len, int(grid_sizes[:, 0].max()))
         x = torch.cat([
             torch.cat([u, u.new_zeros(1, seq_len - u.size(1), u.size(2))],
                       dim=1) for u in x
         ])
 
         # time embeddings
-        if t.dim() == 1:
-            t = t.expand(t.size(0), seq_len)
-        with torch.amp.autocast('cuda', dtype=torch.float32):
-            bt = t.size(0)
-            t = t.flatten()
-            e = self.time_embedding(
-                sinusoidal_embedding_1d(self.freq_dim,
-                                        t).unflatten(0, (bt, seq_len)).float())
-            e0 = self.time_projection(e).unflatten(2, (6, self.dim))
-            assert e.dtype == torch.float32 and e0.dtype == torch.float32
+        e, e0, segments = self.time_embeddings(t, seq_len, t_bounds)
 
         # context
         context_lens = None
-        context = self.text_embedding(
-            torch.stack([
-                torch.cat(
-                    [u, u.new_zeros(self.text_len - u.size(0), u.size(1))])
-                for u in context
-            ]))
+        context = self.embed_context(context)
 
         # arguments
         kwargs = dict(
             e=e0,
             seq_lens=seq_lens,
             grid_sizes=grid_sizes,
-            freqs=self.freqs,
+            freqs=self.rope_freqs(grid_sizes, seq_len),
             context=context,
-            context_lens=context_lens)
+            context_lens=context_lens,
+            segments=segments)
+
+        def run_blocks(x, start=0, end=None):
+            for block in self.blocks[start:end]:
+                x = block(x, **kwargs)
+            return x
 
-        for block in self.blocks:
-            x = block(x, **kwargs)
+        if self.step_cache is not None and not torch.is_grad_enabled():
+            x = self.step_cache(context, x, run_blocks, e0)
+        else:
+            x = run_blocks(x)
 
         # head
-        x = self.head(x, e)
+        x = self.head(x, e, segments)
 
         # unpatchify
         x = self.unpatchify(x, grid_sizes)
         return [u.float() for u in x]
 
+    def bucket_seq_len(self, seq_len, num_frames):
+        r"""
+        Rounds `seq_len` up to `num_frames` times the smallest entry of
+        `seq_len_buckets` that holds `seq_len / num_frames` tokens. Padding
+        tokens are masked out as keys, so the output does not change.
+        """
+        if not self.seq_len_buckets:
+            return seq_len
+        per_frame = math.ceil(seq_len / num_frames)
+        for bucket in self.seq_len_buckets:
+            if bucket >= per_frame:
+                return max(seq_len, bucket * num_frames)
+        return seq_len
+
+    def time_embeddings(self, t, seq_len, bounds=None):
+        r"""
+        Computes the time embeddings of `t` once per distinct timestep value.
+
+        A per-token timestep (e.g. TI2V, where the first latent frame is kept
+        at t=0) is piecewise constant along the sequence, so it is split into
+        the runs of tokens that share one timestep in every sample. The result
+        of the last call is reused while the same `t` tensor is passed in,
+        which lets the conditional and unconditional passes of a step share
+        it. The cache is keyed on the identity of `t` rather than its values,
+        so a hit does not synchronize with the device; the sampling loops
+        build a new timestep tensor per step and never modify it in place.
+        Finding the segments of a per-token `t` synchronizes once per miss,
+        unless the token indices where it can change are given as `bounds`.
+
+        Args:
+            t (Tensor):
+                Diffusion timesteps tensor of shape [B] or [B, L] with L up to
+                `seq_len`. Per-token timesteps of the padding tokens past L
+                repeat the last timestep.
+            seq_len (`int`):
+                Maximum sequence length
+            bounds (`list[int]`, *optional*, defaults to None):
+                Token indices where a per-token `t` may change, see
+                `time_bounds`. Found from `t` when None.
+
+        Returns:
+            Tuple[Tensor, Tensor, List[Tuple[int, int]] | None]:
+                e of shape [B, K, C], e0 of shape [B, K, 6, C] and the token
+                ranges of the K segments. Segments are None when K is 1 (the
+                embeddings broadcast over the sequence) or when `t` changes
+                more often than `max_time_segments` allows (K == seq_len).
+        """
+        cache = self._time_cache
+        if cache is not None and cache[0] is t and cache[1] == seq_len:
+            return cache[2]
+        key = t
+
+        segments = None
+        if t.dim() == 2 and t.size(1) < seq_len:
+            # padding tokens of `bucket_seq_len`
+            t = torch.cat([t, t[:, -1:].expand(-1, seq_len - t.size(1))],
+                          dim=1)
+        if t.dim() == 1:
+            ts = t.unsqueeze(1)
+        else:
+            assert t.size(1) == seq_len
+            if bounds is None:
+                bounds = (t[:, 1:] != t[:, :-1]).any(0).nonzero().flatten(
+                ).add(1).tolist()
+            else:
+                bounds = [b for b in bounds if 0 < b < seq_len]
+            if len(bounds) < self.max_time_segments:
+                starts = [0] + bounds
+                ts = t[:, starts]
+                if bounds:
+                    segments = list(zip(starts, bounds + [seq_len]))
+            else:
+                ts = t
+
+        with torch.amp.autocast('cuda', dtype=torch.float32):
+            bt, k = ts.shape
+            e = self.time_embedding(
+                sinusoidal_embedding_1d(self.freq_dim, ts.flatten()).unflatten(
+                    0, (bt, k)).float())
+            e0 = self.time_projection(e).unflatten(2, (6, self.dim))
+            assert e.dtype == torch.float32 and e0.dtype == torch.float32
+
+        out = (e, e0, segments)
+        # holding `key` keeps its id from being reused while cached
+        self._time_cache = None if torch.is_grad_enabled() else (key, seq_len,
+                                                                 out)
+        return out
+
+    def embed_context(self, context):
+        r"""
+        Applies `text_embedding` to the text embeddings zero-padded to
+        `text_len`. The result is reused while the same context tensors are
+        passed in, i.e. for every sampling step of a request, see
+        `ContextCache`.
+
+        Args:
+            context (List[Tensor]):
+                List of text embeddings each with shape [L, C]
+
+        Returns:
+            Tensor: Shape [B, text_len, dim]
+        """
+
+        def embed():
+            return self.text_embedding(
+                torch.stack([
+                    torch.cat(
+                        [u, u.new_zeros(self.text_len - u.size(0), u.size(1))])
+                    for u in context
+                ]))
+
+        return self._context_cache.get(context, embed)
+
+    def clear_context_cache(self):
+        r"""
+        Releases the cached context embeddings and cross attention keys and
+        values, called at the end of a request.
+        """
+        clear_context_cache(self)
+
+    def set_attention_backend(self, backend):
+        r"""
+        Makes every attention layer of the model use `backend` ('fa3', 'fa2',
+        'sdpa', 'chunked', 'auto'), or the global default when None.
+        """
+        for m in self.modules():
+            if isinstance(m, WanSelfAttention):
+                m.attn_backend = backend
+
+    def rope_freqs(self, grid_sizes, seq_len):
+        r"""
+        Returns the float32 (cos, sin) rope tables for `grid_sizes`, padded to
+        `seq_len`. Tables are built once per grid, length and device and reused
+        by every block and every sampling step.
+
+        Args:
+            grid_sizes (Tensor):
+                Shape [B, 3], the second dimension contains (F, H, W)
+            seq_len (`int`):
+                Padded sequence length
+
+        Returns:
+            `tuple[Tensor, Tensor]`: cos and sin, see `rope_cos_sin`.
+        """
+        key = (tuple(tuple(u) for u in grid_sizes.tolist()), seq_len,
+               self.freqs.device)
+        tables = self._rope_cache.get(key)
+        if tables is None:
+            if len(self._rope_cache) >= 8:
+                self._rope_cache.pop(next(iter(self._rope_cache)))
+            tables = rope_cos_sin(self.freqs, grid_sizes, seq_len)
+            self._rope_cache[key] = tables
+        return tables
+
     def unpatchify(self, x, grid_sizes):
         r"""
         Reconstruct video tensors from patch embeddings.
@@ -0,0 +1,296 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import json
+import logging
+import os
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from accelerate import init_empty_weights
+from safetensors.torch import save_file
+
+from .checkpoint import load_checkpoint
+
+__all__ = [
+    'QuantLinear', 'quantize_weight', 'quantize_model', 'quantized_filename',
+    'load_pretrained', 'save_quantized'
+]
+
+# Linear layers of the DiT that hold nearly all of its parameters. The head and
+# the model specific adapters (audio, motion, face) are kept in full precision.
+QUANT_MODULES = ('blocks', 'text_embedding', 'time_embedding',
+                 'time_projection')
+
+
+def quantize_weight(weight, bits=8, group_size=None):
+    r"""
+    Symmetric, calibration-free quantization of a [out, in] weight.
+
+    Args:
+        weight (`Tensor`):
+            Weight of shape [out, in].
+        bits (`int`, *optional*, defaults to 8):
+            8 or 4. int4 values are packed two per byte along `in`.
+        group_size (`int`, *optional*, defaults to None):
+            Number of input channels sharing a scale. None uses one scale per
+            output channel.
+
+    Returns:
+        tuple[Tensor, Tensor]: The quantized weight and the float32 scales of
+        shape [out, in // group_size].
+    """
+    assert bits in (4, 8), f'unsupported bits {bits}'
+    out_features, in_features = weight.shape
+    group_size = group_size or in_features
+    assert in_features % group_size == 0, \
+        f'{in_features=} is not divisible by {group_size=}'
+
+    qmax = 2**(bits - 1) - 1
+    w = weight.float().reshape(out_features, -1, group_size)
+    scale = w.abs().amax(dim=-1, keepdim=True).clamp(min=1e-8) / qmax
+    q = (w / scale).round_().clamp_(-qmax, qmax).reshape(out_features, -1)
+    if bits == 8:
+        q = q.to(torch.int8)
+    else:
+        assert in_features % 2 == 0, 'int4 needs an even number of inputs'
+        q = (q + 8).to(torch.uint8)
+        q = q[:, 0::2] | (q[:, 1::2] << 4)
+    return q, scale.squeeze(-1)
+
+
+class QuantLinear(nn.Module):
+
+    def __init__(self,
+                 in_features,
+                 out_features,
+                 bias=True,
+                 bits=8,
+                 group_size=None,
+                 dtype=None,
+                 device=None):
+        r"""
+        Weight-only quantized replacement of `nn.Linear`. The weight is stored
+        as int8 or packed int4 with per-channel or group-wise scales, and is
+        dequantized on the fly to the input dtype, so it runs on any device.
+
+        Args:
+            in_features, out_features (`int`):
+                Shape of the linear layer.
+            bias (`bool`, *optional*, defaults to True):
+                Whether the layer has a bias, kept in full precision.
+            bits (`int`, *optional*, defaults to 8):
+                8 or 4.
+            group_size (`int`, *optional*, defaults to None):
+                Input channels per scale. None means per output channel.
+        """
+        super().__init__()
+        assert bits in (4, 8), f'unsupported bits {bits}'
+        self.in_features = in_features
+        self.out_features = out_features
+        self.bits = bits
+        self.group_size = group_size or in_features
+        assert in_features % self.group_size == 0
+
+        packed = in_features if bits == 8 else in_features // 2
+        self.register_buffer(
+            'qweight',
+            torch.empty(
+                out_features,
+                packed,
+                dtype=torch.int8 if bits == 8 else torch.uint8,
+                device=device))
+        self.register_buffer(
+            'scale',
+            torch.empty(
+                out_features,
+                in_features // self.group_size,
+                dtype=torch.float32,
+                device=device))
+        self.bias = nn.Parameter(
+            torch.empty(out_features, dtype=dtype,
+                        device=device)) if bias else None
+
+    @classmethod
+    def from_linear(cls, linear, bits=8, group_size=None):
+        module = cls(
+            linear.in_features,
+            linear.out_features,
+            bias=linear.bias is not None,
+            bits=bits,
+            group_size=group_size,
+            dtype=linear.weight.dtype,
+            device=linear.weight.device)
+        qweight, scale = quantize_weight(linear.weight.data, bits, group_size)
+        module.qweight.copy_(qweight)
+        module.scale.copy_(scale)
+        if linear.bias is not None:
+            module.bias.data.copy_(linear.bias.data)
+        return module
+
+    def dequantize(self, dtype=torch.float32):
+        q = self.qweight
+        if self.bits == 4:
+            q = torch.stack([q & 15, q >> 4], dim=-1).flatten(1).to(dtype) - 8
+        w = q.to(dtype).view(self.out_features, -1, self.group_size)
+        w = w * self.scale.to(dtype).unsqueeze(-1)
+        return w.view(self.out_features, self.in_features)
+
+    def forward(self, x):
+        dtype = torch.get_autocast_dtype(x.device.type) \
+            if torch.is_autocast_enabled(x.device.type) else x.dtype
+        return F.linear(x, self.dequantize(dtype), self.bias)
+
+    def extra_repr(self):
+        return (f'in_features={self.in_features}, '
+                f'out_features={self.out_features}, '
+                f'bias={self.bias is not None}, bits={self.bits}, '
+                f'group_size={self.group_size}')
+
+
+def quantize_model(model,
+                   bits=8,
+                   group_size=None,
+                   modules=QUANT_MODULES,
+                   convert=True):
+    r"""
+    Replaces the `nn.Linear` layers under `modules` with `QuantLinear`.
+
+    Args:
+        model (`nn.Module`):
+            WanModel, WanModel_S2V or WanAnimateModel.
+        bits (`int`, *optional*, defaults to 8):
+            8 or 4.
+        group_size (`int`, *optional*, defaults to None):
+            Input channels per scale. None means per output channel. Layers
+            whose input size is not divisible by it keep per channel scales.
+        modules (`tuple[str]`, *optional*, defaults to QUANT_MODULES):
+            Names of the top-level children to quantize.
+        convert (`bool`, *optional*, defaults to True):
+            Quantize the existing weights. If False, only empty quantized
+            layers are created, e.g. on the meta device before loading a
+            quantized checkpoint.
+    """
+    for name in modules:
+        root = getattr(model, name, None)
+        if root is None:
+            continue
+        for parent in list(root.modules()):
+            for child_name, child in list(parent.named_children()):
+                if type(child) is not nn.Linear:
+                    continue
+                g = group_size if group_size and \
+                    child.in_features % group_size == 0 else None
+                if convert:
+                    q = QuantLinear.from_linear(child, bits, g)
+                else:
+                    q = QuantLinear(
+                        child.in_features,
+                        child.out_features,
+                        bias=child.bias is not None,
+                        bits=bits,
+                        group_size=g,
+                        dtype=child.weight.dtype,
+                        device=child.weight.device)
+                setattr(parent, child_name, q)
+    model.quant_config = {'bits': bits, 'group_size': group_size}
+    return model
+
+
+def quantized_filename(bits=8, group_size=None):
+    r"""
+    Name of the quantized checkpoint written next to the full precision one.
+    """
+    suffix = f'int{bits}' + (f'-g{group_size}' if group_size else '')
+    return f'diffusion_pytorch_model.{suffix}.safetensors'
+
+
+def load_pretrained(model_cls,
+                    checkpoint_dir,
+                    subfolder=None,
+                    bits=None,
+                    group_size=None,
+                    torch_dtype=None,
+                    device_map=None,
+                    **kwargs):
+    r"""
+    Drop-in for `model_cls.from_pretrained` with optional weight-only
+    quantization. A converted checkpoint (see `convert_checkpoints.py
+    --quantize`) is loaded directly on the meta device; otherwise the full
+    precision model is loaded and quantized on the fly.
+
+    Args:
+        model_cls (`type`):
+            WanModel, WanModel_S2V or WanAnimateModel.
+        checkpoint_dir (`str`):
+            Checkpoint directory.
+        subfolder (`str`, *optional*, defaults to None):
+            Subfolder of the model in `checkpoint_dir`.
+        bits (`int`, *optional*, defaults to None):
+            8 or 4. None loads the full precision model.
+        group_size (`int`, *optional*, defaults to None):
+            Input channels per scale. None means per output channel.
+        torch_dtype, device_map:
+            Forwarded to `from_pretrained`.
+    """
+    if torch_dtype is not None:
+        kwargs['torch_dtype'] = torch_dtype
+    if device_map is not None:
+        kwargs['device_map'] = device_map
+    if bits is None:
+        return model_cls.from_pretrained(
+            checkpoint_dir, subfolder=subfolder, **kwargs)
+
+    path = checkpoint_dir if subfolder is None else os.path.join(
+        checkpoint_dir, subfolder)
+    quant_path = os.path.join(path, quantized_filename(bits, group_size))
+    if not os.path.exists(quant_path):
+        logging.info(f'{quant_path} not found, quantizing {path} on the fly')
+        model = model_cls.from_pretrained(
+            checkpoint_dir, subfolder=subfolder, **kwargs)
+        return quantize_model(model, bits, group_size)
+
+    with open(os.path.join(path, 'config.json')) as f:
+        config = json.load(f)
+    # parameters on the meta device; plain tensor attributes such as the RoPE
+    # `freqs` are still built for real
+    with init_empty_weights():
+        model = model_cls.from_config(config)
+    quantize_model(model, bits, group_size, convert=False)
+    load_checkpoint(
+        model,
+        quant_path,
+        device='cpu' if device_map is None else device_map,
+        dtype=torch_dtype)
+    return model
+
+
+def save_quantized(model_cls,
+                   checkpoint_dir,
+                   subfolder=None,
+                   bits=8,
+                   group_size=None):
+    r"""
+    Quantizes a full precision checkpoint and writes the compact checkpoint
+    next to it, where `load_pretrained` picks it up.
+
+    Returns:
+        `str`: Path of the quantized checkpoint.
+    """
+    path = checkpoint_dir if subfolder is None else os.path.join(
+        checkpoint_dir, subfolder)
+    model = model_cls.from_pretrained(checkpoint_dir, subfolder=subfolder)
+    quantize_model(model.eval().requires_grad_(False), bits, group_size)
+
+    dst = os.path.join(path, quantized_filename(bits, group_size))
+    tmp = dst + f'.{os.getpid()}.tmp'
+    state_dict = {k: v.contiguous() for k, v in model.state_dict().items()}
+    save_file(
+        state_dict,
+        tmp,
+        metadata={
+            'format': 'pt',
+            'bits': str(bits),
+            'group_size': str(group_size)
+        })
+    os.replace(tmp, dst)
+    return dst
@@ -17,13 +17,15 @@ from ...distributed.sequence_parallel import (
     get_rank,
     get_world_size,
 )
+from ..attention import attention
+from ..fused_ops import gated_residual, layer_norm_modulate
 from ..model import (
+    ContextCache,
     Head,
     WanAttentionBlock,
     WanLayerNorm,
     WanModel,
     WanSelfAttention,
-    flash_attention,
     rope_params,
     sinusoidal_embedding_1d,
 )
@@ -143,7 +145,7 @@ class Head_S2V(Head):
         assert e.dtype == torch.float32
         with amp.autocast(dtype=torch.float32):
             e = (self.modulation + e.unsqueeze(1)).chunk(2, dim=1)
-            x = (self.head(self.norm(x) * (1 + e[1]) + e[0]))
+            x = self.head(layer_norm_modulate(x, e[0], e[1], self.norm.eps))
         return x
 
 
@@ -168,12 +170,13 @@ class WanS2VSelfAttention(WanSelfAttention):
 
         q, k, v = qkv_fn(x)
 
-        x = flash_attention(
+        x = attention(
             q=rope_apply(q, grid_sizes, freqs),
             k=rope_apply(k, grid_sizes, freqs),
             v=v,
             k_lens=seq_lens,
-            window_size=self.window_size)
+            window_size=self.window_size,
+            backend=self.attn_backend)
 
         # output
         x = x.flatten(2)
@@ -208,36 +211,19 @@ class WanS2VAttentionBlock(WanAttentionBlock):
         assert e[0].dtype == torch.float32
 
         e = [element.squeeze(1) for element in e]
-        norm_x = self.norm1(x).float()
-        parts = []
-        for i in range(2):
-            parts.append(norm_x[:, seg_idx[i]:seg_idx[i + 1]] *
-                         (1 + e[1][:, i:i + 1]) + e[0][:, i:i + 1])
-        norm_x = torch.cat(parts, dim=1)
+        segments = [(seg_idx[0], seg_idx[1]), (seg_idx[1], seg_idx[2])]
         # self-attention
-        y = self.self_attn(norm_x, seq_lens, grid_sizes, freqs)
-        with amp.autocast(dtype=torch.float32):
-            z = []
-            for i in range(2):
-                z.append(y[:, seg_idx[i]:seg_idx[i + 1]] * e[2][:, i:i + 1])
-            y = torch.cat(z, dim=1)
-            x = x + y
+        y = self.self_attn(
+            layer_norm_modulate(x, e[0], e[1], self.norm1.eps, segments),
+            seq_lens, grid_sizes, freqs)
+        x = gated_residual(x, y, e[2], segments)
+
         # cross-attention & ffn function
         def cross_attn_ffn(x, context, context_lens, e):
             x = x + self.cross_attn(self.norm3(x), context, context_lens)
-            norm2_x = self.norm2(x).float()
-            parts = []
-            for i in range(2):
-                parts.append(norm2_x[:, seg_idx[i]:seg_idx[i + 1]] *
-                             (1 + e[4][:, i:i + 1]) + e[3][:, i:i + 1])
-            norm2_x = torch.cat(parts, dim=1)
-            y = self.ffn(norm2_x)
-            with amp.autocast(dtype=torch.float32):
-                z = []
-                for i in range(2):
-                    z.append(y[:, seg_idx[i]:seg_idx[i + 1]] * e[5][:, i:i + 1])
-                y = torch.cat(z, dim=1)
-                x = x + y
+            y = self.ffn(
+                layer_norm_modulate(x, e[3], e[4], self.norm2.eps, segments))
+            x = gated_residual(x, y, e[5], segments)
             return x
 
         x = cross_attn_ffn(x, context, context_lens, e)
@@ -251,6 +237,10 @@ class WanModel_S2V(ModelMixin, ConfigMixin):
     ]
     _no_split_modules = ['WanS2VAttentionBlock']
 
+    embed_context = WanModel.embed_context
+    clear_context_cache = WanModel.clear_context_cache
+    step_cache = None
+
     @register_to_config
     def __init__(
             self,
@@ -336,6 +326,7 @@ class WanModel_S2V(ModelMixin, ConfigMixin):
             rope_params(1024, 2 * (d // 6))
         ],
                                dim=1)
+        self._context_cache = ContextCache()
 
         # initialize weights
         self.init_weights()
@@ -798,12 +789,7 @@ class WanModel_S2V(ModelMixin, ConfigMixin):
 
         # context
         context_lens = None
-        context = self.text_embedding(
-            torch.stack([
-                torch.cat(
-                    [u, u.new_zeros(self.text_len - u.size(0), u.size(1))])
-                for u in context
-            ]))
+        context = self.embed_context(context)
 
         # grad ckpt args
         def create_custom_forward(module, return_dict=None):
@@ -842,9 +828,17 @@ class WanModel_S2V(ModelMixin, ConfigMixin):
             freqs=self.pre_compute_freqs,
             context=context,
             context_lens=context_lens)
-        for idx, block in enumerate(self.blocks):
-            x = block(x, **kwargs)
-            x = self.after_transformer_block(idx, x)
+
+        def run_blocks(x, start=0, end=None):
+            for idx in range(start, len(self.blocks) if end is None else end):
+                x = self.blocks[idx](x, **kwargs)
+                x = self.after_transformer_block(idx, x)
+            return x
+
+        if self.step_cache is not None and not torch.is_grad_enabled():
+            x = self.step_cache(context, x, run_blocks, e0[0])
+        else:
+            x = run_blocks(x)
 
         # Context Parallel
         if self.use_context_parallel:
@@ -10,7 +10,7 @@ from diffusers.loaders import FromOriginalModelMixin, PeftAdapterMixin
 from diffusers.utils import BaseOutput, is_torch_version
 from einops import rearrange, repeat
 
-from ..model import flash_attention
+from ..attention import attention
 from .s2v_utils import rope_precompute
 
 
@@ -151,6 +151,8 @@ class SelfAttention(nn.Module):
         self.window_size = window_size
         self.qk_norm = qk_norm
         self.eps = eps
+        # attention backend name, None uses the global default
+        self.attn_backend = None
 
         # layers
         self.q = nn.Linear(dim, dim)
@@ -172,12 +174,13 @@ class SelfAttention(nn.Module):
 
         q, k, v = qkv_fn(x)
 
-        x = flash_attention(
+        x = attention(
             q=rope_apply(q, grid_sizes, freqs),
             k=rope_apply(k, grid_sizes, freqs),
             v=v,
             k_lens=seq_lens,
-            window_size=self.window_size)
+            window_size=self.window_size,
+            backend=self.attn_backend)
 
         # output
         x = x.flatten(2)
@@ -224,12 +227,13 @@ class SwinSelfAttention(SelfAttention):
 
         # q: b (t h w) n d
         # k: b (t h w) n d
-        out = flash_attention(
+        out = attention(
             q=q,
             k=k,
             v=v,
             # k_lens=torch.tensor([k.shape[1]] * k.shape[0], device=x.device, dtype=torch.long),
-            window_size=self.window_size)
+            window_size=self.window_size,
+            backend=self.attn_backend)
         out = torch.cat([out, ref_v[:1]], axis=0)
         out = rearrange(out, '(b t) (h w) n d -> b (t h w) n d', t=T, h=H, w=W)
         x = out
@@ -308,11 +312,12 @@ class CasualSelfAttention(SelfAttention):
         # k: b (t h w) n d
         outs = []
         for i in range(q.shape[0]):
-            out = flash_attention(
+            out = attention(
                 q=q[i:i + 1],
                 k=k[i:i + 1],
                 v=v[i:i + 1],
-                window_size=self.window_size)
+                window_size=self.window_size,
+                backend=self.attn_backend)
             outs.append(out)
         out = torch.cat(outs, dim=0)
         out = torch.cat([out, ref_v[:1]], axis=0)
@@ -0,0 +1,151 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import logging
+
+import torch
+import torch.distributed as dist
+
+__all__ = ['StepCache', 'STEP_CACHE_MODES']
+
+STEP_CACHE_MODES = ('first_block', 'timestep')
+
+
+class _BranchState:
+
+    def __init__(self, key):
+        # the key tensor is kept alive so that its id is not reused
+        self.key = key
+        self.indicator = None
+        self.residual = None
+        self.num_steps = 0
+        self.num_skipped = 0
+        self.skips = 0
+
+
+class StepCache:
+
+    # conditional, unconditional and batched context of a request
+    max_branches = 4
+
+    def __init__(self,
+                 mode='first_block',
+                 threshold=0.05,
+                 max_skips=2,
+                 warmup_steps=1):
+        r"""
+        Residual caching across denoising steps (first block cache / TeaCache).
+        The output of the transformer blocks changes little between adjacent
+        steps, so when a cheap indicator has moved less than `threshold` since
+        the last fully computed step, the blocks are skipped and the residual
+        they added at that step is reused.
+
+        State is kept per branch, keyed by the identity of the embedded context
+        the model is called with, so the conditional and unconditional passes
+        of classifier-free guidance are tracked separately.
+
+        Args:
+            mode (`str`, *optional*, defaults to 'first_block'):
+                'first_block' runs the first block and compares its residual,
+                the remaining blocks are skipped. 'timestep' compares the time
+                modulation `e0` before any block runs and skips all of them,
+                which saves more but ignores the latents.
+            threshold (`float`, *optional*, defaults to 0.05):
+                Relative L1 change of the indicator below which a step is
+                skipped. Higher values skip more steps at lower quality.
+            max_skips (`int`, *optional*, defaults to 2):
+                Maximum number of consecutive skipped steps per branch.
+            warmup_steps (`int`, *optional*, defaults to 1):
+                Steps computed in full at the start of every branch.
+        """
+        assert mode in STEP_CACHE_MODES, f'Unsupported step cache mode {mode}.'
+        self.mode = mode
+        self.threshold = threshold
+        self.max_skips = max_skips
+        self.warmup_steps = warmup_steps
+        self._states = {}
+        # totals of the branches dropped by `max_branches`
+        self._evicted = (0, 0)
+
+    def __call__(self, key, x, run_blocks, e0=None):
+        r"""
+        Runs the transformer blocks of one denoising step, or reuses the
+        cached residual.
+
+        Args:
+            key (Tensor):
+                Embedded context of the branch, must be the same object at
+                every step, see `ContextCache`.
+            x (Tensor):
+                Input of the first block, shape [B, L, C].
+            run_blocks (`callable`):
+                `run_blocks(x, start, end)` runs blocks [start, end) on `x`,
+                `end=None` runs to the last block.
+            e0 (Tensor, *optional*):
+                Time modulation of the step, required for mode 'timestep'.
+
+        Returns:
+            Tensor: Output of the last block.
+        """
+        state = self._states.get(id(key))
+        if state is None:
+            if len(self._states) >= self.max_branches:
+                evicted = self._states.pop(next(iter(self._states)))
+                self._evicted = (self._evicted[0] + evicted.num_steps,
+                                 self._evicted[1] + evicted.num_skipped)
+            state = self._states[id(key)] = _BranchState(key)
+        state.num_steps += 1
+
+        if self.mode == 'first_block':
+            h = run_blocks(x, 0, 1)
+            indicator, start = h - x, 1
+        else:
+            assert e0 is not None
+            h, indicator, start = x, e0, 0
+
+        if self._can_skip(state, indicator, h):
+            state.skips += 1
+            state.num_skipped += 1
+            return h + state.residual
+
+        out = run_blocks(h, start, None)
+        state.indicator, state.residual, state.skips = indicator, out - h, 0
+        return out
+
+    def _can_skip(self, state, indicator, h):
+        if (state.residual is None or
+                state.num_steps <= self.warmup_steps or
+                state.skips >= self.max_skips or
+                state.residual.shape != h.shape or
+                state.indicator.shape != indicator.shape):
+            return False
+        diff = torch.stack([
+            (indicator - state.indicator).abs().float().mean(),
+            state.indicator.abs().float().mean()
+        ])
+        if dist.is_initialized() and dist.get_world_size() > 1:
+            # sequence parallel ranks hold different tokens but must agree
+            dist.all_reduce(diff)
+        diff, ref = diff.tolist()
+        return diff < self.threshold * ref
+
+    def stats(self):
+        r"""
+        Returns the number of steps and of skipped steps over all branches
+        since the last `reset`, including branches that were evicted.
+        """
+        return (self._evicted[0] +
+                sum(s.num_steps for s in self._states.values()),
+                self._evicted[1] +
+                sum(s.num_skipped for s in self._states.values()))
+
+    def reset(self):
+        r"""
+        Logs the skip statistics and drops the cached residuals, called at the
+        end of a request.
+        """
+        num_steps, num_skipped = self.stats()
+        if num_steps > 0:
+            logging.info(
+                f'Step cache ({self.mode}, threshold {self.threshold}): '
+                f'skipped {num_skipped} of {num_steps} model calls.')
+        self._states.clear()
+        self._evicted = (0, 0)
@@ -2,11 +2,15 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
 import logging
 import math
+import os
 
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.ao.nn.quantized.dynamic import Linear as DynamicQuantLinear
+from torch.ao.quantization import per_channel_dynamic_qconfig
 
+from .checkpoint import load_checkpoint, load_state_dict, resolve_checkpoint
 from .tokenizers import HuggingfaceTokenizer
 
 __all__ = [
@@ -68,6 +72,9 @@ class T5LayerNorm(nn.Module):
 
 class T5Attention(nn.Module):
 
+    # use F.scaled_dot_product_attention, set to False for the einsum path
+    use_sdpa = True
+
     def __init__(self, dim, dim_attn, num_heads, dropout=0.1):
         assert dim_attn % num_heads == 0
         super(T5Attention, self).__init__()
@@ -98,6 +105,33 @@ class T5Attention(nn.Module):
         k = self.k(context).view(b, -1, n, c)
         v = self.v(context).view(b, -1, n, c)
 
+        if self.use_sdpa:
+            # attention mask: relative position bias plus padding
+            attn_bias = None
+            if pos_bias is not None:
+                attn_bias = pos_bias.to(q.dtype)
+            if mask is not None:
+                assert mask.ndim in [2, 3]
+                mask = mask.view(b, 1, 1,
+                                 -1) if mask.ndim == 2 else mask.unsqueeze(1)
+                if attn_bias is None:
+                    attn_bias = q.new_zeros(1, 1, 1, 1)
+                attn_bias = attn_bias.masked_fill(mask == 0,
+                                                  torch.finfo(q.dtype).min)
+
+            # T5 does not use scaling
+            x = F.scaled_dot_product_attention(
+                q.transpose(1, 2),
+                k.transpose(1, 2),
+                v.transpose(1, 2),
+                attn_mask=attn_bias,
+                dropout_p=self.dropout.p if self.training else 0.0,
+                scale=1.0).transpose(1, 2)
+            x = x.reshape(b, -1, n * c)
+            x = self.o(x)
+            x = self.dropout(x)
+            return x
+
         # attention bias
         attn_bias = x.new_zeros(b, n, q.size(1), k.size(1))
         if pos_bias is not None:
@@ -220,6 +254,10 @@ class T5CrossAttention(nn.Module):
 
 class T5RelativeEmbedding(nn.Module):
 
+    # bucket indices shared by all layers, keyed on shape, device and config
+    _bucket_cache = {}
+    _bucket_cache_size = 32
+
     def __init__(self, num_buckets, num_heads, bidirectional, max_dist=128):
         super(T5RelativeEmbedding, self).__init__()
         self.num_buckets = num_buckets
@@ -232,16 +270,27 @@ class T5RelativeEmbedding(nn.Module):
 
     def forward(self, lq, lk):
         device = self.embedding.weight.device
-        # rel_pos = torch.arange(lk).unsqueeze(0).to(device) - \
-        #     torch.arange(lq).unsqueeze(1).to(device)
-        rel_pos = torch.arange(lk, device=device).unsqueeze(0) - \
-            torch.arange(lq, device=device).unsqueeze(1)
-        rel_pos = self._relative_position_bucket(rel_pos)
+        rel_pos = self._relative_position_buckets(lq, lk, device)
         rel_pos_embeds = self.embedding(rel_pos)
         rel_pos_embeds = rel_pos_embeds.permute(2, 0, 1).unsqueeze(
             0)  # [1, N, Lq, Lk]
         return rel_pos_embeds.contiguous()
 
+    def _relative_position_buckets(self, lq, lk, device):
+        r"""
+        Memoized bucket indices of shape [Lq, Lk] for the given lengths.
+        """
+        key = (lq, lk, device, self.num_buckets, self.bidirectional,
+               self.max_dist)
+        cache = T5RelativeEmbedding._bucket_cache
+        if key not in cache:
+            if len(cache) >= self._bucket_cache_size:
+                cache.pop(next(iter(cache)))
+            rel_pos = torch.arange(lk, device=device).unsqueeze(0) - \
+                torch.arange(lq, device=device).unsqueeze(1)
+            cache[key] = self._relative_position_bucket(rel_pos)
+        return cache[key]
+
     def _relative_position_bucket(self, rel_pos):
         # preprocess
         if self.bidirectional:
@@ -469,45 +518,196 @@ def umt5_xxl(**kwargs):
     return _t5('umt5-xxl', **cfg)
 
 
+def _upcast_output(module, args, output):
+    return output.float()
+
+
+def quantize_dynamic_int8(model, convert=True):
+    r"""
+    Converts the `nn.Linear` layers of a T5 model to dynamically quantized
+    int8 layers for CPU inference. Layers are converted one at a time, so no
+    float32 copy of the whole model is materialised. The remaining weights are
+    kept in float32, except for the token embedding, whose output is upcast.
+
+    Args:
+        model (`nn.Module`):
+            T5 model.
+        convert (`bool`, *optional*, defaults to True):
+            Quantize the existing weights. If False, empty int8 layers are
+            created to load a converted state dict into.
+    """
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if type(child) is not nn.Linear:
+                continue
+            if convert:
+                child.float()
+                child.qconfig = per_channel_dynamic_qconfig
+                q = DynamicQuantLinear.from_float(child)
+            else:
+                q = DynamicQuantLinear(
+                    child.in_features,
+                    child.out_features,
+                    bias_=child.bias is not None,
+                    dtype=torch.qint8)
+            setattr(parent, name, q)
+    if convert:
+        for name, param in model.named_parameters():
+            if not name.startswith('token_embedding.'):
+                param.data = param.data.float()
+    model.token_embedding.register_forward_hook(_upcast_output)
+    return model
+
+
 class T5EncoderModel:
 
     def __init__(
         self,
         text_len,
         dtype=torch.bfloat16,
-        device=torch.cuda.current_device(),
+        device=None,
         checkpoint_path=None,
         tokenizer_path=None,
         shard_fn=None,
+        cache=None,
+        pad_bucket=None,
+        quantize=None,
     ):
+        r"""
+        Args:
+            quantize (`str`, *optional*, defaults to None):
+                'int8' runs the encoder with dynamically quantized int8 linear
+                layers. CPU only. The converted model is cached next to the
+                checkpoint.
+        """
         self.text_len = text_len
         self.dtype = dtype
-        self.device = device
+        # resolved lazily so importing this module does not require CUDA
+        self.device = device if device is not None else torch.cuda.current_device()
         self.checkpoint_path = checkpoint_path
         self.tokenizer_path = tokenizer_path
-
-        # init model
-        model = umt5_xxl(
-            encoder_only=True,
-            return_tokenizer=False,
-            dtype=dtype,
-            device=device).eval().requires_grad_(False)
-        logging.info(f'loading {checkpoint_path}')
-        model.load_state_dict(torch.load(checkpoint_path, map_location='cpu'))
-        self.model = model
+        self.cache = cache
+        self.quantize = quantize
+
+        if quantize is not None:
+            assert quantize == 'int8', f'unsupported T5 quantization {quantize}'
+            assert torch.device(self.device).type == 'cpu' and shard_fn is None, \
+                'the quantized T5 encoder runs on CPU only'
+            self.model = self._load_int8(checkpoint_path)
+        else:
+            # init model on the meta device and assign the (mmapped) weights
+            model = umt5_xxl(
+                encoder_only=True,
+                return_tokenizer=False,
+                dtype=dtype,
+                device='meta')
+            self.model = load_checkpoint(
+                model, checkpoint_path,
+                dtype=dtype).eval().requires_grad_(False)
         if shard_fn is not None:
             self.model = shard_fn(self.model, sync_module_states=False)
         else:
             self.model.to(self.device)
         # init tokenizer
         self.tokenizer = HuggingfaceTokenizer(
-            name=tokenizer_path, seq_len=text_len, clean='whitespace')
+            name=tokenizer_path,
+            seq_len=text_len,
+            clean='whitespace',
+            pad_bucket=pad_bucket)
+
+    def _load_int8(self, checkpoint_path):
+        model = umt5_xxl(
+            encoder_only=True,
+            return_tokenizer=False,
+            dtype=self.dtype,
+            device='meta')
+        cache_path = os.path.splitext(
+            resolve_checkpoint(checkpoint_path))[0] + '.int8.pth'
+        if os.path.exists(cache_path):
+            try:
+                quantize_dynamic_int8(model, convert=False)
+                model.load_state_dict(
+                    load_state_dict(cache_path), assign=True)
+                return model.eval().requires_grad_(False)
+            except Exception as e:
+                logging.warning(f'Failed to load {cache_path}: {e}')
+                model = umt5_xxl(
+                    encoder_only=True,
+                    return_tokenizer=False,
+                    dtype=self.dtype,
+                    device='meta')
+
+        # one-time conversion, cached for later runs
+        model = load_checkpoint(model, checkpoint_path, dtype=self.dtype)
+        model = quantize_dynamic_int8(model.eval().requires_grad_(False))
+        tmp = cache_path + f'.{os.getpid()}.tmp'
+        try:
+            torch.save(model.state_dict(), tmp)
+            os.replace(tmp, cache_path)
+        except OSError as e:
+            logging.warning(f'Failed to cache {cache_path}: {e}')
+        return model
 
     def __call__(self, texts, device):
+        if self.cache is None:
+            return self.encode(texts, device)
+
+        keys = [self.cache_key(u) for u in texts]
+        context = [self.cache.get(k) for k in keys]
+        missing = [i for i, u in enumerate(context) if u is None]
+        if missing:
+            # duplicated prompts are encoded once
+            uniq = list(dict.fromkeys(keys[i] for i in missing))
+            encoded = self.encode([texts[keys.index(k)] for k in uniq], device)
+            encoded = {
+                k: self.cache.put(k, u) for k, u in zip(uniq, encoded)
+            }
+            for i in missing:
+                context[i] = encoded[keys[i]]
+        return [u.to(device) for u in context]
+
+    def encode(self, texts, device):
+        r"""
+        Runs the encoder on `texts`, bypassing the cache.
+        """
         ids, mask = self.tokenizer(
             texts, return_mask=True, add_special_tokens=True)
         ids = ids.to(device)
         mask = mask.to(device)
         seq_lens = mask.gt(0).sum(dim=1).long()
-        context = self.model(ids, mask)
+        context = self.model(ids, mask).to(self.dtype)
         return [u[:v] for u, v in zip(context, seq_lens)]
+
+    def cache_key(self, text):
+        r"""
+        Cache key of `text`: tokenizer, cleaned text, text_len and dtype.
+        """
+        if self.tokenizer.clean:
+            text = self.tokenizer._clean(text)
+        return self.cache.make_key(
+            self.tokenizer_path,
+            text,
+            self.text_len,
+            self.dtype,
+            namespace=os.path.basename(self.checkpoint_path or '') +
+            (f'.{self.quantize}' if self.quantize else ''))
+
+    def is_cached(self, texts):
+        r"""
+        Whether every prompt in `texts` can be served without running T5.
+        """
+        return self.cache is not None and all(
+            self.cache_key(u) in self.cache for u in texts)
+
+    def precompute(self, texts, device):
+        r"""
+        Encodes `texts` into the cache ahead of time, e.g. the default negative
+        prompt at pipeline construction. The model is moved to `device` for the
+        call and returned to where it was afterwards.
+        """
+        if self.cache is None or self.is_cached(texts):
+            return
+        model_device = next(self.model.parameters()).device
+        self.model.to(device)
+        self(texts, device)
+        self.model.to(model_device)
@@ -36,11 +36,29 @@ def canonicalize(text, keep_punctuation_exact_string=None):
 
 class HuggingfaceTokenizer:
 
-    def __init__(self, name, seq_len=None, clean=None, **kwargs):
+    def __init__(self,
+                 name,
+                 seq_len=None,
+                 clean=None,
+                 pad_bucket=None,
+                 **kwargs):
+        r"""
+        Args:
+            name (`str`):
+                Name or path of the HuggingFace tokenizer.
+            seq_len (`int`, *optional*, defaults to None):
+                Maximum sequence length. Outputs are truncated to it.
+            clean (`str`, *optional*, defaults to None):
+                Text cleaning mode, one of 'whitespace', 'lower' or 'canonicalize'.
+            pad_bucket (`int`, *optional*, defaults to None):
+                If set, pad to the longest sequence of the batch rounded up to a
+                multiple of `pad_bucket` instead of always padding to `seq_len`.
+        """
         assert clean in (None, 'whitespace', 'lower', 'canonicalize')
         self.name = name
         self.seq_len = seq_len
         self.clean = clean
+        self.pad_bucket = pad_bucket
 
         # init tokenizer
         self.tokenizer = AutoTokenizer.from_pretrained(name, **kwargs)
@@ -51,7 +69,14 @@ class HuggingfaceTokenizer:
 
         # arguments
         _kwargs = {'return_tensors': 'pt'}
-        if self.seq_len is not None:
+        if self.seq_len is not None and self.pad_bucket:
+            _kwargs.update({
+                'padding': 'longest',
+                'truncation': True,
+                'max_length': self.seq_len,
+                'pad_to_multiple_of': self.pad_bucket
+            })
+        elif self.seq_len is not None:
             _kwargs.update({
                 'padding': 'max_length',
                 'truncation': True,
@@ -1,5 +1,4 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
-import logging
 
 import torch
 import torch.cuda.amp as amp
@@ -7,6 +6,9 @@ import torch.nn as nn
 import torch.nn.functional as F
 from einops import rearrange
 
+from .checkpoint import load_checkpoint
+from .vae_tiling import iter_tiled
+
 __all__ = [
     'Wan2_1_VAE',
 ]
@@ -507,6 +509,10 @@ class WanVAE_(nn.Module):
         self.decoder = Decoder3d(dim, z_dim, dim_mult, num_res_blocks,
                                  attn_scales, self.temperal_upsample, dropout)
 
+        # spatial tiling, see `enable_tiling`
+        self.tile_size = None
+        self.tile_overlap = None
+
     def forward(self, x):
         mu, log_var = self.encode(x)
         z = self.reparameterize(mu, log_var)
@@ -518,20 +524,23 @@ class WanVAE_(nn.Module):
         ## cache
         t = x.shape[2]
         iter_ = 1 + (t - 1) // 4
-        ## 对encode输入的x，按时间拆分为1、4、4、4....
-        for i in range(iter_):
-            self._enc_conv_idx = [0]
-            if i == 0:
-                out = self.encoder(
-                    x[:, :, :1, :, :],
-                    feat_cache=self._enc_feat_map,
-                    feat_idx=self._enc_conv_idx)
-            else:
-                out_ = self.encoder(
-                    x[:, :, 1 + 4 * (i - 1):1 + 4 * i, :, :],
-                    feat_cache=self._enc_feat_map,
-                    feat_idx=self._enc_conv_idx)
-                out = torch.cat([out, out_], 2)
+        if self.tile_size is not None:
+            out = self._encode_tiled(x, iter_)
+        else:
+            ## 对encode输入的x，按时间拆分为1、4、4、4....
+            for i in range(iter_):
+                self._enc_conv_idx = [0]
+                if i == 0:
+                    out = self.encoder(
+                        x[:, :, :1, :, :],
+                        feat_cache=self._enc_feat_map,
+                        feat_idx=self._enc_conv_idx)
+                else:
+                    out_ = self.encoder(
+                        x[:, :, 1 + 4 * (i - 1):1 + 4 * i, :, :],
+                        feat_cache=self._enc_feat_map,
+                        feat_idx=self._enc_conv_idx)
+                    out = torch.cat([out, out_], 2)
         mu, log_var = self.conv1(out).chunk(2, dim=1)
         if isinstance(scale[0], torch.Tensor):
             mu = (mu - scale[0].view(1, self.z_dim, 1, 1, 1)) * scale[1].view(
@@ -542,6 +551,27 @@ class WanVAE_(nn.Module):
         return mu
 
     def decode(self, z, scale):
+        r"""
+        Decodes `z` [B, C, T, H, W] into one preallocated video tensor.
+        """
+        out, t = None, 0
+        for chunk in self.decode_stream(z, scale):
+            if out is None:
+                num_frames = 1 + (z.size(2) - 1) * 2**sum(
+                    self.temperal_upsample)
+                out = chunk.new_empty(*chunk.shape[:2], num_frames,
+                                      *chunk.shape[3:])
+            out[:, :, t:t + chunk.size(2)] = chunk
+            t += chunk.size(2)
+        assert t == out.size(2)
+        return out
+
+    def decode_stream(self, z, scale):
+        r"""
+        Decodes `z` [B, C, T, H, W] one latent frame at a time and yields
+        every chunk of pixel frames as soon as its causal slice is done, so
+        only one chunk of the video has to be held at a time.
+        """
         self.clear_cache()
         # z: [b,c,t,h,w]
         if isinstance(scale[0], torch.Tensor):
@@ -549,23 +579,67 @@ class WanVAE_(nn.Module):
                 1, self.z_dim, 1, 1, 1)
         else:
             z = z / scale[1] + scale[0]
-        iter_ = z.shape[2]
         x = self.conv2(z)
-        for i in range(iter_):
+        chunks = self._decode_tiled(
+            x) if self.tile_size is not None else self._decode_chunks(x)
+        try:
+            for out in chunks:
+                yield out
+        finally:
+            self.clear_cache()
+
+    def _decode_chunks(self, x):
+        for i in range(x.size(2)):
             self._conv_idx = [0]
-            if i == 0:
-                out = self.decoder(
-                    x[:, :, i:i + 1, :, :],
-                    feat_cache=self._feat_map,
-                    feat_idx=self._conv_idx)
-            else:
-                out_ = self.decoder(
-                    x[:, :, i:i + 1, :, :],
-                    feat_cache=self._feat_map,
-                    feat_idx=self._conv_idx)
-                out = torch.cat([out, out_], 2)
-        self.clear_cache()
-        return out
+            yield self.decoder(
+                x[:, :, i:i + 1, :, :],
+                feat_cache=self._feat_map,
+                feat_idx=self._conv_idx)
+
+    def enable_tiling(self, tile_size=(32, 32), tile_overlap=(8, 8)):
+        r"""
+        Encode and decode in overlapping spatial tiles, each running the causal
+        network with its own feature cache, to bound activation memory at high
+        resolutions. Tiles are feathered together across the overlap. The
+        result approximates the untiled one: convolutions near tile borders
+        see zero padding instead of the neighbouring content, and the middle
+        attention block only attends within its tile.
+
+        Args:
+            tile_size (`tuple[int, int]`, *optional*, defaults to (32, 32)):
+                Tile (height, width) in latent units.
+            tile_overlap (`tuple[int, int]`, *optional*, defaults to (8, 8)):
+                Minimum overlap of neighbouring tiles in latent units.
+        """
+        self.tile_size = tuple(tile_size)
+        self.tile_overlap = tuple(tile_overlap)
+
+    def disable_tiling(self):
+        self.tile_size = None
+        self.tile_overlap = None
+
+    def _encode_tiled(self, x, iter_):
+        s = 2**(len(self.dim_mult) - 1)
+        chunks = [(0, 1)] + [(1 + 4 * (i - 1), 1 + 4 * i)
+                             for i in range(1, iter_)]
+
+        def step(x, feat_cache, first):
+            return self.encoder(x, feat_cache=feat_cache, feat_idx=[0])
+
+        return torch.cat(
+            list(
+                iter_tiled(step, x, chunks, (x.size(3) // s, x.size(4) // s),
+                           self.tile_size, self.tile_overlap, s,
+                           count_conv3d(self.encoder))), 2)
+
+    def _decode_tiled(self, x):
+        chunks = [(i, i + 1) for i in range(x.size(2))]
+
+        def step(x, feat_cache, first):
+            return self.decoder(x, feat_cache=feat_cache, feat_idx=[0])
+
+        return iter_tiled(step, x, chunks, x.shape[3:], self.tile_size,
+                          self.tile_overlap, 1, count_conv3d(self.decoder))
 
     def reparameterize(self, mu, log_var):
         std = torch.exp(0.5 * log_var)
@@ -609,9 +683,7 @@ def _video_vae(pretrained_path=None, z_dim=None, device='cpu', **kwargs):
         model = WanVAE_(**cfg)
 
     # load checkpoint
-    logging.info(f'loading {pretrained_path}')
-    model.load_state_dict(
-        torch.load(pretrained_path, map_location=device), assign=True)
+    load_checkpoint(model, pretrained_path, device=device)
 
     return model
 
@@ -644,6 +716,15 @@ class Wan2_1_VAE:
             z_dim=z_dim,
         ).eval().requires_grad_(False).to(device)
 
+    def enable_tiling(self, tile_size=(32, 32), tile_overlap=(8, 8)):
+        r"""
+        Encode / decode in overlapping spatial tiles, see `WanVAE_.enable_tiling`.
+        """
+        self.model.enable_tiling(tile_size, tile_overlap)
+
+    def disable_tiling(self):
+        self.model.disable_tiling()
+
     def encode(self, videos):
         """
         videos: A list of videos each with shape [C, T, H, W].
@@ -654,10 +735,48 @@ class Wan2_1_VAE:
                 for u in videos
             ]
 
-    def decode(self, zs):
+    def decode(self, zs, writer=None):
+        """
+        zs: A list of latents each with shape [C, T, H, W].
+        writer: Optional `VideoWriter` that receives every decoded chunk.
+        """
+        return [self._decode_into_buffer(u, writer) for u in zs]
+
+    def decode_stream(self, z):
+        """
+        z: A latent with shape [C, T, H, W]. Yields float32 pixel chunks
+        clamped to [-1, 1], each with shape [3, t, H', W'].
+        """
+        chunks = self.model.decode_stream(z.unsqueeze(0), self.scale)
+        try:
+            while True:
+                # autocast only covers decoding the next chunk, it must not
+                # leak into the consumer while the generator is suspended
+                with amp.autocast(dtype=self.dtype):
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        return
+                    chunk = chunk.squeeze(0).float().clamp_(-1, 1)
+                yield chunk
+        finally:
+            chunks.close()
+
+    def _decode_into_buffer(self, z, writer=None):
+        out, t = None, 0
         with amp.autocast(dtype=self.dtype):
-            return [
-                self.model.decode(u.unsqueeze(0),
-                                  self.scale).float().clamp_(-1, 1).squeeze(0)
-                for u in zs
-            ]
+            for chunk in self.model.decode_stream(z.unsqueeze(0), self.scale):
+                chunk = chunk.squeeze(0)
+                if out is None:
+                    num_frames = 1 + (z.size(1) - 1) * 2**sum(
+                        self.model.temperal_upsample)
+                    out = torch.empty(
+                        chunk.size(0),
+                        num_frames,
+                        *chunk.shape[2:],
+                        dtype=torch.float32,
+                        device=chunk.device)
+                out[:, t:t + chunk.size(1)].copy_(chunk).clamp_(-1, 1)
+                if writer is not None:
+                    writer.write(out[:, t:t + chunk.size(1)])
+                t += chunk.size(1)
+        return out
@@ -0,0 +1,98 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import torch
+
+__all__ = ['tile_spans', 'tile_weights', 'iter_tiled']
+
+
+def tile_spans(length, tile, overlap):
+    r"""
+    Start / end indices of tiles of size `tile` covering `[0, length)`, where
+    neighbouring tiles share at least `overlap` positions.
+    """
+    assert 0 <= overlap < tile
+    if length <= tile:
+        return [(0, length)]
+    stride = tile - overlap
+    starts = list(range(0, length - tile, stride)) + [length - tile]
+    return [(s, s + tile) for s in starts]
+
+
+def tile_weights(spans, factor, device):
+    r"""
+    1-D blending weights of each span, upsampled by `factor`. Each weight
+    ramps linearly across the positions shared with the previous / next span,
+    so the weights of two overlapping tiles add up to one.
+    """
+    out = []
+    for i, (a, b) in enumerate(spans):
+        w = torch.ones((b - a) * factor, device=device)
+        if i > 0:
+            n = (spans[i - 1][1] - a) * factor
+            w[:n] = torch.arange(1, n + 1, device=device) / (n + 1)
+        if i < len(spans) - 1:
+            n = (b - spans[i + 1][0]) * factor
+            w[-n:] = torch.minimum(
+                w[-n:],
+                torch.arange(n, 0, -1, device=device) / (n + 1))
+        out.append(w)
+    return out
+
+
+def iter_tiled(step, x, chunks, grid_size, tile_size, tile_overlap, in_factor,
+               num_caches):
+    r"""
+    Runs a causal, chunk-wise 3D network over overlapping spatial tiles, each
+    tile with its own feature cache, and feathers the tiles back together.
+
+    Args:
+        step (`callable`):
+            `step(x_chunk, feat_cache, first)` runs the network on one temporal
+            chunk of one tile and returns its output.
+        x (`Tensor`):
+            Input of shape [B, C, T, H, W].
+        chunks (`list[tuple[int, int]]`):
+            Temporal ranges of `x`, processed in order.
+        grid_size (`tuple[int, int]`):
+            (H, W) of the latent grid the tiles are laid out on.
+        tile_size, tile_overlap (`tuple[int, int]`):
+            Tile size and minimum overlap in latent grid units.
+        in_factor (`int`):
+            Size of one latent grid cell in `x`, e.g. 1 for decode and the
+            spatial compression for encode.
+        num_caches (`int`):
+            Length of the per-tile `feat_cache` list.
+
+    Yields:
+        `Tensor`: The blended output of every temporal chunk.
+    """
+    spans_h = tile_spans(grid_size[0], tile_size[0], tile_overlap[0])
+    spans_w = tile_spans(grid_size[1], tile_size[1], tile_overlap[1])
+    caches = {(i, j): [None] * num_caches
+              for i in range(len(spans_h))
+              for j in range(len(spans_w))}
+
+    weights_h = weights_w = norm = None
+    for k, (t0, t1) in enumerate(chunks):
+        out = None
+        for i, (h0, h1) in enumerate(spans_h):
+            for j, (w0, w1) in enumerate(spans_w):
+                y = step(
+                    x[:, :, t0:t1, h0 * in_factor:h1 * in_factor,
+                      w0 * in_factor:w1 * in_factor], caches[i, j], k == 0)
+                fh, fw = y.size(3) // (h1 - h0), y.size(4) // (w1 - w0)
+                if weights_h is None:
+                    weights_h = tile_weights(spans_h, fh, y.device)
+                    weights_w = tile_weights(spans_w, fw, y.device)
+                    norm = torch.zeros(
+                        grid_size[0] * fh, grid_size[1] * fw, device=y.device)
+                    for a, (p0, p1) in zip(weights_h, spans_h):
+                        for b, (q0, q1) in zip(weights_w, spans_w):
+                            norm[p0 * fh:p1 * fh,
+                                 q0 * fw:q1 * fw] += a[:, None] * b[None, :]
+                if out is None:
+                    out = y.new_zeros(*y.shape[:3], grid_size[0] * fh,
+                                      grid_size[1] * fw)
+                weight = (weights_h[i][:, None] * weights_w[j][None, :]).to(
+                    y.dtype)
+                out[..., h0 * fh:h1 * fh, w0 * fw:w1 * fw] += y * weight
+        yield out / norm.to(out.dtype)
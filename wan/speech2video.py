@@ -24,16 +24,19 @@ from tqdm import tqdm
 from .distributed.fsdp import shard_model
 from .distributed.sequence_parallel import sp_attn_forward, sp_dit_forward
 from .distributed.util import get_world_size
+from .modules.attention import set_attention_backend
+from .modules.model import context_cache_scope
+from .modules.quant import load_pretrained
 from .modules.s2v.audio_encoder import AudioEncoder
 from .modules.s2v.model_s2v import WanModel_S2V, sp_attn_forward_s2v
+from .modules.step_cache import StepCache
 from .modules.t5 import T5EncoderModel
 from .modules.vae2_1 import Wan2_1_VAE
-from .utils.fm_solvers import (
-    FlowDPMSolverMultistepScheduler,
-    get_sampling_sigmas,
-    retrieve_timesteps,
-)
-from .utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
+from .utils.fm_solvers import get_sampling_sigmas, retrieve_timesteps
+from .utils.fm_solvers_device import scheduler_class
+from .utils.guidance import GuidancePolicy, cfg_batch_args
+from .utils.prompt_cache import PromptEmbeddingCache
+from .utils.regional_compile import compile_blocks, seq_len_buckets
 
 
 def load_safetensors(path):
@@ -86,6 +89,8 @@ class WanS2V:
                 Only works without FSDP.
         """
         self.device = torch.device(f"cuda:{device_id}")
+        set_attention_backend(
+            config.attn_backend, self.device, benchmark=config.attn_benchmark)
         self.config = config
         self.rank = rank
         self.t5_cpu = t5_cpu
@@ -105,21 +110,35 @@ class WanS2V:
             checkpoint_path=os.path.join(checkpoint_dir, config.t5_checkpoint),
             tokenizer_path=os.path.join(checkpoint_dir, config.t5_tokenizer),
             shard_fn=shard_fn if t5_fsdp else None,
+            cache=PromptEmbeddingCache(
+                max_entries=config.t5_cache_size,
+                cache_dir=config.t5_cache_dir),
+            pad_bucket=config.t5_pad_bucket,
+            quantize=config.t5_quant if t5_cpu else None,
         )
 
         self.vae = Wan2_1_VAE(
             vae_pth=os.path.join(checkpoint_dir, config.vae_checkpoint),
             device=self.device)
+        if config.vae_tile_size is not None:
+            self.vae.enable_tiling(config.vae_tile_size, config.vae_tile_overlap)
 
         logging.info(f"Creating WanModel from {checkpoint_dir}")
         if not dit_fsdp:
-            self.noise_model = WanModel_S2V.from_pretrained(
+            self.noise_model = load_pretrained(
+                WanModel_S2V,
                 checkpoint_dir,
+                bits=config.dit_quant_bits,
+                group_size=config.dit_quant_group_size,
                 torch_dtype=self.param_dtype,
                 device_map=self.device)
         else:
-            self.noise_model = WanModel_S2V.from_pretrained(
-                checkpoint_dir, torch_dtype=self.param_dtype)
+            self.noise_model = load_pretrained(
+                WanModel_S2V,
+                checkpoint_dir,
+                bits=config.dit_quant_bits,
+                group_size=config.dit_quant_group_size,
+                torch_dtype=self.param_dtype)
 
         self.noise_model = self._configure_model(
             model=self.noise_model,
@@ -138,6 +157,9 @@ class WanS2V:
             self.sp_size = 1
 
         self.sample_neg_prompt = config.sample_neg_prompt
+        self.text_encoder.precompute(
+            [self.sample_neg_prompt],
+            torch.device('cpu') if t5_cpu else self.device)
         self.motion_frames = config.transformer.motion_frames
         self.drop_first_motion = config.drop_first_motion
         self.fps = config.sample_fps
@@ -173,6 +195,13 @@ class WanS2V:
                     sp_attn_forward_s2v, block.self_attn)
             model.use_context_parallel = True
 
+        if self.config.step_cache:
+            model.step_cache = StepCache(
+                mode=self.config.step_cache,
+                threshold=self.config.step_cache_threshold,
+                max_skips=self.config.step_cache_max_skips,
+                warmup_steps=self.config.step_cache_warmup_steps)
+
         if dist.is_initialized():
             dist.barrier()
 
@@ -184,6 +213,15 @@ class WanS2V:
             if not self.init_on_cpu:
                 model.to(self.device)
 
+        if self.config.compile_blocks and not dit_fsdp:
+            compile_blocks(
+                model,
+                buckets=seq_len_buckets(self.config.compile_sizes,
+                                        self.config.vae_stride,
+                                        self.config.patch_size),
+                backend=self.config.compile_backend,
+                mode=self.config.compile_mode)
+
         return model
 
     def get_size_less_than_area(self,
@@ -410,6 +448,7 @@ class WanS2V:
         seed=-1,
         offload_model=True,
         init_first_frame=False,
+        batch_cfg=False,
     ):
         r"""
         Generates video frames from input image and text prompt using diffusion process.
@@ -448,6 +487,9 @@ class WanS2V:
                 If True, offloads models to CPU during generation to save VRAM
             init_first_frame (`bool`, *optional*, defaults to False):
                 Whether to use the reference image as the first frame (i.e., standard image-to-video generation)
+            batch_cfg (`bool`, *optional*, defaults to False):
+                If True and `guide_scale > 1`, runs the conditional and unconditional
+                passes as a single batch-of-2 forward per step
 
         Returns:
             torch.Tensor:
@@ -520,22 +562,24 @@ class WanS2V:
 
         # preprocess
         if not self.t5_cpu:
-            self.text_encoder.model.to(self.device)
-            context = self.text_encoder([input_prompt], self.device)
-            context_null = self.text_encoder([n_prompt], self.device)
+            if not self.text_encoder.is_cached([input_prompt, n_prompt]):
+                self.text_encoder.model.to(self.device)
+            context = self.text_encoder([input_prompt, n_prompt], self.device)
             if offload_model:
                 self.text_encoder.model.cpu()
         else:
-            context = self.text_encoder([input_prompt], torch.device('cpu'))
-            context_null = self.text_encoder([n_prompt], torch.device('cpu'))
+            context = self.text_encoder([input_prompt, n_prompt],
+                                        torch.device('cpu'))
             context = [t.to(self.device) for t in context]
-            context_null = [t.to(self.device) for t in context_null]
+        context, context_null = context[:1], context[1:]
 
         out = []
+        guidance = GuidancePolicy.from_config(self.config)
         # evaluation mode
         with (
                 torch.amp.autocast('cuda', dtype=self.param_dtype),
                 torch.no_grad(),
+                context_cache_scope(self.noise_model),
         ):
             for r in range(num_repeat):
                 seed_g = torch.Generator(device=self.device)
@@ -557,18 +601,20 @@ class WanS2V:
                 max_seq_len = np.prod(target_shape) // 4
 
                 if sample_solver == 'unipc':
-                    sample_scheduler = FlowUniPCMultistepScheduler(
-                        num_train_timesteps=self.num_train_timesteps,
-                        shift=1,
-                        use_dynamic_shifting=False)
+                    sample_scheduler = scheduler_class(
+                        'unipc', self.config.device_scheduler)(
+                            num_train_timesteps=self.num_train_timesteps,
+                            shift=1,
+                            use_dynamic_shifting=False)
                     sample_scheduler.set_timesteps(
                         sampling_steps, device=self.device, shift=shift)
                     timesteps = sample_scheduler.timesteps
                 elif sample_solver == 'dpm++':
-                    sample_scheduler = FlowDPMSolverMultistepScheduler(
-                        num_train_timesteps=self.num_train_timesteps,
-                        shift=1,
-                        use_dynamic_shifting=False)
+                    sample_scheduler = scheduler_class(
+                        'dpm++', self.config.device_scheduler)(
+                            num_train_timesteps=self.num_train_timesteps,
+                            shift=1,
+                            use_dynamic_shifting=False)
                     sampling_sigmas = get_sampling_sigmas(sampling_steps, shift)
                     timesteps, _ = retrieve_timesteps(
                         sample_scheduler,
@@ -610,24 +656,38 @@ class WanS2V:
                         ],
                         "drop_motion_frames": drop_first_motion and r == 0,
                     }
+                    if batch_cfg:
+                        arg_cfg = cfg_batch_args(arg_c, arg_null)
                 if offload_model or self.init_on_cpu:
                     self.noise_model.to(self.device)
                     torch.cuda.empty_cache()
 
+                guidance.plan(timesteps)
                 for i, t in enumerate(tqdm(timesteps)):
                     latent_model_input = latents[0:1]
                     timestep = [t]
 
                     timestep = torch.stack(timestep).to(self.device)
 
-                    noise_pred_cond = self.noise_model(
-                        latent_model_input, t=timestep, **arg_c)
+                    use_uncond = guide_scale > 1 and guidance.use_uncond(i)
+                    if use_uncond and batch_cfg:
+                        noise_pred = self.noise_model(
+                            latent_model_input * 2,
+                            t=torch.cat([timestep, timestep]),
+                            **arg_cfg)
+                        noise_pred_cond = noise_pred[:1]
+                        noise_pred_uncond = noise_pred[1:]
+                    else:
+                        noise_pred_cond = self.noise_model(
+                            latent_model_input, t=timestep, **arg_c)
+                        noise_pred_uncond = [None]
+                        if use_uncond:
+                            noise_pred_uncond = self.noise_model(
+                                latent_model_input, t=timestep, **arg_null)
 
                     if guide_scale > 1:
-                        noise_pred_uncond = self.noise_model(
-                            latent_model_input, t=timestep, **arg_null)
                         noise_pred = [
-                            u + guide_scale * (c - u)
+                            guidance(i, c, u, guide_scale)
                             for c, u in zip(noise_pred_cond, noise_pred_uncond)
                         ]
                     else:
@@ -667,6 +727,7 @@ class WanS2V:
                     self.vae.encode(videos_last_frames))
                 out.append(image.cpu())
 
+        guidance.report()
         videos = torch.cat(out, dim=2)
         del noise, latents
         del sample_scheduler
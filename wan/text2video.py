@@ -6,7 +6,7 @@ import os
 import random
 import sys
 import types
-from contextlib import contextmanager
+from contextlib import ExitStack, contextmanager
 from functools import partial
 
 import torch
@@ -17,15 +17,22 @@ from tqdm import tqdm
 from .distributed.fsdp import shard_model
 from .distributed.sequence_parallel import sp_attn_forward, sp_dit_forward
 from .distributed.util import get_world_size
-from .modules.model import WanModel
+from .modules.attention import set_attention_backend
+from .modules.model import (
+    WanModel,
+    clear_context_cache,
+    context_cache_scope,
+)
+from .modules.quant import load_pretrained
+from .modules.step_cache import StepCache
 from .modules.t5 import T5EncoderModel
 from .modules.vae2_1 import Wan2_1_VAE
-from .utils.fm_solvers import (
-    FlowDPMSolverMultistepScheduler,
-    get_sampling_sigmas,
-    retrieve_timesteps,
-)
-from .utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
+from .utils.fm_solvers import get_sampling_sigmas, retrieve_timesteps
+from .utils.fm_solvers_device import scheduler_class
+from .utils.guidance import GuidancePolicy, cfg_batch_args
+from .utils.offload import BlockStreamer, ExpertPrefetcher
+from .utils.prompt_cache import PromptEmbeddingCache
+from .utils.regional_compile import compile_blocks, seq_len_buckets
 
 
 class WanT2V:
@@ -70,10 +77,16 @@ class WanT2V:
                 Only works without FSDP.
         """
         self.device = torch.device(f"cuda:{device_id}")
+        set_attention_backend(
+            config.attn_backend, self.device, benchmark=config.attn_benchmark)
         self.config = config
         self.rank = rank
         self.t5_cpu = t5_cpu
         self.init_on_cpu = init_on_cpu
+        # stream DiT blocks from host memory instead of moving whole experts
+        self.offload_blocks = None if dit_fsdp else config.offload_blocks
+        # one BlockStreamer per expert when `offload_blocks` is set
+        self.block_streamers = []
 
         self.num_train_timesteps = config.num_train_timesteps
         self.boundary = config.boundary
@@ -89,17 +102,28 @@ class WanT2V:
             device=torch.device('cpu'),
             checkpoint_path=os.path.join(checkpoint_dir, config.t5_checkpoint),
             tokenizer_path=os.path.join(checkpoint_dir, config.t5_tokenizer),
-            shard_fn=shard_fn if t5_fsdp else None)
+            shard_fn=shard_fn if t5_fsdp else None,
+            cache=PromptEmbeddingCache(
+                max_entries=config.t5_cache_size,
+                cache_dir=config.t5_cache_dir),
+            pad_bucket=config.t5_pad_bucket,
+            quantize=config.t5_quant if t5_cpu else None)
 
         self.vae_stride = config.vae_stride
         self.patch_size = config.patch_size
         self.vae = Wan2_1_VAE(
             vae_pth=os.path.join(checkpoint_dir, config.vae_checkpoint),
             device=self.device)
+        if config.vae_tile_size is not None:
+            self.vae.enable_tiling(config.vae_tile_size, config.vae_tile_overlap)
 
         logging.info(f"Creating WanModel from {checkpoint_dir}")
-        self.low_noise_model = WanModel.from_pretrained(
-            checkpoint_dir, subfolder=config.low_noise_checkpoint)
+        self.low_noise_model = load_pretrained(
+            WanModel,
+            checkpoint_dir,
+            subfolder=config.low_noise_checkpoint,
+            bits=config.dit_quant_bits,
+            group_size=config.dit_quant_group_size)
         self.low_noise_model = self._configure_model(
             model=self.low_noise_model,
             use_sp=use_sp,
@@ -107,8 +131,12 @@ class WanT2V:
             shard_fn=shard_fn,
             convert_model_dtype=convert_model_dtype)
 
-        self.high_noise_model = WanModel.from_pretrained(
-            checkpoint_dir, subfolder=config.high_noise_checkpoint)
+        self.high_noise_model = load_pretrained(
+            WanModel,
+            checkpoint_dir,
+            subfolder=config.high_noise_checkpoint,
+            bits=config.dit_quant_bits,
+            group_size=config.dit_quant_group_size)
         self.high_noise_model = self._configure_model(
             model=self.high_noise_model,
             use_sp=use_sp,
@@ -121,6 +149,9 @@ class WanT2V:
             self.sp_size = 1
 
         self.sample_neg_prompt = config.sample_neg_prompt
+        self.text_encoder.precompute(
+            [self.sample_neg_prompt],
+            torch.device('cpu') if t5_cpu else self.device)
 
     def _configure_model(self, model, use_sp, dit_fsdp, shard_fn,
                          convert_model_dtype):
@@ -153,6 +184,13 @@ class WanT2V:
                     sp_attn_forward, block.self_attn)
             model.forward = types.MethodType(sp_dit_forward, model)
 
+        if self.config.step_cache:
+            model.step_cache = StepCache(
+                mode=self.config.step_cache,
+                threshold=self.config.step_cache_threshold,
+                max_skips=self.config.step_cache_max_skips,
+                warmup_steps=self.config.step_cache_warmup_steps)
+
         if dist.is_initialized():
             dist.barrier()
 
@@ -161,44 +199,73 @@ class WanT2V:
         else:
             if convert_model_dtype:
                 model.to(self.param_dtype)
-            if not self.init_on_cpu:
+            if self.offload_blocks:
+                self.block_streamers.append(
+                    BlockStreamer(
+                        model, self.device, num_resident=self.offload_blocks))
+            elif not self.init_on_cpu:
                 model.to(self.device)
 
+        if self.config.compile_blocks and not dit_fsdp:
+            compile_blocks(
+                model,
+                buckets=seq_len_buckets(self.config.compile_sizes,
+                                        self.config.vae_stride,
+                                        self.config.patch_size),
+                backend=self.config.compile_backend,
+                mode=self.config.compile_mode)
+
         return model
 
-    def _prepare_model_for_timestep(self, t, boundary, offload_model):
+    def _schedule_experts(self, timesteps, boundary, offload_model):
         r"""
-        Prepares and returns the required model for the current timestep.
+        Decides the expert of every sampling step up front, so that the
+        sampling loop needs no host synchronization and the expert switch can
+        be prefetched.
 
         Args:
-            t (torch.Tensor):
-                current timestep.
+            timesteps (torch.Tensor):
+                Timesteps of the sampling run.
             boundary (`int`):
-                The timestep threshold. If `t` is at or above this value,
-                the `high_noise_model` is considered as the required model.
+                The timestep threshold. Steps with `t` at or above this value
+                use the `high_noise_model`.
             offload_model (`bool`):
                 A flag intended to control the offloading behavior.
 
         Returns:
-            torch.nn.Module:
-                The active model on the target device for the current timestep.
+            tuple[ExpertPrefetcher, list[bool]]:
+                The prefetcher returning the expert of a step on the target
+                device, and whether each step is a high noise step.
         """
-        if t.item() >= boundary:
-            required_model_name = 'high_noise_model'
-            offload_model_name = 'low_noise_model'
-        else:
-            required_model_name = 'low_noise_model'
-            offload_model_name = 'high_noise_model'
-        if offload_model or self.init_on_cpu:
-            if next(getattr(
-                    self,
-                    offload_model_name).parameters()).device.type == 'cuda':
-                getattr(self, offload_model_name).to('cpu')
-            if next(getattr(
-                    self,
-                    required_model_name).parameters()).device.type == 'cpu':
-                getattr(self, required_model_name).to(self.device)
-        return getattr(self, required_model_name)
+        high_noise = (timesteps >= boundary).tolist()
+        models = {
+            'high_noise_model': self.high_noise_model,
+            'low_noise_model': self.low_noise_model
+        }
+        experts = ExpertPrefetcher(
+            models, [
+                'high_noise_model' if u else 'low_noise_model'
+                for u in high_noise
+            ],
+            self.device,
+            offload=(offload_model or self.init_on_cpu) and
+            not self.offload_blocks,
+            prefetch=self.config.expert_prefetch,
+            streamers={
+                name: streamer for name, model in models.items()
+                for streamer in self.block_streamers
+                if streamer.model is model
+            })
+        return experts, high_noise
+
+    def remove_block_streamers(self):
+        r"""
+        Stops streaming the DiT blocks and leaves them in host memory, e.g.
+        before the pipeline is released.
+        """
+        for streamer in self.block_streamers:
+            streamer.remove()
+        self.block_streamers = []
 
     def generate(self,
                  input_prompt,
@@ -210,7 +277,9 @@ class WanT2V:
                  guide_scale=5.0,
                  n_prompt="",
                  seed=-1,
-                 offload_model=True):
+                 offload_model=True,
+                 batch_cfg=False,
+                 video_writer=None):
         r"""
         Generates video frames from text prompt using diffusion process.
 
@@ -237,6 +306,12 @@ class WanT2V:
                 Random seed for noise generation. If -1, use random seed.
             offload_model (`bool`, *optional*, defaults to True):
                 If True, offloads models to CPU during generation to save VRAM
+            batch_cfg (`bool`, *optional*, defaults to False):
+                If True, runs the conditional and unconditional passes as a single
+                batch-of-2 forward per step. Faster, but needs more activation memory
+            video_writer (`VideoWriter`, *optional*, defaults to None):
+                If given, decoded frame chunks are streamed to it while the VAE
+                decode is still running
 
         Returns:
             torch.Tensor:
@@ -265,16 +340,16 @@ class WanT2V:
         seed_g.manual_seed(seed)
 
         if not self.t5_cpu:
-            self.text_encoder.model.to(self.device)
-            context = self.text_encoder([input_prompt], self.device)
-            context_null = self.text_encoder([n_prompt], self.device)
+            if not self.text_encoder.is_cached([input_prompt, n_prompt]):
+                self.text_encoder.model.to(self.device)
+            context = self.text_encoder([input_prompt, n_prompt], self.device)
             if offload_model:
                 self.text_encoder.model.cpu()
         else:
-            context = self.text_encoder([input_prompt], torch.device('cpu'))
-            context_null = self.text_encoder([n_prompt], torch.device('cpu'))
+            context = self.text_encoder([input_prompt, n_prompt],
+                                        torch.device('cpu'))
             context = [t.to(self.device) for t in context]
-            context_null = [t.to(self.device) for t in context_null]
+        context, context_null = context[:1], context[1:]
 
         noise = [
             torch.randn(
@@ -302,22 +377,27 @@ class WanT2V:
                 torch.no_grad(),
                 no_sync_low_noise(),
                 no_sync_high_noise(),
+                context_cache_scope(self.low_noise_model,
+                                    self.high_noise_model),
+                ExitStack() as stack,
         ):
             boundary = self.boundary * self.num_train_timesteps
 
             if sample_solver == 'unipc':
-                sample_scheduler = FlowUniPCMultistepScheduler(
-                    num_train_timesteps=self.num_train_timesteps,
-                    shift=1,
-                    use_dynamic_shifting=False)
+                sample_scheduler = scheduler_class(
+                    'unipc', self.config.device_scheduler)(
+                        num_train_timesteps=self.num_train_timesteps,
+                        shift=1,
+                        use_dynamic_shifting=False)
                 sample_scheduler.set_timesteps(
                     sampling_steps, device=self.device, shift=shift)
                 timesteps = sample_scheduler.timesteps
             elif sample_solver == 'dpm++':
-                sample_scheduler = FlowDPMSolverMultistepScheduler(
-                    num_train_timesteps=self.num_train_timesteps,
-                    shift=1,
-                    use_dynamic_shifting=False)
+                sample_scheduler = scheduler_class(
+                    'dpm++', self.config.device_scheduler)(
+                        num_train_timesteps=self.num_train_timesteps,
+                        shift=1,
+                        use_dynamic_shifting=False)
                 sampling_sigmas = get_sampling_sigmas(sampling_steps, shift)
                 timesteps, _ = retrieve_timesteps(
                     sample_scheduler,
@@ -331,25 +411,41 @@ class WanT2V:
 
             arg_c = {'context': context, 'seq_len': seq_len}
             arg_null = {'context': context_null, 'seq_len': seq_len}
+            if batch_cfg:
+                arg_cfg = cfg_batch_args(arg_c, arg_null)
+
+            experts, high_noise = self._schedule_experts(
+                timesteps, boundary, offload_model)
+            # closed below, or on the way out if sampling fails
+            stack.enter_context(experts)
+            guidance = GuidancePolicy.from_config(self.config).plan(timesteps)
 
-            for _, t in enumerate(tqdm(timesteps)):
+            for i, t in enumerate(tqdm(timesteps)):
                 latent_model_input = latents
                 timestep = [t]
 
                 timestep = torch.stack(timestep)
 
-                model = self._prepare_model_for_timestep(
-                    t, boundary, offload_model)
-                sample_guide_scale = guide_scale[1] if t.item(
-                ) >= boundary else guide_scale[0]
-
-                noise_pred_cond = model(
-                    latent_model_input, t=timestep, **arg_c)[0]
-                noise_pred_uncond = model(
-                    latent_model_input, t=timestep, **arg_null)[0]
-
-                noise_pred = noise_pred_uncond + sample_guide_scale * (
-                    noise_pred_cond - noise_pred_uncond)
+                model = experts(i)
+                sample_guide_scale = guide_scale[
+                    1] if high_noise[i] else guide_scale[0]
+
+                use_uncond = guidance.use_uncond(i)
+                if use_uncond and batch_cfg:
+                    noise_pred_cond, noise_pred_uncond = model(
+                        latent_model_input * 2,
+                        t=torch.cat([timestep, timestep]),
+                        **arg_cfg)
+                else:
+                    noise_pred_cond = model(
+                        latent_model_input, t=timestep, **arg_c)[0]
+                    noise_pred_uncond = None
+                    if use_uncond:
+                        noise_pred_uncond = model(
+                            latent_model_input, t=timestep, **arg_null)[0]
+
+                noise_pred = guidance(i, noise_pred_cond, noise_pred_uncond,
+                                      sample_guide_scale)
 
                 temp_x0 = sample_scheduler.step(
                     noise_pred.unsqueeze(0),
@@ -360,12 +456,20 @@ class WanT2V:
                 latents = [temp_x0.squeeze(0)]
 
             x0 = latents
+            experts.close()
+            guidance.report()
+            clear_context_cache(self.low_noise_model)
+            clear_context_cache(self.high_noise_model)
             if offload_model:
-                self.low_noise_model.cpu()
-                self.high_noise_model.cpu()
+                if self.offload_blocks:
+                    for streamer in self.block_streamers:
+                        streamer.release()
+                else:
+                    self.low_noise_model.cpu()
+                    self.high_noise_model.cpu()
                 torch.cuda.empty_cache()
             if self.rank == 0:
-                videos = self.vae.decode(x0)
+                videos = self.vae.decode(x0, writer=video_writer)
 
         del noise, latents
         del sample_scheduler
@@ -19,15 +19,22 @@ from tqdm import tqdm
 from .distributed.fsdp import shard_model
 from .distributed.sequence_parallel import sp_attn_forward, sp_dit_forward
 from .distributed.util import get_world_size
-from .modules.model import WanModel
+from .modules.attention import set_attention_backend
+from .modules.model import (
+    WanModel,
+    clear_context_cache,
+    context_cache_scope,
+    time_bounds,
+)
+from .modules.quant import load_pretrained
+from .modules.step_cache import StepCache
 from .modules.t5 import T5EncoderModel
 from .modules.vae2_2 import Wan2_2_VAE
-from .utils.fm_solvers import (
-    FlowDPMSolverMultistepScheduler,
-    get_sampling_sigmas,
-    retrieve_timesteps,
-)
-from .utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
+from .utils.fm_solvers import get_sampling_sigmas, retrieve_timesteps
+from .utils.fm_solvers_device import scheduler_class
+from .utils.guidance import GuidancePolicy, cfg_batch_args
+from .utils.prompt_cache import PromptEmbeddingCache
+from .utils.regional_compile import compile_blocks, seq_len_buckets
 from .utils.utils import best_output_size, masks_like
 
 
@@ -73,6 +80,8 @@ class WanTI2V:
                 Only works without FSDP.
         """
         self.device = torch.device(f"cuda:{device_id}")
+        set_attention_backend(
+            config.attn_backend, self.device, benchmark=config.attn_benchmark)
         self.config = config
         self.rank = rank
         self.t5_cpu = t5_cpu
@@ -91,16 +100,27 @@ class WanTI2V:
             device=torch.device('cpu'),
             checkpoint_path=os.path.join(checkpoint_dir, config.t5_checkpoint),
             tokenizer_path=os.path.join(checkpoint_dir, config.t5_tokenizer),
-            shard_fn=shard_fn if t5_fsdp else None)
+            shard_fn=shard_fn if t5_fsdp else None,
+            cache=PromptEmbeddingCache(
+                max_entries=config.t5_cache_size,
+                cache_dir=config.t5_cache_dir),
+            pad_bucket=config.t5_pad_bucket,
+            quantize=config.t5_quant if t5_cpu else None)
 
         self.vae_stride = config.vae_stride
         self.patch_size = config.patch_size
         self.vae = Wan2_2_VAE(
             vae_pth=os.path.join(checkpoint_dir, config.vae_checkpoint),
             device=self.device)
+        if config.vae_tile_size is not None:
+            self.vae.enable_tiling(config.vae_tile_size, config.vae_tile_overlap)
 
         logging.info(f"Creating WanModel from {checkpoint_dir}")
-        self.model = WanModel.from_pretrained(checkpoint_dir)
+        self.model = load_pretrained(
+            WanModel,
+            checkpoint_dir,
+            bits=config.dit_quant_bits,
+            group_size=config.dit_quant_group_size)
         self.model = self._configure_model(
             model=self.model,
             use_sp=use_sp,
@@ -114,6 +134,9 @@ class WanTI2V:
             self.sp_size = 1
 
         self.sample_neg_prompt = config.sample_neg_prompt
+        self.text_encoder.precompute(
+            [self.sample_neg_prompt],
+            torch.device('cpu') if t5_cpu else self.device)
 
     def _configure_model(self, model, use_sp, dit_fsdp, shard_fn,
                          convert_model_dtype):
@@ -146,6 +169,13 @@ class WanTI2V:
                     sp_attn_forward, block.self_attn)
             model.forward = types.MethodType(sp_dit_forward, model)
 
+        if self.config.step_cache:
+            model.step_cache = StepCache(
+                mode=self.config.step_cache,
+                threshold=self.config.step_cache_threshold,
+                max_skips=self.config.step_cache_max_skips,
+                warmup_steps=self.config.step_cache_warmup_steps)
+
         if dist.is_initialized():
             dist.barrier()
 
@@ -157,6 +187,15 @@ class WanTI2V:
             if not self.init_on_cpu:
                 model.to(self.device)
 
+        if self.config.compile_blocks and not dit_fsdp:
+            compile_blocks(
+                model,
+                buckets=seq_len_buckets(self.config.compile_sizes,
+                                        self.config.vae_stride,
+                                        self.config.patch_size),
+                backend=self.config.compile_backend,
+                mode=self.config.compile_mode)
+
         return model
 
     def generate(self,
@@ -171,7 +210,9 @@ class WanTI2V:
                  guide_scale=5.0,
                  n_prompt="",
                  seed=-1,
-                 offload_model=True):
+                 offload_model=True,
+                 batch_cfg=False,
+                 video_writer=None):
         r"""
         Generates video frames from text prompt using diffusion process.
 
@@ -200,6 +241,12 @@ class WanTI2V:
                 Random seed for noise generation. If -1, use random seed.
             offload_model (`bool`, *optional*, defaults to True):
                 If True, offloads models to CPU during generation to save VRAM
+            batch_cfg (`bool`, *optional*, defaults to False):
+                If True, runs the conditional and unconditional passes as a single
+                batch-of-2 forward per step. Faster, but needs more activation memory
+            video_writer (`VideoWriter`, *optional*, defaults to None):
+                If given, decoded frame chunks are streamed to it while the VAE
+                decode is still running
 
         Returns:
             torch.Tensor:
@@ -222,7 +269,9 @@ class WanTI2V:
                 guide_scale=guide_scale,
                 n_prompt=n_prompt,
                 seed=seed,
-                offload_model=offload_model)
+                offload_model=offload_model,
+                batch_cfg=batch_cfg,
+                video_writer=video_writer)
         # t2v
         return self.t2v(
             input_prompt=input_prompt,
@@ -234,7 +283,9 @@ class WanTI2V:
             guide_scale=guide_scale,
             n_prompt=n_prompt,
             seed=seed,
-            offload_model=offload_model)
+            offload_model=offload_model,
+            batch_cfg=batch_cfg,
+            video_writer=video_writer)
 
     def t2v(self,
             input_prompt,
@@ -246,7 +297,9 @@ class WanTI2V:
             guide_scale=5.0,
             n_prompt="",
             seed=-1,
-            offload_model=True):
+            offload_model=True,
+            batch_cfg=False,
+            video_writer=None):
         r"""
         Generates video frames from text prompt using diffusion process.
 
@@ -271,6 +324,12 @@ class WanTI2V:
                 Random seed for noise generation. If -1, use random seed.
             offload_model (`bool`, *optional*, defaults to True):
                 If True, offloads models to CPU during generation to save VRAM
+            batch_cfg (`bool`, *optional*, defaults to False):
+                If True, runs the conditional and unconditional passes as a single
+                batch-of-2 forward per step. Faster, but needs more activation memory
+            video_writer (`VideoWriter`, *optional*, defaults to None):
+                If given, decoded frame chunks are streamed to it while the VAE
+                decode is still running
 
         Returns:
             torch.Tensor:
@@ -297,16 +356,16 @@ class WanTI2V:
         seed_g.manual_seed(seed)
 
         if not self.t5_cpu:
-            self.text_encoder.model.to(self.device)
-            context = self.text_encoder([input_prompt], self.device)
-            context_null = self.text_encoder([n_prompt], self.device)
+            if not self.text_encoder.is_cached([input_prompt, n_prompt]):
+                self.text_encoder.model.to(self.device)
+            context = self.text_encoder([input_prompt, n_prompt], self.device)
             if offload_model:
                 self.text_encoder.model.cpu()
         else:
-            context = self.text_encoder([input_prompt], torch.device('cpu'))
-            context_null = self.text_encoder([n_prompt], torch.device('cpu'))
+            context = self.text_encoder([input_prompt, n_prompt],
+                                        torch.device('cpu'))
             context = [t.to(self.device) for t in context]
-            context_null = [t.to(self.device) for t in context_null]
+        context, context_null = context[:1], context[1:]
 
         noise = [
             torch.randn(
@@ -330,21 +389,24 @@ class WanTI2V:
                 torch.amp.autocast('cuda', dtype=self.param_dtype),
                 torch.no_grad(),
                 no_sync(),
+                context_cache_scope(self.model),
         ):
 
             if sample_solver == 'unipc':
-                sample_scheduler = FlowUniPCMultistepScheduler(
-                    num_train_timesteps=self.num_train_timesteps,
-                    shift=1,
-                    use_dynamic_shifting=False)
+                sample_scheduler = scheduler_class(
+                    'unipc', self.config.device_scheduler)(
+                        num_train_timesteps=self.num_train_timesteps,
+                        shift=1,
+                        use_dynamic_shifting=False)
                 sample_scheduler.set_timesteps(
                     sampling_steps, device=self.device, shift=shift)
                 timesteps = sample_scheduler.timesteps
             elif sample_solver == 'dpm++':
-                sample_scheduler = FlowDPMSolverMultistepScheduler(
-                    num_train_timesteps=self.num_train_timesteps,
-                    shift=1,
-                    use_dynamic_shifting=False)
+                sample_scheduler = scheduler_class(
+                    'dpm++', self.config.device_scheduler)(
+                        num_train_timesteps=self.num_train_timesteps,
+                        shift=1,
+                        use_dynamic_shifting=False)
                 sampling_sigmas = get_sampling_sigmas(sampling_steps, shift)
                 timesteps, _ = retrieve_timesteps(
                     sample_scheduler,
@@ -356,15 +418,28 @@ class WanTI2V:
             # sample videos
             latents = noise
             mask1, mask2 = masks_like(noise, zero=False)
+            # the per-token timestep only changes where the mask does
+            t_bounds = time_bounds(mask2[0][0][:, ::2, ::2], seq_len)
 
-            arg_c = {'context': context, 'seq_len': seq_len}
-            arg_null = {'context': context_null, 'seq_len': seq_len}
+            arg_c = {
+                'context': context,
+                'seq_len': seq_len,
+                't_bounds': t_bounds
+            }
+            arg_null = {
+                'context': context_null,
+                'seq_len': seq_len,
+                't_bounds': t_bounds
+            }
+            if batch_cfg:
+                arg_cfg = cfg_batch_args(arg_c, arg_null)
 
             if offload_model or self.init_on_cpu:
                 self.model.to(self.device)
                 torch.cuda.empty_cache()
 
-            for _, t in enumerate(tqdm(timesteps)):
+            guidance = GuidancePolicy.from_config(self.config).plan(timesteps)
+            for i, t in enumerate(tqdm(timesteps)):
                 latent_model_input = latents
                 timestep = [t]
 
@@ -377,13 +452,22 @@ class WanTI2V:
                 ])
                 timestep = temp_ts.unsqueeze(0)
 
-                noise_pred_cond = self.model(
-                    latent_model_input, t=timestep, **arg_c)[0]
-                noise_pred_uncond = self.model(
-                    latent_model_input, t=timestep, **arg_null)[0]
-
-                noise_pred = noise_pred_uncond + guide_scale * (
-                    noise_pred_cond - noise_pred_uncond)
+                use_uncond = guidance.use_uncond(i)
+                if use_uncond and batch_cfg:
+                    noise_pred_cond, noise_pred_uncond = self.model(
+                        latent_model_input * 2,
+                        t=torch.cat([timestep, timestep]),
+                        **arg_cfg)
+                else:
+                    noise_pred_cond = self.model(
+                        latent_model_input, t=timestep, **arg_c)[0]
+                    noise_pred_uncond = None
+                    if use_uncond:
+                        noise_pred_uncond = self.model(
+                            latent_model_input, t=timestep, **arg_null)[0]
+
+                noise_pred = guidance(i, noise_pred_cond, noise_pred_uncond,
+                                      guide_scale)
 
                 temp_x0 = sample_scheduler.step(
                     noise_pred.unsqueeze(0),
@@ -393,12 +477,14 @@ class WanTI2V:
                     generator=seed_g)[0]
                 latents = [temp_x0.squeeze(0)]
             x0 = latents
+            clear_context_cache(self.model)
+            guidance.report()
             if offload_model:
                 self.model.cpu()
                 torch.cuda.synchronize()
                 torch.cuda.empty_cache()
             if self.rank == 0:
-                videos = self.vae.decode(x0)
+                videos = self.vae.decode(x0, writer=video_writer)
 
         del noise, latents
         del sample_scheduler
@@ -410,6 +496,276 @@ class WanTI2V:
 
         return videos[0] if self.rank == 0 else None
 
+    def t2v_batch(self,
+                  input_prompts,
+                  size=(1280, 704),
+                  frame_num=121,
+                  shift=5.0,
+                  sample_solver='unipc',
+                  sampling_steps=50,
+                  guide_scale=5.0,
+                  n_prompts=None,
+                  seeds=None,
+                  offload_model=True,
+                  batch_cfg=False,
+                  video_writers=None):
+        r"""
+        Generates several videos from text prompts in one batched sampling loop.
+        All samples share resolution, frame count, shift, solver and step count,
+        while each keeps its own noise generator and scheduler state, so every
+        sample follows the same trajectory as a single `t2v` call with its seed.
+
+        Args:
+            input_prompts (`list[str]`):
+                Text prompts for content generation, one per video
+            size (`tuple[int]`, *optional*, defaults to (1280,704)):
+                Controls video resolution, (width,height).
+            frame_num (`int`, *optional*, defaults to 121):
+                How many frames to sample from a video. The number should be 4n+1
+            shift (`float`, *optional*, defaults to 5.0):
+                Noise schedule shift parameter. Affects temporal dynamics
+            sample_solver (`str`, *optional*, defaults to 'unipc'):
+                Solver used to sample the video.
+            sampling_steps (`int`, *optional*, defaults to 50):
+                Number of diffusion sampling steps. Higher values improve quality but slow generation
+            guide_scale (`float` or `list[float]`, *optional*, defaults 5.0):
+                Classifier-free guidance scale, shared or one per video.
+            n_prompts (`list[str]`, *optional*, defaults to None):
+                Negative prompts, one per video. Empty entries use `config.sample_neg_prompt`
+            seeds (`list[int]`, *optional*, defaults to None):
+                Random seeds, one per video. Negative entries use a random seed.
+            offload_model (`bool`, *optional*, defaults to True):
+                If True, offloads models to CPU during generation to save VRAM
+            batch_cfg (`bool`, *optional*, defaults to False):
+                If True, runs the conditional and unconditional passes as a single
+                batch-of-2N forward per step. Faster, but needs more activation memory
+            video_writers (`list[VideoWriter]`, *optional*, defaults to None):
+                One writer (or None) per video. Decoded frame chunks of each video
+                are streamed to its writer while the VAE decode is still running
+
+        Returns:
+            list[torch.Tensor]:
+                Generated video frames tensors, one per prompt, each (C, N, H, W).
+        """
+        # preprocess
+        num_samples = len(input_prompts)
+        F = frame_num
+        target_shape = (self.vae.model.z_dim, (F - 1) // self.vae_stride[0] + 1,
+                        size[1] // self.vae_stride[1],
+                        size[0] // self.vae_stride[2])
+
+        seq_len = math.ceil((target_shape[2] * target_shape[3]) /
+                            (self.patch_size[1] * self.patch_size[2]) *
+                            target_shape[1] / self.sp_size) * self.sp_size
+
+        if not isinstance(guide_scale, (list, tuple)):
+            guide_scale = [guide_scale] * num_samples
+        n_prompts = n_prompts or [""] * num_samples
+        n_prompts = [u if u != "" else self.sample_neg_prompt for u in n_prompts]
+        seeds = seeds or [-1] * num_samples
+        assert len(guide_scale) == len(n_prompts) == len(seeds) == num_samples
+        seed_gs = []
+        for seed in seeds:
+            seed = seed if seed >= 0 else random.randint(0, sys.maxsize)
+            seed_g = torch.Generator(device=self.device)
+            seed_g.manual_seed(seed)
+            seed_gs.append(seed_g)
+
+        if not self.t5_cpu:
+            if not self.text_encoder.is_cached(
+                    list(input_prompts) + n_prompts):
+                self.text_encoder.model.to(self.device)
+            context = self.text_encoder(
+                list(input_prompts) + n_prompts, self.device)
+            if offload_model:
+                self.text_encoder.model.cpu()
+        else:
+            context = self.text_encoder(
+                list(input_prompts) + n_prompts, torch.device('cpu'))
+            context = [t.to(self.device) for t in context]
+        context, context_null = context[:num_samples], context[num_samples:]
+
+        noise = [
+            torch.randn(
+                target_shape[0],
+                target_shape[1],
+                target_shape[2],
+                target_shape[3],
+                dtype=torch.float32,
+                device=self.device,
+                generator=seed_g) for seed_g in seed_gs
+        ]
+
+        @contextmanager
+        def noop_no_sync():
+            yield
+
+        no_sync = getattr(self.model, 'no_sync', noop_no_sync)
+
+        # evaluation mode
+        with (
+                torch.amp.autocast('cuda', dtype=self.param_dtype),
+                torch.no_grad(),
+                no_sync(),
+                context_cache_scope(self.model),
+        ):
+
+            # one scheduler per sample, the multistep solvers keep history
+            sample_schedulers = []
+            for _ in range(num_samples):
+                if sample_solver == 'unipc':
+                    sample_scheduler = scheduler_class(
+                        'unipc', self.config.device_scheduler)(
+                            num_train_timesteps=self.num_train_timesteps,
+                            shift=1,
+                            use_dynamic_shifting=False)
+                    sample_scheduler.set_timesteps(
+                        sampling_steps, device=self.device, shift=shift)
+                    timesteps = sample_scheduler.timesteps
+                elif sample_solver == 'dpm++':
+                    sample_scheduler = scheduler_class(
+                        'dpm++', self.config.device_scheduler)(
+                            num_train_timesteps=self.num_train_timesteps,
+                            shift=1,
+                            use_dynamic_shifting=False)
+                    sampling_sigmas = get_sampling_sigmas(sampling_steps, shift)
+                    timesteps, _ = retrieve_timesteps(
+                        sample_scheduler,
+                        device=self.device,
+                        sigmas=sampling_sigmas)
+                else:
+                    raise NotImplementedError("Unsupported solver.")
+                sample_schedulers.append(sample_scheduler)
+
+            # sample videos
+            latents = noise
+            mask1, mask2 = masks_like(noise[:1], zero=False)
+            # the per-token timestep only changes where the mask does
+            t_bounds = time_bounds(mask2[0][0][:, ::2, ::2], seq_len)
+
+            if offload_model or self.init_on_cpu:
+                self.model.to(self.device)
+                torch.cuda.empty_cache()
+
+            # one policy per sample: with adaptive guidance each sample stops
+            # its unconditional pass on its own convergence, like a `t2v` call
+            guidances = [
+                GuidancePolicy.from_config(self.config).plan(timesteps)
+                for _ in range(num_samples)
+            ]
+            for step, t in enumerate(tqdm(timesteps)):
+                latent_model_input = latents
+                timestep = [t]
+
+                timestep = torch.stack(timestep)
+
+                temp_ts = (mask2[0][0][:, ::2, ::2] * timestep).flatten()
+                temp_ts = torch.cat([
+                    temp_ts,
+                    temp_ts.new_ones(seq_len - temp_ts.size(0)) * timestep
+                ])
+                timestep = temp_ts.unsqueeze(0).expand(num_samples, -1)
+
+                uncond = [
+                    i for i, guidance in enumerate(guidances)
+                    if guidance.use_uncond(step)
+                ]
+                x_null = [latent_model_input[i] for i in uncond]
+                uncond_context = [context_null[i] for i in uncond]
+                if uncond and batch_cfg:
+                    noise_pred = self.model(
+                        latent_model_input + x_null,
+                        t=torch.cat([timestep, timestep[uncond]]),
+                        context=context + uncond_context,
+                        seq_len=seq_len,
+                        t_bounds=t_bounds)
+                    noise_pred_cond = noise_pred[:num_samples]
+                    noise_pred_uncond = noise_pred[num_samples:]
+                else:
+                    noise_pred_cond = self.model(
+                        latent_model_input,
+                        t=timestep,
+                        context=context,
+                        seq_len=seq_len,
+                        t_bounds=t_bounds)
+                    noise_pred_uncond = []
+                    if uncond:
+                        noise_pred_uncond = self.model(
+                            x_null,
+                            t=timestep[uncond],
+                            context=uncond_context,
+                            seq_len=seq_len,
+                            t_bounds=t_bounds)
+                noise_pred_uncond = dict(zip(uncond, noise_pred_uncond))
+
+                latents = []
+                for i, sample_scheduler in enumerate(sample_schedulers):
+                    noise_pred = guidances[i](step, noise_pred_cond[i],
+                                              noise_pred_uncond.get(i),
+                                              guide_scale[i])
+                    temp_x0 = sample_scheduler.step(
+                        noise_pred.unsqueeze(0),
+                        t,
+                        latent_model_input[i].unsqueeze(0),
+                        return_dict=False,
+                        generator=seed_gs[i])[0]
+                    latents.append(temp_x0.squeeze(0))
+            x0 = latents
+            clear_context_cache(self.model)
+            for guidance in guidances:
+                guidance.report()
+            if offload_model:
+                self.model.cpu()
+                torch.cuda.synchronize()
+                torch.cuda.empty_cache()
+            if self.rank == 0:
+                video_writers = video_writers or [None] * num_samples
+                videos = [
+                    self.vae.decode([u], writer=writer)[0]
+                    for u, writer in zip(x0, video_writers)
+                ]
+
+        del noise, latents
+        del sample_schedulers
+        if offload_model:
+            gc.collect()
+            torch.cuda.synchronize()
+        if dist.is_initialized():
+            dist.barrier()
+
+        return videos if self.rank == 0 else None
+
+    def output_size(self, img, max_area):
+        r"""
+        (width, height) of the video generated from `img` within `max_area`.
+        """
+        dh, dw = self.patch_size[1] * self.vae_stride[1], self.patch_size[
+            2] * self.vae_stride[2]
+        return best_output_size(img.width, img.height, dw, dh, max_area)
+
+    def preprocess_image(self, img, max_area):
+        r"""
+        Resizes and center-crops `img` to `output_size(img, max_area)`.
+
+        Returns:
+            torch.Tensor: The image in [-1, 1] on the device, shape [3, 1, H, W].
+        """
+        ih, iw = img.height, img.width
+        ow, oh = self.output_size(img, max_area)
+
+        scale = max(ow / iw, oh / ih)
+        img = img.resize((round(iw * scale), round(ih * scale)), Image.LANCZOS)
+
+        # center-crop
+        x1 = (img.width - ow) // 2
+        y1 = (img.height - oh) // 2
+        img = img.crop((x1, y1, x1 + ow, y1 + oh))
+        assert img.width == ow and img.height == oh
+
+        # to tensor
+        return TF.to_tensor(img).sub_(0.5).div_(0.5).to(
+            self.device).unsqueeze(1)
+
     def i2v(self,
             input_prompt,
             img,
@@ -421,7 +777,9 @@ class WanTI2V:
             guide_scale=5.0,
             n_prompt="",
             seed=-1,
-            offload_model=True):
+            offload_model=True,
+            batch_cfg=False,
+            video_writer=None):
         r"""
         Generates video frames from input image and text prompt using diffusion process.
 
@@ -449,6 +807,12 @@ class WanTI2V:
                 Random seed for noise generation. If -1, use random seed
             offload_model (`bool`, *optional*, defaults to True):
                 If True, offloads models to CPU during generation to save VRAM
+            batch_cfg (`bool`, *optional*, defaults to False):
+                If True, runs the conditional and unconditional passes as a single
+                batch-of-2 forward per step. Faster, but needs more activation memory
+            video_writer (`VideoWriter`, *optional*, defaults to None):
+                If given, decoded frame chunks are streamed to it while the VAE
+                decode is still running
 
         Returns:
             torch.Tensor:
@@ -459,22 +823,8 @@ class WanTI2V:
                 - W: Frame width (from max_area)
         """
         # preprocess
-        ih, iw = img.height, img.width
-        dh, dw = self.patch_size[1] * self.vae_stride[1], self.patch_size[
-            2] * self.vae_stride[2]
-        ow, oh = best_output_size(iw, ih, dw, dh, max_area)
-
-        scale = max(ow / iw, oh / ih)
-        img = img.resize((round(iw * scale), round(ih * scale)), Image.LANCZOS)
-
-        # center-crop
-        x1 = (img.width - ow) // 2
-        y1 = (img.height - oh) // 2
-        img = img.crop((x1, y1, x1 + ow, y1 + oh))
-        assert img.width == ow and img.height == oh
-
-        # to tensor
-        img = TF.to_tensor(img).sub_(0.5).div_(0.5).to(self.device).unsqueeze(1)
+        img = self.preprocess_image(img, max_area)
+        oh, ow = img.shape[-2:]
 
         F = frame_num
         seq_len = ((F - 1) // self.vae_stride[0] + 1) * (
@@ -498,16 +848,16 @@ class WanTI2V:
 
         # preprocess
         if not self.t5_cpu:
-            self.text_encoder.model.to(self.device)
-            context = self.text_encoder([input_prompt], self.device)
-            context_null = self.text_encoder([n_prompt], self.device)
+            if not self.text_encoder.is_cached([input_prompt, n_prompt]):
+                self.text_encoder.model.to(self.device)
+            context = self.text_encoder([input_prompt, n_prompt], self.device)
             if offload_model:
                 self.text_encoder.model.cpu()
         else:
-            context = self.text_encoder([input_prompt], torch.device('cpu'))
-            context_null = self.text_encoder([n_prompt], torch.device('cpu'))
+            context = self.text_encoder([input_prompt, n_prompt],
+                                        torch.device('cpu'))
             context = [t.to(self.device) for t in context]
-            context_null = [t.to(self.device) for t in context_null]
+        context, context_null = context[:1], context[1:]
 
         z = self.vae.encode([img])
 
@@ -522,21 +872,24 @@ class WanTI2V:
                 torch.amp.autocast('cuda', dtype=self.param_dtype),
                 torch.no_grad(),
                 no_sync(),
+                context_cache_scope(self.model),
         ):
 
             if sample_solver == 'unipc':
-                sample_scheduler = FlowUniPCMultistepScheduler(
-                    num_train_timesteps=self.num_train_timesteps,
-                    shift=1,
-                    use_dynamic_shifting=False)
+                sample_scheduler = scheduler_class(
+                    'unipc', self.config.device_scheduler)(
+                        num_train_timesteps=self.num_train_timesteps,
+                        shift=1,
+                        use_dynamic_shifting=False)
                 sample_scheduler.set_timesteps(
                     sampling_steps, device=self.device, shift=shift)
                 timesteps = sample_scheduler.timesteps
             elif sample_solver == 'dpm++':
-                sample_scheduler = FlowDPMSolverMultistepScheduler(
-                    num_train_timesteps=self.num_train_timesteps,
-                    shift=1,
-                    use_dynamic_shifting=False)
+                sample_scheduler = scheduler_class(
+                    'dpm++', self.config.device_scheduler)(
+                        num_train_timesteps=self.num_train_timesteps,
+                        shift=1,
+                        use_dynamic_shifting=False)
                 sampling_sigmas = get_sampling_sigmas(sampling_steps, shift)
                 timesteps, _ = retrieve_timesteps(
                     sample_scheduler,
@@ -550,21 +903,29 @@ class WanTI2V:
             mask1, mask2 = masks_like([noise], zero=True)
             latent = (1. - mask2[0]) * z[0] + mask2[0] * latent
 
+            # the per-token timestep only changes where the mask does
+            t_bounds = time_bounds(mask2[0][0][:, ::2, ::2], seq_len)
+
             arg_c = {
                 'context': [context[0]],
                 'seq_len': seq_len,
+                't_bounds': t_bounds,
             }
 
             arg_null = {
                 'context': context_null,
                 'seq_len': seq_len,
+                't_bounds': t_bounds,
             }
+            if batch_cfg:
+                arg_cfg = cfg_batch_args(arg_c, arg_null)
 
             if offload_model or self.init_on_cpu:
                 self.model.to(self.device)
                 torch.cuda.empty_cache()
 
-            for _, t in enumerate(tqdm(timesteps)):
+            guidance = GuidancePolicy.from_config(self.config).plan(timesteps)
+            for i, t in enumerate(tqdm(timesteps)):
                 latent_model_input = [latent.to(self.device)]
                 timestep = [t]
 
@@ -577,16 +938,25 @@ class WanTI2V:
                 ])
                 timestep = temp_ts.unsqueeze(0)
 
-                noise_pred_cond = self.model(
-                    latent_model_input, t=timestep, **arg_c)[0]
-                if offload_model:
-                    torch.cuda.empty_cache()
-                noise_pred_uncond = self.model(
-                    latent_model_input, t=timestep, **arg_null)[0]
+                use_uncond = guidance.use_uncond(i)
+                if use_uncond and batch_cfg:
+                    noise_pred_cond, noise_pred_uncond = self.model(
+                        latent_model_input * 2,
+                        t=torch.cat([timestep, timestep]),
+                        **arg_cfg)
+                else:
+                    noise_pred_cond = self.model(
+                        latent_model_input, t=timestep, **arg_c)[0]
+                    noise_pred_uncond = None
+                    if use_uncond:
+                        if offload_model:
+                            torch.cuda.empty_cache()
+                        noise_pred_uncond = self.model(
+                            latent_model_input, t=timestep, **arg_null)[0]
                 if offload_model:
                     torch.cuda.empty_cache()
-                noise_pred = noise_pred_uncond + guide_scale * (
-                    noise_pred_cond - noise_pred_uncond)
+                noise_pred = guidance(i, noise_pred_cond, noise_pred_uncond,
+                                      guide_scale)
 
                 temp_x0 = sample_scheduler.step(
                     noise_pred.unsqueeze(0),
@@ -600,13 +970,15 @@ class WanTI2V:
                 x0 = [latent]
                 del latent_model_input, timestep
 
+            clear_context_cache(self.model)
+            guidance.report()
             if offload_model:
                 self.model.cpu()
                 torch.cuda.synchronize()
                 torch.cuda.empty_cache()
 
             if self.rank == 0:
-                videos = self.vae.decode(x0)
+                videos = self.vae.decode(x0, writer=video_writer)
 
         del noise, latent, x0
         del sample_scheduler
@@ -4,9 +4,16 @@ from .fm_solvers import (
     get_sampling_sigmas,
     retrieve_timesteps,
 )
+from .fm_solvers_device import (
+    FlowDPMSolverDeviceScheduler,
+    FlowUniPCDeviceScheduler,
+    scheduler_class,
+)
 from .fm_solvers_unipc import FlowUniPCMultistepScheduler
 
 __all__ = [
     'HuggingfaceTokenizer', 'get_sampling_sigmas', 'retrieve_timesteps',
-    'FlowDPMSolverMultistepScheduler', 'FlowUniPCMultistepScheduler'
+    'FlowDPMSolverMultistepScheduler', 'FlowUniPCMultistepScheduler',
+    'FlowDPMSolverDeviceScheduler', 'FlowUniPCDeviceScheduler',
+    'scheduler_class'
 ]
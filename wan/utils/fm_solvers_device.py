@@ -0,0 +1,449 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+from typing import List, Optional, Union
+
+import torch
+from diffusers.schedulers.scheduling_utils import SchedulerOutput
+from diffusers.utils.torch_utils import randn_tensor
+
+from .fm_solvers import FlowDPMSolverMultistepScheduler
+from .fm_solvers_unipc import FlowUniPCMultistepScheduler
+
+__all__ = [
+    'FlowUniPCDeviceScheduler', 'FlowDPMSolverDeviceScheduler',
+    'scheduler_class'
+]
+
+
+def scheduler_class(sample_solver, device_resident=False):
+    r"""
+    Scheduler class of `sample_solver` ('unipc' or 'dpm++'), the device
+    resident variant if `device_resident` is set.
+    """
+    classes = {
+        'unipc': (FlowUniPCMultistepScheduler, FlowUniPCDeviceScheduler),
+        'dpm++': (FlowDPMSolverMultistepScheduler, FlowDPMSolverDeviceScheduler)
+    }
+    if sample_solver not in classes:
+        raise NotImplementedError("Unsupported solver.")
+    return classes[sample_solver][int(bool(device_resident))]
+
+
+def _log_snr(scheduler, sigma):
+    alpha, sigma = scheduler._sigma_to_alpha_sigma_t(sigma)
+    return alpha, sigma, torch.log(alpha) - torch.log(sigma)
+
+
+class FlowUniPCDeviceScheduler(FlowUniPCMultistepScheduler):
+    r"""
+    `FlowUniPCMultistepScheduler` whose step does not touch the host. The
+    solver order of every step, the B(h) coefficients, the `rk` ratios and the
+    predictor / corrector `rhos` of the whole schedule are computed once in
+    `set_timesteps`, with the same float32 ops as the reference scheduler, and
+    kept as tensors on the sampling device. `step` indexes them with an
+    integer counter, so the result is bitwise identical to the reference on
+    the same device.
+
+    The step index starts at `begin_index` (0 by default) instead of being
+    looked up from the first timestep passed to `step`, the timestep argument
+    is ignored. `solver_p` is not supported.
+    """
+
+    def set_timesteps(
+        self,
+        num_inference_steps: Union[int, None] = None,
+        device: Union[str, torch.device] = None,
+        sigmas: Optional[List[float]] = None,
+        mu: Optional[Union[float, None]] = None,
+        shift: Optional[Union[float, None]] = None,
+    ):
+        if self.solver_p is not None:
+            raise ValueError(
+                f"`solver_p` is not supported by {self.__class__.__name__}")
+        if self.config.prediction_type != "flow_prediction":
+            raise ValueError(
+                f"prediction_type given as {self.config.prediction_type} must be `flow_prediction` for "
+                f"{self.__class__.__name__}.")
+        super().set_timesteps(
+            num_inference_steps,
+            device=device,
+            sigmas=sigmas,
+            mu=mu,
+            shift=shift)
+        self._device = self.timesteps.device
+        self._plan(0)
+
+    def set_begin_index(self, begin_index: int = 0):
+        super().set_begin_index(begin_index)
+        if self.num_inference_steps is not None:
+            self._plan(begin_index)
+
+    def _plan(self, begin):
+        n, order = self.num_inference_steps, self.config.solver_order
+        self._orders = [0] * n
+        self._use_corrector = [False] * n
+        coef_p, coef_c = torch.zeros(n, 3), torch.zeros(n, 3)
+        rks_p, rks_c = torch.ones(n, order), torch.ones(n, order)
+        rhos_p, rhos_c = torch.zeros(n, order), torch.zeros(n, order)
+
+        lower_order_nums = 0
+        for s in range(begin, n):
+            this_order = min(order, n - s) if self.config.lower_order_final \
+                else order
+            self._orders[s] = min(this_order, lower_order_nums + 1)
+            lower_order_nums = min(lower_order_nums + 1, order)
+
+            k = self._orders[s]
+            coef_p[s], rks_p[s, :k - 1], rhos_p[s, :k - 1] = \
+                self._bh_coefficients(s + 1, s, k, predictor=True)
+            if s > begin and s - 1 not in self.disable_corrector:
+                k = self._orders[s - 1]
+                self._use_corrector[s] = True
+                coef_c[s], rks_c[s, :k - 1], rhos_c[s, :k] = \
+                    self._bh_coefficients(s, s - 1, k, predictor=False)
+
+        device = self._device
+        self._sigmas = self.sigmas.to(device)
+        self._coef_p, self._coef_c = coef_p.to(device), coef_c.to(device)
+        self._rks_p, self._rks_c = rks_p.to(device), rks_c.to(device)
+        self._rhos_p, self._rhos_c = rhos_p.to(device), rhos_c.to(device)
+
+    def _bh_coefficients(self, t, s0, order, predictor):
+        r"""
+        Coefficients of the UniP (`predictor`) or UniC update from sigma index
+        `s0` to `t`, computed as in `multistep_uni_{p,c}_bh_update`.
+        """
+        alpha_t, sigma_t, lambda_t = _log_snr(self, self.sigmas[t])
+        alpha_s0, sigma_s0, lambda_s0 = _log_snr(self, self.sigmas[s0])
+        h = lambda_t - lambda_s0
+
+        rks = []
+        for i in range(1, order):
+            lambda_si = _log_snr(self, self.sigmas[s0 - i])[2]
+            rks.append((lambda_si - lambda_s0) / h)
+        rks_k = torch.tensor(rks + [1.0])
+
+        hh = -h if self.predict_x0 else h
+        h_phi_1 = torch.expm1(hh)
+        h_phi_k = h_phi_1 / hh - 1
+        factorial_i = 1
+        if self.config.solver_type == "bh1":
+            B_h = hh
+        elif self.config.solver_type == "bh2":
+            B_h = torch.expm1(hh)
+        else:
+            raise NotImplementedError()
+
+        R, b = [], []
+        for i in range(1, order + 1):
+            R.append(torch.pow(rks_k, i - 1))
+            b.append(h_phi_k * factorial_i / B_h)
+            factorial_i *= i + 1
+            h_phi_k = h_phi_k / hh - 1 / factorial_i
+        R = torch.stack(R)
+        b = torch.tensor(b)
+
+        if predictor:
+            if order == 1:
+                rhos = torch.zeros(0)
+            elif order == 2:
+                rhos = torch.tensor([0.5])
+            else:
+                rhos = torch.linalg.solve(R[:-1, :-1], b[:-1])
+        else:
+            if order == 1:
+                rhos = torch.tensor([0.5])
+            else:
+                rhos = torch.linalg.solve(R, b)
+
+        if self.predict_x0:
+            coef = [sigma_t / sigma_s0, alpha_t * h_phi_1, alpha_t * B_h]
+        else:
+            coef = [alpha_t / alpha_s0, sigma_t * h_phi_1, sigma_t * B_h]
+        return torch.stack(coef), rks_k[:-1], rhos
+
+    def convert_model_output(self, model_output: torch.Tensor,
+                             sample: torch.Tensor) -> torch.Tensor:
+        sigma_t = self._sigmas[self.step_index]
+        if self.predict_x0:
+            x0_pred = sample - sigma_t * model_output
+            if self.config.thresholding:
+                x0_pred = self._threshold_sample(x0_pred)
+            return x0_pred
+
+        epsilon = sample - (1 - sigma_t) * model_output
+        if self.config.thresholding:
+            x0_pred = self._threshold_sample(sample - sigma_t * model_output)
+            epsilon = model_output + x0_pred
+        return epsilon
+
+    def _differences(self, m0, rks, order):
+        return torch.stack([
+            (self.model_outputs[-(i + 1)] - m0) / rks[i - 1]
+            for i in range(1, order)
+        ],
+                           dim=1)
+
+    def _predict(self, x, s):
+        order = self._orders[s]
+        c_x, c_m, c_r = self._coef_p[s]
+        m0 = self.model_outputs[-1]
+        x_t = c_x * x - c_m * m0
+        if order > 1:
+            D1s = self._differences(m0, self._rks_p[s], order)
+            rhos_p = self._rhos_p[s, :order - 1].to(x.dtype)
+            x_t = x_t - c_r * torch.einsum("k,bkc...->bc...", rhos_p, D1s)
+        return x_t.to(x.dtype)
+
+    def _correct(self, model_t, x, s):
+        order = self._orders[s - 1]
+        c_x, c_m, c_r = self._coef_c[s]
+        m0 = self.model_outputs[-1]
+        rhos_c = self._rhos_c[s, :order].to(x.dtype)
+        x_t_ = c_x * x - c_m * m0
+        D1_t = model_t - m0
+        if order > 1:
+            D1s = self._differences(m0, self._rks_c[s], order)
+            corr_res = torch.einsum("k,bkc...->bc...", rhos_c[:-1], D1s)
+            x_t = x_t_ - c_r * (corr_res + rhos_c[-1] * D1_t)
+        else:
+            x_t = x_t_ - c_r * (rhos_c[-1] * D1_t)
+        return x_t.to(x.dtype)
+
+    def step(self,
+             model_output: torch.Tensor,
+             timestep: Union[int, torch.Tensor],
+             sample: torch.Tensor,
+             return_dict: bool = True,
+             generator=None):
+        if self.num_inference_steps is None:
+            raise ValueError(
+                "Number of inference steps is 'None', you need to run 'set_timesteps' after creating the scheduler"
+            )
+        if self.step_index is None:
+            self._step_index = self.begin_index or 0
+        s = self.step_index
+
+        model_output_convert = self.convert_model_output(
+            model_output, sample=sample)
+        if self._use_corrector[s]:
+            sample = self._correct(model_output_convert, self.last_sample, s)
+
+        self.model_outputs = self.model_outputs[1:] + [model_output_convert]
+        self.this_order = self._orders[s]
+        self.last_sample = sample
+        prev_sample = self._predict(sample, s)
+
+        self.lower_order_nums = min(self.lower_order_nums + 1,
+                                    self.config.solver_order)
+        self._step_index += 1
+
+        if not return_dict:
+            return (prev_sample,)
+        return SchedulerOutput(prev_sample=prev_sample)
+
+
+class FlowDPMSolverDeviceScheduler(FlowDPMSolverMultistepScheduler):
+    r"""
+    `FlowDPMSolverMultistepScheduler` whose step does not touch the host. The
+    solver order of every step and the multistep weights of the sample, of
+    the differences D0, D1, D2 and of the SDE noise are computed once in
+    `set_timesteps`, with the same float32 ops as the reference scheduler, and
+    kept as tensors on the sampling device. `step` indexes them with an
+    integer counter, so the result is bitwise identical to the reference on
+    the same device.
+
+    The step index starts at `begin_index` (0 by default) instead of being
+    looked up from the first timestep passed to `step`, the timestep argument
+    is ignored.
+    """
+
+    def set_timesteps(
+        self,
+        num_inference_steps: Union[int, None] = None,
+        device: Union[str, torch.device] = None,
+        sigmas: Optional[List[float]] = None,
+        mu: Optional[Union[float, None]] = None,
+        shift: Optional[Union[float, None]] = None,
+    ):
+        if self.config.prediction_type != "flow_prediction":
+            raise ValueError(
+                f"prediction_type given as {self.config.prediction_type} must be `flow_prediction` for "
+                f"{self.__class__.__name__}.")
+        super().set_timesteps(
+            num_inference_steps,
+            device=device,
+            sigmas=sigmas,
+            mu=mu,
+            shift=shift)
+        self._device = self.timesteps.device
+        self._plan(0)
+
+    def set_begin_index(self, begin_index: int = 0):
+        super().set_begin_index(begin_index)
+        if self.num_inference_steps is not None:
+            self._plan(begin_index)
+
+    def _plan(self, begin):
+        n, order = self.num_inference_steps, self.config.solver_order
+        self._orders = [0] * n
+        coef, dcoef = torch.zeros(n, 5), torch.zeros(n, 4)
+
+        lower_order_nums = 0
+        for s in range(begin, n):
+            lower_order_final = (s == n - 1) and (
+                self.config.euler_at_final or
+                (self.config.lower_order_final and n < 15) or
+                self.config.final_sigmas_type == "zero")
+            lower_order_second = ((s == n - 2) and
+                                  self.config.lower_order_final and n < 15)
+            if order == 1 or lower_order_nums < 1 or lower_order_final:
+                self._orders[s] = 1
+            elif order == 2 or lower_order_nums < 2 or lower_order_second:
+                self._orders[s] = 2
+            else:
+                self._orders[s] = 3
+            lower_order_nums = min(lower_order_nums + 1, order)
+            coef[s], dcoef[s] = self._multistep_coefficients(
+                s, self._orders[s])
+
+        self._sigmas = self.sigmas.to(self._device)
+        self._coef = coef.to(self._device)
+        self._dcoef = dcoef.to(self._device)
+
+    def _multistep_coefficients(self, s, order):
+        r"""
+        Weights of the sample, D0, D1, D2 and the noise in the update of step
+        `s`, and of the model outputs in D1 and D2, computed as in the
+        `*_order_update` methods.
+        """
+        algorithm_type = self.config.algorithm_type
+        heun = self.config.solver_type == "heun"
+        alpha_t, sigma_t, lambda_t = _log_snr(self, self.sigmas[s + 1])
+        alpha_s0, sigma_s0, lambda_s0 = _log_snr(self, self.sigmas[s])
+        h = lambda_t - lambda_s0
+        zero = torch.zeros(())
+        c_d1 = c_d2 = c_noise = zero
+        dcoef = [zero] * 4
+
+        if order > 1:
+            lambda_s1 = _log_snr(self, self.sigmas[s - 1])[2]
+            r0 = (lambda_s0 - lambda_s1) / h
+            dcoef[0] = 1.0 / r0
+        if order > 2:
+            lambda_s2 = _log_snr(self, self.sigmas[s - 2])[2]
+            r1 = (lambda_s1 - lambda_s2) / h
+            dcoef[1:] = [1.0 / r1, r0 / (r0 + r1), 1.0 / (r0 + r1)]
+            if algorithm_type not in ["dpmsolver++", "dpmsolver"]:
+                raise NotImplementedError(
+                    f"third order is not implemented for {algorithm_type}")
+
+        if algorithm_type == "dpmsolver++":
+            c_sample = sigma_t / sigma_s0
+            c_d0 = alpha_t * (torch.exp(-h) - 1.0)
+            if order == 2:
+                c_d1 = (alpha_t * ((torch.exp(-h) - 1.0) / h + 1.0)) if heun \
+                    else -(0.5 * c_d0)
+            elif order == 3:
+                c_d1 = alpha_t * ((torch.exp(-h) - 1.0) / h + 1.0)
+                c_d2 = -(alpha_t * ((torch.exp(-h) - 1.0 + h) / h**2 - 0.5))
+            c_d0 = -c_d0
+        elif algorithm_type == "dpmsolver":
+            c_sample = alpha_t / alpha_s0
+            c_d0 = sigma_t * (torch.exp(h) - 1.0)
+            if order == 2:
+                c_d1 = -(sigma_t * ((torch.exp(h) - 1.0) / h - 1.0)) if heun \
+                    else -(0.5 * c_d0)
+            elif order == 3:
+                c_d1 = -(sigma_t * ((torch.exp(h) - 1.0) / h - 1.0))
+                c_d2 = -(sigma_t * ((torch.exp(h) - 1.0 - h) / h**2 - 0.5))
+            c_d0 = -c_d0
+        elif algorithm_type == "sde-dpmsolver++":
+            c_sample = sigma_t / sigma_s0 * torch.exp(-h)
+            c_d0 = alpha_t * (1 - torch.exp(-2.0 * h))
+            if order == 2:
+                c_d1 = (alpha_t * ((1.0 - torch.exp(-2.0 * h)) /
+                                   (-2.0 * h) + 1.0)) if heun else 0.5 * c_d0
+            c_noise = sigma_t * torch.sqrt(1.0 - torch.exp(-2 * h))
+        elif algorithm_type == "sde-dpmsolver":
+            c_sample = alpha_t / alpha_s0
+            c_d0 = -(2.0 * (sigma_t * (torch.exp(h) - 1.0)))
+            if order == 2:
+                c_d1 = -(2.0 * (sigma_t * ((torch.exp(h) - 1.0) / h - 1.0))) \
+                    if heun else -(sigma_t * (torch.exp(h) - 1.0))
+            c_noise = sigma_t * torch.sqrt(torch.exp(2 * h) - 1.0)
+        return (torch.stack([c_sample, c_d0, c_d1, c_d2, c_noise]),
+                torch.stack(dcoef))
+
+    def convert_model_output(self, model_output: torch.Tensor,
+                             sample: torch.Tensor) -> torch.Tensor:
+        sigma_t = self._sigmas[self.step_index]
+        if self.config.algorithm_type in ["dpmsolver++", "sde-dpmsolver++"]:
+            x0_pred = sample - sigma_t * model_output
+            if self.config.thresholding:
+                x0_pred = self._threshold_sample(x0_pred)
+            return x0_pred
+
+        epsilon = sample - (1 - sigma_t) * model_output
+        if self.config.thresholding:
+            x0_pred = self._threshold_sample(sample - sigma_t * model_output)
+            epsilon = model_output + x0_pred
+        return epsilon
+
+    def step(
+        self,
+        model_output: torch.Tensor,
+        timestep: Union[int, torch.Tensor],
+        sample: torch.Tensor,
+        generator=None,
+        variance_noise: Optional[torch.Tensor] = None,
+        return_dict: bool = True,
+    ):
+        if self.num_inference_steps is None:
+            raise ValueError(
+                "Number of inference steps is 'None', you need to run 'set_timesteps' after creating the scheduler"
+            )
+        if self.step_index is None:
+            self._step_index = self.begin_index or 0
+        s = self.step_index
+        order = self._orders[s]
+
+        model_output = self.convert_model_output(model_output, sample=sample)
+        self.model_outputs = self.model_outputs[1:] + [model_output]
+
+        # Upcast to avoid precision issues when computing prev_sample
+        sample = sample.to(torch.float32)
+        c_sample, c_d0, c_d1, c_d2, c_noise = self._coef[s]
+        m0 = self.model_outputs[-1]
+        prev_sample = c_sample * sample + c_d0 * m0
+        if order == 2:
+            m1 = self.model_outputs[-2]
+            prev_sample = prev_sample + c_d1 * (self._dcoef[s, 0] * (m0 - m1))
+        elif order == 3:
+            m1, m2 = self.model_outputs[-2], self.model_outputs[-3]
+            inv_r0, inv_r1, w_d1, inv_r01 = self._dcoef[s]
+            D1_0, D1_1 = inv_r0 * (m0 - m1), inv_r1 * (m1 - m2)
+            D1 = D1_0 + w_d1 * (D1_0 - D1_1)
+            D2 = inv_r01 * (D1_0 - D1_1)
+            prev_sample = prev_sample + c_d1 * D1 + c_d2 * D2
+
+        if self.config.algorithm_type in ["sde-dpmsolver", "sde-dpmsolver++"]:
+            if variance_noise is None:
+                noise = randn_tensor(
+                    model_output.shape,
+                    generator=generator,
+                    device=model_output.device,
+                    dtype=torch.float32)
+            else:
+                noise = variance_noise.to(
+                    device=model_output.device, dtype=torch.float32)
+            prev_sample = prev_sample + c_noise * noise
+
+        self.lower_order_nums = min(self.lower_order_nums + 1,
+                                    self.config.solver_order)
+        # Cast sample back to expected dtype
+        prev_sample = prev_sample.to(model_output.dtype)
+        self._step_index += 1
+
+        if not return_dict:
+            return (prev_sample,)
+        return SchedulerOutput(prev_sample=prev_sample)
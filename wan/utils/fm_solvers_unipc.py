@@ -465,22 +465,25 @@ class FlowUniPCMultistepScheduler(SchedulerMixin, ConfigMixin):
         else:
             D1s = None
 
+        # A first order step has no residual term. It is skipped rather than
+        # multiplied by zero, since B(h) of `bh1` is infinite when stepping to
+        # the final sigma of 0 and inf * 0 would turn the sample into NaN.
         if self.predict_x0:
             x_t_ = sigma_t / sigma_s0 * x - alpha_t * h_phi_1 * m0
             if D1s is not None:
                 pred_res = torch.einsum("k,bkc...->bc...", rhos_p,
                                         D1s)  # pyright: ignore
+                x_t = x_t_ - alpha_t * B_h * pred_res
             else:
-                pred_res = 0
-            x_t = x_t_ - alpha_t * B_h * pred_res
+                x_t = x_t_
         else:
             x_t_ = alpha_t / alpha_s0 * x - sigma_t * h_phi_1 * m0
             if D1s is not None:
                 pred_res = torch.einsum("k,bkc...->bc...", rhos_p,
                                         D1s)  # pyright: ignore
+                x_t = x_t_ - sigma_t * B_h * pred_res
             else:
-                pred_res = 0
-            x_t = x_t_ - sigma_t * B_h * pred_res
+                x_t = x_t_
 
         x_t = x_t.to(x.dtype)
         return x_t
@@ -0,0 +1,179 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import logging
+
+import torch
+import torch.nn.functional as F
+
+__all__ = ['cfg_batch_args', 'GuidancePolicy']
+
+
+def cfg_batch_args(arg_c, arg_null):
+    r"""
+    Merges the conditional and unconditional model kwargs so that both
+    classifier-free guidance branches run as one batch-of-2 forward, with the
+    conditional sample first.
+
+    Args:
+        arg_c (`dict`):
+            Keyword arguments of the conditional forward.
+        arg_null (`dict`):
+            Keyword arguments of the unconditional forward, same keys as `arg_c`.
+
+    Returns:
+        `dict`: Lists of tensors are concatenated, tensors are concatenated
+        along the batch dimension, any other value (e.g. `seq_len`) must be
+        identical in both branches and is passed through.
+    """
+    assert arg_c.keys() == arg_null.keys()
+    args = {}
+    for k, c in arg_c.items():
+        u = arg_null[k]
+        if isinstance(c, (list, tuple)) and len(c) > 0 and torch.is_tensor(
+                c[0]):
+            args[k] = list(c) + list(u)
+        elif torch.is_tensor(c):
+            args[k] = torch.cat([c, u])
+        else:
+            assert c == u, f"'{k}' differs between cond and uncond branch."
+            args[k] = c
+    return args
+
+
+class GuidancePolicy:
+
+    def __init__(self,
+                 interval=None,
+                 every=1,
+                 adaptive_threshold=None,
+                 num_train_timesteps=1000):
+        r"""
+        Decides at which sampling steps the unconditional pass of
+        classifier-free guidance runs, and how the prediction is formed when it
+        does not:
+
+        - `interval`: guidance is only applied while t / num_train_timesteps
+          lies within [low, high], elsewhere the conditional prediction is
+          used as is.
+        - `every`: within the interval the unconditional pass only runs every
+          k-th step, the steps in between reuse the last guidance delta
+          `cond - uncond`.
+        - `adaptive_threshold`: once the cosine similarity of the conditional
+          and unconditional predictions reaches the threshold, the
+          unconditional pass is dropped for the rest of the run. The
+          similarity is taken over the whole prediction, so batched sampling
+          keeps one policy per sample.
+
+        The default arguments run the unconditional pass at every step.
+
+        Args:
+            interval (`tuple[float, float]`, *optional*, defaults to None):
+                (low, high) range of normalized timesteps with guidance.
+            every (`int`, *optional*, defaults to 1):
+                Run the unconditional pass every `every` steps.
+            adaptive_threshold (`float`, *optional*, defaults to None):
+                Cosine similarity at which guidance stops, e.g. 0.99.
+            num_train_timesteps (`int`, *optional*, defaults to 1000):
+                Normalizes the timesteps for `interval`.
+        """
+        assert every >= 1
+        self.interval = interval
+        self.every = every
+        self.adaptive_threshold = adaptive_threshold
+        self.num_train_timesteps = num_train_timesteps
+
+        # unconditional passes run and skipped, over all runs until `report`
+        self.num_steps = 0
+        self.num_uncond = 0
+        self.skipped = {'interval': 0, 'reuse': 0, 'adaptive': 0}
+        self.plan([])
+
+    @classmethod
+    def from_config(cls, config):
+        r"""
+        Policy of the `cfg_interval`, `cfg_every` and `cfg_adaptive_threshold`
+        settings of a task config.
+        """
+        return cls(
+            interval=config.cfg_interval,
+            every=config.cfg_every,
+            adaptive_threshold=config.cfg_adaptive_threshold,
+            num_train_timesteps=config.num_train_timesteps)
+
+    def plan(self, timesteps):
+        r"""
+        Starts a sampling run over `timesteps`, read once to the host. Returns
+        the policy itself.
+        """
+        self._phase = []
+        k = 0
+        for t in torch.as_tensor(timesteps).flatten().tolist():
+            t = t / self.num_train_timesteps
+            if (self.interval is None or
+                    self.interval[0] <= t <= self.interval[1]):
+                self._phase.append(k)
+                k += 1
+            else:
+                self._phase.append(None)
+        self._delta = None
+        self._converged = False
+        return self
+
+    def use_uncond(self, step):
+        r"""
+        Whether the unconditional pass runs at `step`.
+        """
+        self.num_steps += 1
+        phase = self._phase[step]
+        if phase is None:
+            self.skipped['interval'] += 1
+        elif self._converged:
+            self.skipped['adaptive'] += 1
+        elif phase % self.every != 0 and self._delta is not None:
+            self.skipped['reuse'] += 1
+        else:
+            self.num_uncond += 1
+            return True
+        return False
+
+    def __call__(self, step, cond, uncond, guide_scale):
+        r"""
+        Guided prediction of `step`.
+
+        Args:
+            step (`int`):
+                Index of the sampling step.
+            cond (Tensor):
+                Conditional prediction.
+            uncond (Tensor):
+                Unconditional prediction, None if `use_uncond(step)` was False.
+            guide_scale (`float` or Tensor):
+                Guidance scale, a tensor broadcasts over `cond`.
+        """
+        if uncond is not None:
+            delta = cond - uncond
+            if self.every > 1:
+                self._delta = delta
+            if self.adaptive_threshold is not None:
+                similarity = F.cosine_similarity(
+                    cond.flatten().float(), uncond.flatten().float(), dim=0)
+                if similarity.item() >= self.adaptive_threshold:
+                    self._converged, self._delta = True, None
+            return uncond + guide_scale * delta
+        if self._phase[step] is not None and self._delta is not None:
+            return cond + (guide_scale - 1) * self._delta
+        return cond
+
+    def report(self):
+        r"""
+        Logs how many unconditional passes were skipped and why, and resets
+        the counters.
+        """
+        if self.num_steps > self.num_uncond:
+            logging.info(
+                f'Guidance: ran {self.num_uncond} of {self.num_steps} '
+                f'unconditional passes, skipped '
+                f'{self.skipped["interval"]} outside the interval, '
+                f'{self.skipped["reuse"]} reusing the guidance delta and '
+                f'{self.skipped["adaptive"]} after convergence.')
+        self.num_steps = self.num_uncond = 0
+        self.skipped = dict.fromkeys(self.skipped, 0)
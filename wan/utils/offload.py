@@ -0,0 +1,333 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import torch
+
+__all__ = ['BlockStreamer', 'ExpertPrefetcher']
+
+
+class BlockStreamer:
+
+    def __init__(self,
+                 model,
+                 device,
+                 num_resident=2,
+                 pin_memory=None,
+                 blocks_attr='blocks'):
+        r"""
+        Sequential weight streaming for the transformer blocks of a model. The
+        blocks live in host memory and are copied to `device` right before they
+        run, while the following blocks are prefetched on a side CUDA stream
+        (or a worker thread on other devices). Prefetching stops at the last
+        block, so nothing is left on the device after a forward pass unless
+        the first blocks are requested with `prefetch_head`. Everything outside
+        the blocks is moved to `device` once. The context caches of the blocks
+        (cross attention keys and values, see `ContextCache`) are disabled,
+        since they would stay on `device` after the block is evicted; the
+        keys and values are recomputed at every step instead.
+
+        Args:
+            model (`nn.Module`):
+                Model whose `blocks_attr` ModuleList is streamed.
+            device (`torch.device`):
+                Compute device.
+            num_resident (`int`, *optional*, defaults to 2):
+                Maximum number of blocks on `device` at once, including the one
+                that is running. The next `num_resident - 1` blocks are
+                prefetched; with all blocks resident nothing is evicted.
+            pin_memory (`bool`, *optional*, defaults to None):
+                Pin the host copies for asynchronous copies. Defaults to True
+                on CUDA. Disable it to keep memory-mapped weights zero-copy.
+            blocks_attr (`str`, *optional*, defaults to 'blocks'):
+                Name of the ModuleList to stream.
+        """
+        self.model = model
+        self.device = torch.device(device)
+        self.blocks = list(getattr(model, blocks_attr))
+        self.num_resident = max(1, min(num_resident, len(self.blocks)))
+        if pin_memory is None:
+            pin_memory = self.device.type == 'cuda'
+
+        for name, module in model.named_children():
+            if name != blocks_attr:
+                module.to(self.device)
+
+        # (module, name, is_param) slots of every block and their host copies
+        self._slots, self._host = [], []
+        for block in self.blocks:
+            slots, host = [], []
+            for module in block.modules():
+                for is_param, tensors in ((True, module._parameters),
+                                          (False, module._buffers)):
+                    for name, t in tensors.items():
+                        if t is None:
+                            continue
+                        t = t.data.cpu()
+                        slots.append((module, name, is_param))
+                        host.append(t.pin_memory() if pin_memory else t)
+            self._slots.append(slots)
+            self._host.append(host)
+            self._assign(len(self._host) - 1, host)
+
+        self._stream = torch.cuda.Stream(
+            self.device) if self.device.type == 'cuda' else None
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='block-streamer'
+        ) if self._stream is None else None
+        self._resident = {}
+        self._pending = {}
+
+        # statistics, e.g. to check the memory budget
+        self.num_loads = 0
+        self.max_resident = 0
+
+        # (cache, size) of the disabled context caches, restored on `remove`
+        self._context_caches = []
+        for block in self.blocks:
+            for module in block.modules():
+                cache = getattr(module, '_context_cache', None)
+                if cache is not None:
+                    cache.clear()
+                    self._context_caches.append((cache, cache.size))
+                    cache.size = 0
+
+        self._hooks = []
+        for i, block in enumerate(self.blocks):
+            self._hooks.append(
+                block.register_forward_pre_hook(self._make_pre_hook(i)))
+            self._hooks.append(
+                block.register_forward_hook(self._make_post_hook(i)))
+
+    def _assign(self, i, tensors):
+        for (module, name, is_param), t in zip(self._slots[i], tensors):
+            if is_param:
+                module._parameters[name].data = t
+            else:
+                module._buffers[name] = t
+
+    def _copy(self, i):
+        return [t.to(self.device, non_blocking=True) for t in self._host[i]]
+
+    def _prefetch(self, i):
+        if i in self._resident or i in self._pending:
+            return
+        self.num_loads += 1
+        if self._stream is not None:
+            # memory reuse across streams is covered by `record_stream` in
+            # `_wait`, so the copy does not have to wait for the main stream
+            with torch.cuda.stream(self._stream):
+                tensors = self._copy(i)
+                event = torch.cuda.Event()
+                event.record(self._stream)
+            self._pending[i] = (tensors, event)
+        else:
+            self._pending[i] = self._executor.submit(self._copy, i)
+
+    def _wait(self, i):
+        if i not in self._resident:
+            self._prefetch(i)
+            pending = self._pending.pop(i)
+            if isinstance(pending, Future):
+                tensors = pending.result()
+            else:
+                tensors, event = pending
+                stream = torch.cuda.current_stream(self.device)
+                stream.wait_event(event)
+                for t in tensors:
+                    t.record_stream(stream)
+            self._resident[i] = tensors
+            self._assign(i, tensors)
+
+    def _evict(self, i):
+        if self._resident.pop(i, None) is not None:
+            self._assign(i, self._host[i])
+
+    def _make_pre_hook(self, i):
+
+        def hook(module, args):
+            self._wait(i)
+            for k in range(i + 1, min(i + self.num_resident, len(self.blocks))):
+                self._prefetch(k)
+            self.max_resident = max(self.max_resident,
+                                    len(self._resident) + len(self._pending))
+
+        return hook
+
+    def _make_post_hook(self, i):
+
+        def hook(module, args, output):
+            if self.num_resident < len(self.blocks):
+                self._evict(i)
+
+        return hook
+
+    @property
+    def num_loaded(self):
+        r"""
+        Number of blocks on the device or being copied there.
+        """
+        return len(self._resident) + len(self._pending)
+
+    def prefetch_head(self):
+        r"""
+        Starts copying the first `num_resident` blocks, e.g. while another
+        model runs before this one.
+        """
+        for i in range(self.num_resident):
+            self._prefetch(i)
+
+    def release(self):
+        r"""
+        Moves every block that is on the device back to the host.
+        """
+        for i in list(self._pending):
+            self._wait(i)
+        for i in list(self._resident):
+            self._evict(i)
+
+    def remove(self):
+        r"""
+        Removes the hooks and leaves every block on the host.
+        """
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
+        for cache, size in self._context_caches:
+            cache.size = size
+        self._context_caches = []
+        self.release()
+        if self._executor is not None:
+            self._executor.shutdown()
+
+
+class ExpertPrefetcher:
+
+    def __init__(self,
+                 experts,
+                 schedule,
+                 device,
+                 offload=True,
+                 prefetch=True,
+                 streamers=None):
+        r"""
+        Places MoE experts on the device following a per-step schedule that
+        is known before sampling starts. An expert is released as soon as its
+        last step has run, and with `prefetch` the next expert is moved on a
+        worker thread while the last step of the current one is running.
+
+        Args:
+            experts (`dict[str, nn.Module]`):
+                Experts by name.
+            schedule (`list[str]`):
+                Name of the expert used at every step.
+            device (`torch.device`):
+                Compute device.
+            offload (`bool`, *optional*, defaults to True):
+                Keep only the experts in use on `device`. If False, the experts
+                are left where they are.
+            prefetch (`bool`, *optional*, defaults to True):
+                Overlap the move of the next expert with the last step of the
+                current one. Both experts are on the device for that step.
+            streamers (`dict[str, BlockStreamer]`, *optional*, defaults to None):
+                Block streamers of the experts whose blocks are streamed. A
+                finished expert releases its blocks, and with `prefetch` the
+                first blocks of the next expert are copied during the last step
+                of the current one.
+
+        Used as a context manager, the prefetcher is closed when the block
+        exits, also when sampling fails.
+        """
+        self.experts = experts
+        self.schedule = list(schedule)
+        self.device = torch.device(device)
+        self.offload = offload
+        self.prefetch = prefetch
+        self.streamers = streamers or {}
+
+        # steps after which the expert changes, and the expert that follows
+        self._switch = {
+            i: self.schedule[i + 1]
+            for i in range(len(self.schedule) - 1)
+            if self.schedule[i + 1] != self.schedule[i]
+        }
+        self._on_device = {
+            name for name, module in experts.items()
+            if next(module.parameters()).device == self.device
+        }
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='expert-prefetch'
+        ) if offload and prefetch else None
+        self._pending = {}
+
+    def _load(self, name):
+        module = self.experts[name]
+        if self.device.type == 'cuda':
+            stream = torch.cuda.Stream(self.device)
+            with torch.cuda.stream(stream):
+                module.to(self.device, non_blocking=True)
+            stream.synchronize()
+        else:
+            module.to(self.device)
+        return module
+
+    def _wait(self, name):
+        if name in self._pending:
+            self._pending.pop(name).result()
+        elif name not in self._on_device:
+            self._load(name)
+        self._on_device.add(name)
+
+    def __call__(self, step):
+        r"""
+        Returns the expert of `step` on the device.
+        """
+        name = self.schedule[step]
+        following = self._switch.get(step)
+        if step > 0 and self.schedule[step - 1] != name:
+            # the previous expert is done, drop its per-request caches
+            previous = self.schedule[step - 1]
+            if hasattr(self.experts[previous], 'clear_context_cache'):
+                self.experts[previous].clear_context_cache()
+            if previous in self.streamers:
+                self.streamers[previous].release()
+        if self.prefetch and following in self.streamers:
+            self.streamers[following].prefetch_head()
+        if not self.offload:
+            return self.experts[name]
+
+        for other in list(self._on_device):
+            if other != name:
+                self.experts[other].to('cpu')
+                self._on_device.discard(other)
+        self._wait(name)
+
+        if (self._executor is not None and following is not None and
+                following not in self._on_device and
+                following not in self._pending):
+            self._pending[following] = self._executor.submit(
+                self._load, following)
+        return self.experts[name]
+
+    def close(self):
+        r"""
+        Waits for outstanding moves and stops the worker thread. Calling it
+        again does nothing.
+        """
+        for name in list(self._pending):
+            self._wait(name)
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # a failed run leaves no move in flight and no streamed block behind,
+        # so a long-lived pipeline starts the next run from a known placement
+        try:
+            self.close()
+        finally:
+            if exc_type is not None:
+                for streamer in self.streamers.values():
+                    streamer.release()
@@ -0,0 +1,127 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from safetensors.torch import load_file, save_file
+
+__all__ = ['PromptEmbeddingCache']
+
+
+class PromptEmbeddingCache:
+
+    def __init__(self, max_entries=64, cache_dir=None):
+        r"""
+        Content-addressed cache of text encoder outputs. Entries live in an
+        in-memory LRU and, if `cache_dir` is given, are also persisted as
+        safetensors files so they survive process restarts.
+
+        Args:
+            max_entries (`int`, *optional*, defaults to 64):
+                Capacity of the in-memory tier. 0 disables it.
+            cache_dir (`str`, *optional*, defaults to None):
+                Directory of the on-disk tier. None disables it.
+        """
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(tokenizer, text, text_len, dtype, namespace=''):
+        r"""
+        Builds the cache key of an already cleaned prompt.
+
+        Args:
+            tokenizer (`str`):
+                Tokenizer name or path.
+            text (`str`):
+                Prompt after the tokenizer's cleaning step.
+            text_len (`int`):
+                Maximum token length of the encoder.
+            dtype (`torch.dtype`):
+                Dtype of the encoder output.
+            namespace (`str`, *optional*, defaults to ''):
+                Extra identifier, e.g. the encoder checkpoint name.
+        """
+        payload = json.dumps(
+            [namespace, tokenizer, text, text_len,
+             str(dtype)],
+            ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.safetensors')
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._entries:
+                return True
+        return self.cache_dir is not None and os.path.exists(self._path(key))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        r"""
+        Returns the cached CPU tensor for `key`, or None.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        if self.cache_dir is not None and os.path.exists(self._path(key)):
+            try:
+                value = load_file(self._path(key))['context']
+            except Exception as e:
+                logging.warning(f'Failed to load cached prompt {key}: {e}')
+            else:
+                self._put_memory(key, value)
+                with self._lock:
+                    self.hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        r"""
+        Stores `value` under `key` and returns the stored CPU copy.
+        """
+        value = value.detach().to('cpu').contiguous()
+        self._put_memory(key, value)
+        if self.cache_dir is not None and not os.path.exists(self._path(key)):
+            tmp = self._path(key) + f'.{os.getpid()}.tmp'
+            try:
+                save_file({'context': value}, tmp)
+                os.replace(tmp, self._path(key))
+            except OSError as e:
+                logging.warning(f'Failed to persist prompt {key}: {e}')
+        return value
+
+    def _put_memory(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        r"""
+        Drops the in-memory tier. Files on disk are kept.
+        """
+        with self._lock:
+            self._entries.clear()
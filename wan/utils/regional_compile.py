@@ -0,0 +1,73 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import logging
+import math
+import os
+
+import torch
+
+__all__ = ['compile_blocks', 'seq_len_buckets', 'set_compile_cache_dir']
+
+
+def seq_len_buckets(sizes, vae_stride, patch_size):
+    r"""
+    Tokens per latent frame of every (width, height) in `sizes`, e.g. the
+    `SIZE_CONFIGS` of the task's `SUPPORTED_SIZES`, in ascending order.
+    """
+    return sorted({
+        math.ceil((h // vae_stride[1]) * (w // vae_stride[2]) /
+                  (patch_size[1] * patch_size[2])) for w, h in sizes
+    })
+
+
+def set_compile_cache_dir(cache_dir):
+    r"""
+    Persists compiled kernels and FX graphs in `cache_dir`, so that warm
+    workers load them instead of recompiling. This sets the process wide
+    `TORCHINDUCTOR_CACHE_DIR`, so it is called once at startup (generate.py,
+    `WanWorker`) before anything is compiled. An existing
+    `TORCHINDUCTOR_CACHE_DIR` in the environment takes precedence.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', cache_dir)
+    import torch._inductor.config as inductor_config
+    inductor_config.fx_graph_cache = True
+
+
+def compile_blocks(model, buckets=None, backend='inductor', mode=None):
+    r"""
+    Regional compilation of a DiT: the forward of every transformer block is
+    compiled with static shapes. All blocks share one code object, so a graph
+    compiled for one block is reused by the others and only a new sequence
+    length bucket triggers a recompile.
+
+    Args:
+        model (`nn.Module`):
+            WanModel, WanModel_S2V or WanAnimateModel.
+        buckets (`list[int]`, *optional*, defaults to None):
+            Tokens per latent frame that WanModel pads `seq_len` up to, see
+            `seq_len_buckets`. None compiles every sequence length as is.
+        backend (`str`, *optional*, defaults to 'inductor'):
+            torch.compile backend. 'inductor' also works on CPU.
+        mode (`str`, *optional*, defaults to None):
+            torch.compile mode, e.g. 'max-autotune-no-cudagraphs'.
+
+    Every bucket and number of time segments is a separate graph of the
+    shared code object, so `torch._dynamo.config.cache_size_limit` is raised
+    to hold them. The limit is global to the process and is only ever
+    raised, which also lets other compiled functions keep more graphs. The
+    persistent kernel cache is set up separately with `set_compile_cache_dir`.
+    """
+    # one graph per bucket and per number of time segments
+    limit = 4 * len(buckets or ()) + 8
+    if torch._dynamo.config.cache_size_limit < limit:
+        logging.info(f'Raising torch._dynamo.config.cache_size_limit from '
+                     f'{torch._dynamo.config.cache_size_limit} to {limit}.')
+        torch._dynamo.config.cache_size_limit = limit
+
+    for block in model.blocks:
+        block.forward = torch.compile(
+            block.forward, backend=backend, mode=mode, dynamic=False)
+    model.seq_len_buckets = buckets
+    logging.info(f'Compiled {len(model.blocks)} blocks with {backend}, '
+                 f'seq_len buckets per frame: {buckets}')
+    return model
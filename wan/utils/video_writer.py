@@ -0,0 +1,203 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import logging
+import os
+import queue
+import subprocess
+import threading
+
+import torch
+
+__all__ = ['VideoWriter', 'frames_to_uint8']
+
+
+def frames_to_uint8(frames, value_range=(-1, 1)):
+    r"""
+    Converts a [C, T, H, W] video chunk in `value_range` into [T, H, W, C]
+    uint8 frames on the same device. Matches the rounding of `save_video`.
+    """
+    if frames.dtype == torch.uint8:
+        return frames.permute(1, 2, 3, 0).contiguous()
+    low, high = min(value_range), max(value_range)
+    frames = frames.clamp(low, high).sub_(low).div_(high - low)
+    return frames.mul_(255).to(torch.uint8).permute(1, 2, 3, 0).contiguous()
+
+
+def _ffmpeg_exe():
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return 'ffmpeg'
+
+
+class VideoWriter:
+
+    def __init__(self,
+                 save_file,
+                 fps=16,
+                 audio=None,
+                 value_range=(-1, 1),
+                 crf=18,
+                 max_queue=8):
+        r"""
+        Background H.264 writer. Video chunks are handed over with `write`,
+        converted to uint8 and piped as raw RGB frames into a single ffmpeg
+        process on a worker thread, so encoding overlaps with decoding. An
+        optional audio track is muxed by the same process.
+        As a context manager the video is finalized when the block exits, or
+        aborted with `abort` if it raises.
+
+        Args:
+            save_file (`str`):
+                Output .mp4 path.
+            fps (`int`, *optional*, defaults to 16):
+                Frame rate of the video.
+            audio (`str`, *optional*, defaults to None):
+                Audio file muxed as AAC; the output is cut to the shorter
+                stream.
+            value_range (`tuple[float]`, *optional*, defaults to (-1, 1)):
+                Value range of float chunks.
+            crf (`int`, *optional*, defaults to 18):
+                x264 constant rate factor.
+            max_queue (`int`, *optional*, defaults to 8):
+                Maximum number of pending chunks before `write` blocks.
+        """
+        if audio is not None and not os.path.exists(audio):
+            raise FileNotFoundError(f"audio file {audio} does not exist")
+        save_dir = os.path.dirname(save_file)
+        if save_dir:
+            os.makedirs(save_dir, exist_ok=True)
+        self.save_file = save_file
+        self.fps = fps
+        self.audio = audio
+        self.value_range = value_range
+        self.crf = crf
+        self.num_frames = 0
+
+        self._proc = None
+        self._error = None
+        self._closed = False
+        self._aborted = False
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(
+            target=self._run, name='video-writer', daemon=True)
+        self._thread.start()
+
+    def _command(self, width, height):
+        command = [
+            _ffmpeg_exe(), '-y', '-loglevel', 'error', '-f', 'rawvideo',
+            '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r',
+            str(self.fps), '-i', '-'
+        ]
+        if self.audio is not None:
+            command += ['-i', self.audio]
+        command += ['-map', '0:v:0']
+        if self.audio is not None:
+            command += [
+                '-map', '1:a:0', '-c:a', 'aac', '-b:a', '192k', '-shortest'
+            ]
+        command += [
+            '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-crf',
+            str(self.crf), self.save_file
+        ]
+        return command
+
+    def _run(self):
+        while True:
+            frames = self._queue.get()
+            if frames is None:
+                break
+            if self._error is not None or self._aborted:
+                continue
+            try:
+                frames = frames.cpu().numpy()
+                if self._proc is None:
+                    _, height, width, _ = frames.shape
+                    self._proc = subprocess.Popen(
+                        self._command(width, height),
+                        stdin=subprocess.PIPE,
+                        stderr=subprocess.PIPE)
+                self._proc.stdin.write(frames.tobytes())
+            except Exception as e:
+                self._error = e
+
+    def write(self, chunk):
+        r"""
+        Queues a video chunk of shape [C, T, H, W], either float in
+        `value_range` or uint8, on any device.
+        """
+        if self._closed:
+            raise RuntimeError('VideoWriter is closed.')
+        if self._error is not None:
+            raise RuntimeError(f'VideoWriter failed: {self._error}')
+        frames = frames_to_uint8(chunk.detach(), self.value_range)
+        self.num_frames += frames.size(0)
+        self._queue.put(frames)
+
+    def close(self):
+        r"""
+        Waits until all chunks are encoded and the file is finalized. Returns
+        the output path.
+        """
+        if self._closed:
+            return self.save_file
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+        stderr = b''
+        if self._proc is not None:
+            try:
+                self._proc.stdin.close()
+            except OSError:
+                pass
+            stderr = self._proc.stderr.read()
+            self._proc.wait()
+            if self._proc.returncode != 0 and self._error is None:
+                self._error = RuntimeError(
+                    f'ffmpeg exited with {self._proc.returncode}')
+        if self._error is not None:
+            raise RuntimeError(
+                f'Failed to write {self.save_file}: {self._error} '
+                f'{stderr.decode(errors="ignore")}')
+        logging.info(f'Wrote {self.num_frames} frames to {self.save_file}')
+        return self.save_file
+
+    def abort(self):
+        r"""
+        Stops ffmpeg without finalizing the video and removes the partial
+        output file, for when generation fails. Does nothing once closed.
+        """
+        if self._closed:
+            return
+        self._closed = self._aborted = True
+        # killing ffmpeg unblocks a worker thread stuck writing to its pipe
+        if self._proc is not None:
+            self._proc.kill()
+        self._queue.put(None)
+        self._thread.join()
+        if self._proc is None:
+            return
+        self._proc.kill()
+        self._proc.wait()
+        for pipe in (self._proc.stdin, self._proc.stderr):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        try:
+            os.remove(self.save_file)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f'Could not remove {self.save_file}: {e}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # on an error the truncated video is dropped and the error propagates
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,412 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import gc
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import ExitStack
+
+import torch
+
+from .configs import MAX_AREA_CONFIGS, SIZE_CONFIGS, WAN_CONFIGS
+from .image2video import WanI2V
+from .text2video import WanT2V
+from .textimage2video import WanTI2V
+from .utils.regional_compile import set_compile_cache_dir
+from .utils.video_writer import VideoWriter
+
+__all__ = ['GenerationJob', 'WanWorker', 'parse_size']
+
+WORKER_PIPELINES = {
+    't2v-A14B': WanT2V,
+    'i2v-A14B': WanI2V,
+    'ti2v-5B': WanTI2V,
+}
+
+
+def parse_size(size):
+    r"""
+    Converts a 'width*height' string into a `(width, height)` tuple and the
+    matching maximum pixel area.
+    """
+    if size in SIZE_CONFIGS:
+        return SIZE_CONFIGS[size], MAX_AREA_CONFIGS[size]
+    try:
+        w, h = (int(v) for v in size.split('*'))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid size '{size}', expected 'width*height'.")
+    return (w, h), w * h
+
+
+class GenerationJob:
+
+    def __init__(self,
+                 task,
+                 prompt,
+                 size='1280*704',
+                 img=None,
+                 frame_num=None,
+                 shift=None,
+                 sample_solver='unipc',
+                 sampling_steps=None,
+                 guide_scale=None,
+                 n_prompt="",
+                 seed=-1,
+                 save_file=None,
+                 on_start=None):
+        r"""
+        A single generation request handled by `WanWorker`.
+
+        Args:
+            task (`str`):
+                Task name, one of the keys of `WORKER_PIPELINES`.
+            prompt (`str`):
+                Text prompt for content generation.
+            size (`str`, *optional*, defaults to '1280*704'):
+                Video resolution as 'width*height'. For image conditioned tasks
+                it only bounds the pixel area.
+            img (PIL.Image.Image, *optional*, defaults to None):
+                Conditioning image for i2v-A14B and ti2v-5B.
+            frame_num, shift, sampling_steps, guide_scale (*optional*):
+                Sampling parameters. `None` falls back to the task config.
+            sample_solver (`str`, *optional*, defaults to 'unipc'):
+                Solver used to sample the video.
+            n_prompt (`str`, *optional*, defaults to ""):
+                Negative prompt. If empty, use `config.sample_neg_prompt`.
+            seed (`int`, *optional*, defaults to -1):
+                Random seed for noise generation. If -1, use random seed.
+            save_file (`str`, *optional*, defaults to None):
+                If given, the video is written to this path on the worker.
+            on_start (`callable`, *optional*, defaults to None):
+                Called with the job when the worker starts processing it.
+        """
+        if task not in WORKER_PIPELINES:
+            raise NotImplementedError(f"Unsupport task for worker: {task}")
+        cfg = WAN_CONFIGS[task]
+        self.task = task
+        self.prompt = prompt
+        self.size, self.max_area = parse_size(size)
+        self.img = img
+        self.frame_num = frame_num or cfg.frame_num
+        self.shift = shift if shift is not None else cfg.sample_shift
+        self.sample_solver = sample_solver
+        self.sampling_steps = sampling_steps or cfg.sample_steps
+        self.guide_scale = guide_scale if guide_scale is not None else cfg.sample_guide_scale
+        self.n_prompt = n_prompt
+        self.seed = seed
+        self.save_file = save_file
+        self.on_start = on_start
+
+        # outputs
+        self.video = None
+        self.started_at = None
+        self.finished_at = None
+        self.future = Future()
+
+    @property
+    def batch_key(self):
+        r"""
+        Jobs with an equal, non-None key can share a batched sampling loop.
+        """
+        if self.task != 'ti2v-5B' or self.img is not None:
+            return None
+        return (self.task, self.size, self.frame_num, self.shift,
+                self.sample_solver, self.sampling_steps)
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+
+class WanWorker:
+
+    def __init__(self,
+                 checkpoint_dirs,
+                 device_id=0,
+                 t5_cpu=False,
+                 convert_model_dtype=False,
+                 offload_model=True,
+                 max_pipelines=1,
+                 keep_video=True,
+                 batch_cfg=False,
+                 max_batch_size=1,
+                 pipelines=None,
+                 start=True):
+        r"""
+        Long-lived inference worker that keeps Wan pipelines warm between
+        requests. Jobs are processed from an in-process queue on a background
+        thread, so T5, the VAE and the DiT weights are loaded once per worker
+        instead of once per request.
+
+        Args:
+            checkpoint_dirs (`dict[str, str]`):
+                Mapping from task name to its checkpoint directory.
+            device_id (`int`, *optional*, defaults to 0):
+                Id of target GPU device.
+            t5_cpu (`bool`, *optional*, defaults to False):
+                Whether to place T5 model on CPU.
+            convert_model_dtype (`bool`, *optional*, defaults to False):
+                Convert DiT model parameters dtype to 'config.param_dtype'.
+            offload_model (`bool`, *optional*, defaults to True):
+                If True, offloads models to CPU between sampling stages.
+            max_pipelines (`int`, *optional*, defaults to 1):
+                How many task pipelines are kept loaded at the same time. The
+                least recently used pipeline is released when exceeded.
+            keep_video (`bool`, *optional*, defaults to True):
+                Keep the decoded video tensor on the finished job. Disable when
+                only `save_file` is needed.
+            batch_cfg (`bool`, *optional*, defaults to False):
+                Run the conditional and unconditional passes as one batched
+                forward per step.
+            max_batch_size (`int`, *optional*, defaults to 1):
+                Maximum number of compatible queued ti2v-5B text-to-video jobs
+                (same size, frame count, shift, solver and step count) that are
+                sampled together in one batched denoising loop.
+            pipelines (`dict[str, object]`, *optional*, defaults to None):
+                Already built pipelines by task name, used instead of loading
+                them from `checkpoint_dirs`. They count towards
+                `max_pipelines`.
+            start (`bool`, *optional*, defaults to True):
+                Start the worker thread. Otherwise queued jobs are only
+                processed once `start` is called.
+        """
+        self.checkpoint_dirs = dict(checkpoint_dirs)
+        self.device_id = device_id
+        self.t5_cpu = t5_cpu
+        self.convert_model_dtype = convert_model_dtype
+        self.offload_model = offload_model
+        self.max_pipelines = max(1, max_pipelines)
+        self.keep_video = keep_video
+        self.batch_cfg = batch_cfg
+        self.max_batch_size = max(1, max_batch_size)
+
+        # the persistent compile cache is process wide, set up once here
+        for task in self.checkpoint_dirs:
+            cfg = WAN_CONFIGS[task]
+            if cfg.compile_blocks and cfg.compile_cache_dir is not None:
+                set_compile_cache_dir(cfg.compile_cache_dir)
+                break
+
+        self._pipelines = OrderedDict(pipelines or {})
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name='wan-worker', daemon=True)
+        if start:
+            self.start()
+
+    def start(self):
+        r"""
+        Starts the worker thread, see the `start` argument.
+        """
+        self._thread.start()
+
+    def get_pipeline(self, task):
+        r"""
+        Returns the pipeline for `task`, building it on first use.
+        """
+        with self._lock:
+            if task in self._pipelines:
+                self._pipelines.move_to_end(task)
+                return self._pipelines[task]
+
+            if task not in self.checkpoint_dirs:
+                raise ValueError(f"No checkpoint directory given for {task}")
+            while len(self._pipelines) >= self.max_pipelines:
+                evicted, pipeline = self._pipelines.popitem(last=False)
+                logging.info(f"Releasing {evicted} pipeline.")
+                if hasattr(pipeline, 'remove_block_streamers'):
+                    pipeline.remove_block_streamers()
+                # drop the last reference before returning the cached blocks
+                del pipeline
+                gc.collect()
+                torch.cuda.empty_cache()
+
+            logging.info(f"Creating {task} pipeline.")
+            pipeline = WORKER_PIPELINES[task](
+                config=WAN_CONFIGS[task],
+                checkpoint_dir=self.checkpoint_dirs[task],
+                device_id=self.device_id,
+                rank=0,
+                t5_cpu=self.t5_cpu,
+                convert_model_dtype=self.convert_model_dtype,
+            )
+            self._pipelines[task] = pipeline
+            return pipeline
+
+    def warmup(self, task):
+        r"""
+        Builds the pipeline for `task` on the worker thread ahead of the first
+        request. Returns a future that resolves once the weights are loaded.
+        """
+        future = Future()
+        self._put((self.get_pipeline, task, future))
+        return future
+
+    def submit(self, task, prompt, **kwargs):
+        r"""
+        Queues a generation request and returns its `GenerationJob`. The job's
+        `future` resolves to the job itself once `video` / `save_file` are set.
+        Keyword arguments are forwarded to `GenerationJob`.
+        """
+        job = GenerationJob(task, prompt, **kwargs)
+        self._put(job)
+        return job
+
+    def generate(self, task, prompt, timeout=None, **kwargs):
+        r"""
+        Blocking variant of `submit`.
+        """
+        return self.submit(task, prompt, **kwargs).future.result(timeout)
+
+    def qsize(self):
+        with self._cond:
+            return len(self._pending)
+
+    def close(self, wait=True):
+        self._put(None)
+        if wait and self._thread.is_alive():
+            self._thread.join()
+
+    def _put(self, item):
+        with self._cond:
+            self._pending.append(item)
+            self._cond.notify()
+
+    def _take(self):
+        r"""
+        Pops the next work item. A `GenerationJob` is returned together with
+        every compatible pending job, up to `max_batch_size`, so they can share
+        one sampling loop.
+        """
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            item = self._pending.popleft()
+            if not isinstance(item, GenerationJob):
+                return item
+            jobs = [item]
+            key = item.batch_key
+            if key is not None and self.max_batch_size > 1:
+                for other in list(self._pending):
+                    if len(jobs) >= self.max_batch_size:
+                        break
+                    if isinstance(other, GenerationJob
+                                 ) and other.batch_key == key:
+                        self._pending.remove(other)
+                        jobs.append(other)
+            return jobs
+
+    def _run(self):
+        while True:
+            item = self._take()
+            if item is None:
+                break
+            if isinstance(item, list):
+                jobs = [
+                    job for job in item
+                    if job.future.set_running_or_notify_cancel()
+                ]
+                if not jobs:
+                    continue
+                try:
+                    self._process(jobs)
+                    for job in jobs:
+                        job.future.set_result(job)
+                except BaseException as e:
+                    logging.exception("Worker job failed.")
+                    for job in jobs:
+                        job.future.set_exception(e)
+                continue
+            fn, arg, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(arg))
+            except BaseException as e:
+                logging.exception("Worker call failed.")
+                future.set_exception(e)
+
+    def _process(self, jobs):
+        for job in jobs:
+            job.started_at = time.time()
+            if job.on_start is not None:
+                job.on_start(job)
+        # the decoded chunks are streamed to ffmpeg while the VAE is still
+        # decoding; the writers are closed even if sampling fails
+        with ExitStack() as stack:
+            writers = [
+                stack.enter_context(
+                    VideoWriter(
+                        job.save_file, fps=WAN_CONFIGS[job.task].sample_fps))
+                if job.save_file is not None else None for job in jobs
+            ]
+            job = jobs[0]
+            pipeline = self.get_pipeline(job.task)
+            kwargs = dict(
+                frame_num=job.frame_num,
+                shift=job.shift,
+                sample_solver=job.sample_solver,
+                sampling_steps=job.sampling_steps,
+                offload_model=self.offload_model,
+                batch_cfg=self.batch_cfg)
+            if len(jobs) > 1:
+                logging.info(
+                    f"Sampling {len(jobs)} {job.task} jobs as one batch.")
+                videos = pipeline.t2v_batch(
+                    [j.prompt for j in jobs],
+                    size=job.size,
+                    guide_scale=[j.guide_scale for j in jobs],
+                    n_prompts=[j.n_prompt for j in jobs],
+                    seeds=[j.seed for j in jobs],
+                    video_writers=writers,
+                    **kwargs)
+            elif isinstance(pipeline, WanTI2V):
+                videos = [
+                    pipeline.generate(
+                        job.prompt,
+                        img=job.img,
+                        size=job.size,
+                        max_area=job.max_area,
+                        guide_scale=job.guide_scale,
+                        n_prompt=job.n_prompt,
+                        seed=job.seed,
+                        video_writer=writers[0],
+                        **kwargs)
+                ]
+            elif isinstance(pipeline, WanI2V):
+                if job.img is None:
+                    raise ValueError("i2v-A14B requires an input image.")
+                videos = [
+                    pipeline.generate(
+                        job.prompt,
+                        job.img,
+                        max_area=job.max_area,
+                        guide_scale=job.guide_scale,
+                        n_prompt=job.n_prompt,
+                        seed=job.seed,
+                        video_writer=writers[0],
+                        **kwargs)
+                ]
+            else:
+                videos = [
+                    pipeline.generate(
+                        job.prompt,
+                        size=job.size,
+                        guide_scale=job.guide_scale,
+                        n_prompt=job.n_prompt,
+                        seed=job.seed,
+                        video_writer=writers[0],
+                        **kwargs)
+                ]
+
+        for job, video in zip(jobs, videos):
+            if self.keep_video:
+                job.video = video.cpu()
+            job.finished_at = time.time()
+            logging.info(f"Finished {job.task} job in {job.elapsed:.1f}s.")
+        del videos